@@ -0,0 +1,740 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmark for process_picker_metadata.py
+
+Runs the real session-processing code against local stand-ins, so throughput
+can be measured without Google or Azure accounts:
+
+- A fake Photos Picker API serving paged /mediaItems and baseUrl downloads of
+  a configurable size, with optional latency and injected 429 throttling.
+- An in-process Azure Blob Storage stand-in speaking enough of the REST API
+  for the SDK calls the script makes, or a real Azurite instance (--azurite).
+
+Each case (item count x payload size x workers) runs in a fresh process so its
+peak RSS is its own. Results are printed as a table, optionally written to
+JSON, and compared against an earlier results file to flag regressions.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS in the results
+    resource = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Azurite's well-known development account
+AZURITE_ACCOUNT_NAME = 'devstoreaccount1'
+AZURITE_ACCOUNT_KEY = (
+    'Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRz6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=='
+)
+
+# Blobs larger than this are counted but not kept by the in-process stand-in
+STAND_IN_BODY_LIMIT = 1024 * 1024
+
+# Default benchmark matrix
+DEFAULT_ITEMS = '50,200'
+DEFAULT_SIZES_KB = '256,4096'
+DEFAULT_WORKERS = '1,4,8'
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_TOLERANCE = 0.15
+
+
+class FakePickerHandler(BaseHTTPRequestHandler):
+    """
+    Photos Picker API stand-in.
+    
+    Session IDs encode the case as bench-<items>-<bytes>, so the server needs
+    no per-case state: /mediaItems pages through that many items and each
+    baseUrl serves that many bytes, honouring Range requests.
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, *args) -> None:
+        pass
+    
+    def do_GET(self) -> None:
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle_rate and server.random.random() < server.throttle_rate:
+            server.throttled += 1
+            self._send(429, b'{"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}',
+                       {'Retry-After': f'{server.retry_after:g}'})
+            return
+        
+        url = urlparse(self.path)
+        if url.path.endswith('/mediaItems'):
+            self._media_items(parse_qs(url.query))
+        elif url.path.startswith('/media/'):
+            _, _, size, name = url.path.split('/', 3)
+            self._media(int(size), int(name.split('=')[0]))
+        else:
+            self._send(404, b'{"error": {"code": 404}}')
+    
+    def _media_items(self, query: Dict[str, List[str]]) -> None:
+        _, count, size = query['sessionId'][0].split('-')
+        start = int(query.get('pageToken', ['0'])[0])
+        end = min(start + self.server.page_size, int(count))
+        base = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        page = {
+            'mediaItems': [
+                {
+                    'id': f'item-{i}',
+                    'mediaFile': {
+                        'filename': f'bench-{i:05d}.jpg',
+                        'baseUrl': f'{base}/media/{size}/{i}',
+                        'mimeType': 'image/jpeg',
+                    },
+                }
+                for i in range(start, end)
+            ]
+        }
+        if end < int(count):
+            page['nextPageToken'] = str(end)
+        self._send(200, json.dumps(page).encode(), {'Content-Type': 'application/json'})
+    
+    def _media(self, size: int, index: int) -> None:
+        server = self.server
+        body = memoryview(server.payload(size, index))
+        headers = {'Content-Type': 'image/jpeg', 'Accept-Ranges': 'bytes'}
+        byte_range = self.headers.get('Range')
+        if byte_range:
+            start, end = byte_range.split('=', 1)[1].split('-')
+            start, end = int(start), min(int(end or size - 1), size - 1)
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            status, body = 206, body[start:end + 1]
+        else:
+            status = 200
+        if server.drop_rate and len(body) > 1 and server.random.random() < server.drop_rate:
+            server.dropped += 1
+            self._send(status, body, headers, cut_at=len(body) // 2)
+        else:
+            self._send(status, body, headers)
+    
+    def _send(self, status: int, body, headers: Optional[Dict[str, str]] = None,
+              cut_at: Optional[int] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            if cut_at is None:
+                self.wfile.write(body)
+            else:
+                # Break the connection part-way through the body
+                self.wfile.write(body[:cut_at])
+                self.close_connection = True
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def fake_payload(body: bytes, index: int) -> bytes:
+    return index.to_bytes(8, 'big')[:len(body)] + body[8:]
+
+
+class FakePickerServer(ThreadingHTTPServer):
+    """Threaded fake Picker API with shared payload buffers, throttle and drop counters."""
+    
+    daemon_threads = True
+    
+    def __init__(self, page_size: int, latency: float, throttle_rate: float, retry_after: float,
+                 drop_rate: float = 0):
+        super().__init__(('127.0.0.1', 0), FakePickerHandler)
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.drop_rate = drop_rate
+        self.throttled = 0
+        self.dropped = 0
+        self.random = random.Random(0)
+        self._payloads = {}
+        self._lock = threading.Lock()
+    
+    def handle_error(self, request, client_address) -> None:
+        # A client hanging up mid-response is expected, e.g. when a run is cancelled
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+    
+    def payload(self, size: int, index: int) -> bytes:
+        """Deterministic body per (size, index); only the first 8 bytes differ between items."""
+        with self._lock:
+            if size not in self._payloads:
+                self._payloads[size] = random.Random(size).randbytes(size)
+        return fake_payload(self._payloads[size], index)
+    
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class BlobStandInHandler(BaseHTTPRequestHandler):
+    """
+    Minimal Azure Blob REST stand-in for the calls process_picker_metadata makes.
+    
+    Supports container create/delete/list (flat or by delimiter), Put Blob, Put Block, Put Block
+    List, Get Blob (with ranges), Get/Set Blob Properties, Delete Blob and
+    synchronous Copy Blob, including If-Match / If-None-Match conditions (a
+    Get Blob whose ETag matches If-None-Match returns 304) and x-ms-meta-*
+    metadata. Authorization headers are accepted without checks.
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, *args) -> None:
+        pass
+    
+    def _target(self) -> Tuple[str, Optional[str], Dict[str, List[str]]]:
+        url = urlparse(self.path)
+        parts = url.path.lstrip('/').split('/', 2)
+        container = parts[1] if len(parts) > 1 else ''
+        blob = unquote(parts[2]) if len(parts) > 2 and parts[2] else None
+        return container, blob, parse_qs(url.query)
+    
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+    
+    def _send(self, status: int, headers: Optional[Dict[str, str]] = None, body: bytes = b'') -> None:
+        self.send_response(status)
+        self.send_header('x-ms-request-id', str(self.server.next_id()))
+        self.send_header('x-ms-version', self.headers.get('x-ms-version', '2021-08-06'))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    def _error(self, status: int, code: str) -> None:
+        body = f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'
+        self._send(status, {'x-ms-error-code': code, 'Content-Type': 'application/xml'}, body.encode())
+    
+    def _blob_headers(self, blob: Dict) -> Dict[str, str]:
+        headers = {
+            'ETag': blob['etag'],
+            'Last-Modified': blob['last_modified'],
+            'x-ms-creation-time': blob['last_modified'],
+            'x-ms-blob-type': 'BlockBlob',
+            'Content-Type': blob['content_type'],
+            'Accept-Ranges': 'bytes',
+        }
+        if blob['content_md5']:
+            headers['Content-MD5'] = blob['content_md5']
+        if blob['cache_control']:
+            headers['Cache-Control'] = blob['cache_control']
+        for key, value in blob['metadata'].items():
+            headers[f'x-ms-meta-{key}'] = value
+        return headers
+    
+    def _conditions_fail(self, existing: Optional[Dict]) -> bool:
+        if_match = self.headers.get('If-Match')
+        if if_match and (not existing or if_match not in ('*', existing['etag'])):
+            self._error(412, 'ConditionNotMet')
+            return True
+        if self.headers.get('If-None-Match') == '*' and existing:
+            self._error(409, 'BlobAlreadyExists')
+            return True
+        return False
+    
+    def _store(self, container: Dict, name: str, data: bytes, status: int = 201) -> None:
+        blob = {
+            'size': len(data),
+            'body': data if self.server.body_limit is None or len(data) <= self.server.body_limit else None,
+            'etag': f'"0x{self.server.next_id():016X}"',
+            'last_modified': formatdate(usegmt=True),
+            'content_type': self.headers.get('x-ms-blob-content-type', 'application/octet-stream'),
+            'content_md5': self.headers.get('x-ms-blob-content-md5'),
+            'cache_control': self.headers.get('x-ms-blob-cache-control'),
+            'metadata': {
+                key[len('x-ms-meta-'):]: value
+                for key, value in self.headers.items()
+                if key.lower().startswith('x-ms-meta-')
+            },
+        }
+        container[name] = blob
+        self.server.bytes_stored += len(data)
+        self._send(status, {
+            'ETag': blob['etag'],
+            'Last-Modified': blob['last_modified'],
+            'Content-MD5': base64.b64encode(hashlib.md5(data).digest()).decode(),
+            'x-ms-request-server-encrypted': 'true',
+        })
+    
+    def do_PUT(self) -> None:
+        container_name, name, query = self._target()
+        data = self._body()
+        with self.server.lock:
+            containers = self.server.containers
+            if query.get('restype') == ['container'] and name is None:
+                if container_name in containers:
+                    return self._error(409, 'ContainerAlreadyExists')
+                containers[container_name] = {}
+                self.server.blocks[container_name] = {}
+                return self._send(201, {'ETag': '"0x1"', 'Last-Modified': formatdate(usegmt=True)})
+            
+            container = containers.get(container_name)
+            if container is None:
+                return self._error(404, 'ContainerNotFound')
+            comp = query.get('comp', [''])[0]
+            
+            if comp == 'block':
+                block_id = query['blockid'][0]
+                self.server.blocks[container_name].setdefault(name, {})[block_id] = data
+                return self._send(201)
+            
+            if self._conditions_fail(container.get(name)):
+                return
+            
+            if comp == 'properties':
+                blob = container.get(name)
+                if blob is None:
+                    return self._error(404, 'BlobNotFound')
+                blob.update({
+                    'etag': f'"0x{self.server.next_id():016X}"',
+                    'last_modified': formatdate(usegmt=True),
+                    'content_type': self.headers.get('x-ms-blob-content-type', 'application/octet-stream'),
+                    'content_md5': self.headers.get('x-ms-blob-content-md5'),
+                    'cache_control': self.headers.get('x-ms-blob-cache-control'),
+                })
+                return self._send(200, {'ETag': blob['etag'], 'Last-Modified': blob['last_modified']})
+            
+            if comp == 'blocklist':
+                staged = self.server.blocks[container_name].pop(name, {})
+                block_ids = [element.text for element in ElementTree.fromstring(data)]
+                if any(block_id not in staged for block_id in block_ids):
+                    return self._error(400, 'InvalidBlockList')
+                return self._store(container, name, b''.join(staged[block_id] for block_id in block_ids))
+            
+            copy_source = self.headers.get('x-ms-copy-source')
+            if copy_source:
+                source_container, source_name, _ = self._target_of(copy_source)
+                source = containers.get(source_container, {}).get(source_name)
+                if source is None:
+                    return self._error(404, 'CannotVerifyCopySource')
+                container[name] = dict(source, etag=f'"0x{self.server.next_id():016X}"')
+                return self._send(202, {
+                    'ETag': container[name]['etag'],
+                    'Last-Modified': container[name]['last_modified'],
+                    'x-ms-copy-id': str(self.server.next_id()),
+                    'x-ms-copy-status': 'success',
+                })
+            
+            self._store(container, name, data)
+    
+    def _target_of(self, url: str) -> Tuple[str, Optional[str], Dict[str, List[str]]]:
+        path, self.path = self.path, urlparse(url)._replace(scheme='', netloc='').geturl()
+        try:
+            return self._target()
+        finally:
+            self.path = path
+    
+    def do_HEAD(self) -> None:
+        container_name, name, _ = self._target()
+        with self.server.lock:
+            blob = self.server.containers.get(container_name, {}).get(name)
+        if blob is None:
+            return self._send(404, {'x-ms-error-code': 'BlobNotFound'})
+        self._send(200, dict(self._blob_headers(blob), **{'Content-Length': str(blob['size'])}))
+    
+    def do_GET(self) -> None:
+        container_name, name, query = self._target()
+        with self.server.lock:
+            container = self.server.containers.get(container_name)
+            if container is None:
+                return self._error(404, 'ContainerNotFound')
+            if name is None and query.get('comp') == ['list']:
+                return self._list(
+                    container_name, container, query.get('prefix', [''])[0], query.get('delimiter', [''])[0]
+                )
+            blob = container.get(name)
+        
+        if blob is None:
+            return self._error(404, 'BlobNotFound')
+        if blob['body'] is None:
+            return self._error(501, 'BodyNotRetainedByStandIn')
+        headers = self._blob_headers(blob)
+        if self.headers.get('If-None-Match') in ('*', blob['etag']):
+            return self._send(304, {'ETag': blob['etag']})
+        body = blob['body']
+        byte_range = self.headers.get('x-ms-range') or self.headers.get('Range')
+        if byte_range and body:
+            start, end = byte_range.split('=', 1)[1].split('-')
+            start, end = int(start), min(int(end or len(body) - 1), len(body) - 1)
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+            return self._send(206, headers, body[start:end + 1])
+        self._send(200, headers, body)
+    
+    def _list(self, container_name: str, container: Dict, prefix: str, delimiter: str = '') -> None:
+        entries = []
+        seen_prefixes = set()
+        for name in sorted(container):
+            if not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix):]:
+                sub_prefix = name[:name.index(delimiter, len(prefix)) + len(delimiter)]
+                if sub_prefix not in seen_prefixes:
+                    seen_prefixes.add(sub_prefix)
+                    entries.append(f"<BlobPrefix><Name>{escape(sub_prefix)}</Name></BlobPrefix>")
+                continue
+            blob = container[name]
+            metadata = ''.join(f'<{key}>{escape(value)}</{key}>' for key, value in blob['metadata'].items())
+            entries.append(
+                f"<Blob><Name>{escape(name)}</Name><Properties>"
+                f"<Last-Modified>{blob['last_modified']}</Last-Modified>"
+                f"<Etag>{blob['etag']}</Etag>"
+                f"<Content-Length>{blob['size']}</Content-Length>"
+                f"<Content-Type>{escape(blob['content_type'])}</Content-Type>"
+                f"<Content-MD5>{blob['content_md5'] or ''}</Content-MD5>"
+                f"<BlobType>BlockBlob</BlobType></Properties>"
+                f"<Metadata>{metadata}</Metadata></Blob>"
+            )
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<EnumerationResults ContainerName="{escape(container_name)}">'
+            f'<Prefix>{escape(prefix)}</Prefix><Delimiter>{escape(delimiter)}</Delimiter>'
+            f'<Blobs>{"".join(entries)}</Blobs><NextMarker />'
+            '</EnumerationResults>'
+        )
+        self._send(200, {'Content-Type': 'application/xml'}, body.encode())
+    
+    def do_DELETE(self) -> None:
+        container_name, name, query = self._target()
+        with self.server.lock:
+            if name is None and query.get('restype') == ['container']:
+                if self.server.containers.pop(container_name, None) is None:
+                    return self._error(404, 'ContainerNotFound')
+                self.server.blocks.pop(container_name, None)
+                return self._send(202)
+            if self.server.containers.get(container_name, {}).pop(name, None) is None:
+                return self._error(404, 'BlobNotFound')
+        self._send(202)
+
+
+class BlobStandInServer(ThreadingHTTPServer):
+    """Threaded in-process Blob Storage stand-in holding containers in memory."""
+    
+    daemon_threads = True
+    
+    def __init__(self, body_limit: Optional[int] = STAND_IN_BODY_LIMIT):
+        super().__init__(('127.0.0.1', 0), BlobStandInHandler)
+        self.body_limit = body_limit
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.blocks = {}
+        self.bytes_stored = 0
+        self._ids = iter(range(1, sys.maxsize))
+    
+    def handle_error(self, request, client_address) -> None:
+        # A client hanging up mid-response is expected, e.g. when a run is cancelled
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+    
+    def next_id(self) -> int:
+        return next(self._ids)
+    
+    @property
+    def account_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/{AZURITE_ACCOUNT_NAME}"
+
+
+def start_server(server: ThreadingHTTPServer) -> ThreadingHTTPServer:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(case: Dict, picker_url: str, azure_config: Dict, options: Dict) -> Dict:
+    """
+    Process one benchmark session with the real script, in the current process.
+    
+    Runs in a fresh child process per case, so peak RSS covers only this case.
+    
+    Args:
+        case: items, size and workers for this case
+        picker_url: Base URL of the fake Picker API
+        azure_config: Azure config pointing at the stand-in or Azurite
+        options: Extra keyword arguments for process_picker_session_with_token
+    
+    Returns:
+        Dict of measurements for the case
+    """
+    import process_picker_metadata as picker
+    
+    logging.getLogger().setLevel(logging.INFO if options.pop('verbose') else logging.WARNING)
+    verify_content = options.pop('verify_content', False)
+    same_name = options.get('custom_filename')
+    picker.PICKER_API_BASE = picker_url
+    rss_at_start = peak_rss_bytes()
+    
+    pool_size = max(picker.DEFAULT_POOL_SIZE, case['workers'])
+    with picker.ClientContext(azure_config, pool_size) as clients, tempfile.TemporaryDirectory() as data_dir:
+        # Keep the site's _data manifests out of benchmark runs
+        picker.ALIAS_MANIFEST_FILE = Path(data_dir) / picker.ALIAS_MANIFEST_FILE.name
+        picker.RENDITION_MANIFEST_FILE = Path(data_dir) / picker.RENDITION_MANIFEST_FILE.name
+        clients.container_client.create_container()
+        try:
+            start = time.monotonic()
+            ok = picker.process_picker_session_with_token(
+                f"bench-{case['items']}-{case['size']}", 'bench-token', clients,
+                workers=case['workers'], **options
+            )
+            seconds = time.monotonic() - start
+            report = clients.metrics.report((clients.google_limiter, clients.azure_limiter))
+            if same_name:
+                ok = check_stored_hash(clients, same_name) and ok
+            if verify_content:
+                ok = check_downloaded_hashes(clients, case['size']) and ok
+        finally:
+            clients.container_client.delete_container()
+    
+    total_bytes = case['items'] * case['size']
+    return dict(
+        case,
+        ok=ok,
+        seconds=round(seconds, 3),
+        first_upload_sec=report['items']['first_upload_seconds'],
+        items_per_sec=round(case['items'] / seconds, 2),
+        mb_per_sec=round(total_bytes / seconds / (1024 * 1024), 2),
+        peak_rss_mb=round(peak_rss_bytes() / (1024 * 1024), 1) if resource else None,
+        start_rss_mb=round(rss_at_start / (1024 * 1024), 1) if resource else None,
+        retries=sum(service['retries'] for service in report['services'].values()),
+        throttled=sum(service['throttled'] for service in report['services'].values()),
+        stages={
+            stage: {key: data[key] for key in ('count', 'seconds', 'p50', 'p99')}
+            for stage, data in report['stages'].items()
+        },
+    )
+
+
+def check_stored_hash(clients, blob_name: str) -> bool:
+    """True if a blob's content matches the sha256 recorded in its metadata."""
+    import process_picker_metadata as picker
+    
+    download = clients.container_client.get_blob_client(blob_name).download_blob()
+    digest = hashlib.sha256()
+    for chunk in download.chunks():
+        digest.update(chunk)
+    recorded = (download.properties.metadata or {}).get(picker.HASH_METADATA_KEY)
+    if recorded != digest.hexdigest():
+        logger.error(f"{blob_name}: recorded sha256 {recorded} does not match its content {digest.hexdigest()}")
+        return False
+    return True
+
+
+def check_downloaded_hashes(clients, size: int) -> bool:
+    """True if every stored item's recorded sha256 matches the body the fake Picker API served."""
+    import process_picker_metadata as picker
+    
+    body = random.Random(size).randbytes(size)
+    ok = True
+    for blob in clients.container_client.list_blobs(include=['metadata']):
+        match = re.search(r'bench-(\d+)\.jpg$', blob.name)
+        if not match:
+            continue
+        expected = hashlib.sha256(fake_payload(body, int(match.group(1)))).hexdigest()
+        recorded = (blob.metadata or {}).get(picker.HASH_METADATA_KEY)
+        if recorded != expected:
+            logger.error(f"{blob.name}: recorded sha256 {recorded} does not match the served body {expected}")
+            ok = False
+    return ok
+
+
+def run_case_in_child(case: Dict, picker_url: str, azure_config: Dict, options: Dict) -> Dict:
+    """Run a case in a spawned process and return its measurements."""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, (case, picker_url, azure_config, dict(options)))
+
+
+def case_key(result: Dict) -> str:
+    return f"{result['items']}x{result['size']}B/w{result['workers']}"
+
+
+def compare_with_baseline(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Compare results with an earlier run.
+    
+    Returns:
+        Descriptions of cases that got slower or bigger beyond tolerance
+    """
+    previous = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if not old:
+            continue
+        if result['items_per_sec'] < old['items_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f"{case_key(result)}: {old['items_per_sec']} -> {result['items_per_sec']} items/sec"
+            )
+        if old.get('peak_rss_mb') and result.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(
+                f"{case_key(result)}: peak RSS {old['peak_rss_mb']} -> {result['peak_rss_mb']} MB"
+            )
+    return regressions
+
+
+def log_results(results: List[Dict]) -> None:
+    logger.info(f"\n{'items':>6} {'size KB':>8} {'workers':>7} {'ok':>3} {'sec':>8} "
+                f"{'items/s':>8} {'MB/s':>8} {'1st up':>7} {'RSS MB':>7} {'retries':>7}")
+    for result in results:
+        logger.info(
+            f"{result['items']:>6} {result['size'] // 1024:>8} {result['workers']:>7} "
+            f"{'yes' if result['ok'] else 'NO':>3} {result['seconds']:>8} "
+            f"{result['items_per_sec']:>8} {result['mb_per_sec']:>8} "
+            f"{result['first_upload_sec'] if result.get('first_upload_sec') is not None else '-':>7} "
+            f"{result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '-':>7} {result['retries']:>7}"
+        )
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark process_picker_metadata.py offline against local Picker and Blob stand-ins'
+    )
+    parser.add_argument('--items', type=_int_list, default=_int_list(DEFAULT_ITEMS),
+                        help=f'Comma-separated media item counts (default: {DEFAULT_ITEMS})')
+    parser.add_argument('--sizes-kb', type=_int_list, default=_int_list(DEFAULT_SIZES_KB),
+                        help=f'Comma-separated payload sizes in KB (default: {DEFAULT_SIZES_KB})')
+    parser.add_argument('--workers', type=_int_list, default=_int_list(DEFAULT_WORKERS),
+                        help=f'Comma-separated --workers values (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f'Media items per /mediaItems page (default: {DEFAULT_PAGE_SIZE})')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='Added latency per fake Picker API request (default: 0)')
+    parser.add_argument('--throttle-rate', type=float, default=0,
+                        help='Fraction of Picker API requests answered with 429 (default: 0)')
+    parser.add_argument('--retry-after', type=float, default=0.2,
+                        help='Retry-After seconds sent with injected 429s (default: 0.2)')
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help='Fraction of media responses broken off half-way; the case then also '
+                             'checks every stored hash against the served body (default: 0)')
+    parser.add_argument('--chunk-mb', type=int, default=4, help='Passed through as --chunk-mb')
+    parser.add_argument('--range-parts', type=int, default=4, help='Passed through as --range-parts')
+    parser.add_argument('--range-min-mb', type=int, default=16, help='Passed through as --range-min-mb')
+    parser.add_argument('--max-inflight-mb', type=int, default=256, help='Passed through as --max-inflight-mb')
+    parser.add_argument('--upload-mode', default='overwrite', help='Passed through as --upload-mode')
+    parser.add_argument('--same-name', action='store_true',
+                        help='Give every item one customFilename, as photo-picker.html does, and fail the case '
+                             'unless all items succeed and the stored blob matches its recorded hash')
+    parser.add_argument('--azurite', metavar='URL',
+                        help=f'Use Azurite at URL (e.g. http://127.0.0.1:10000/{AZURITE_ACCOUNT_NAME}) '
+                             'instead of the in-process stand-in')
+    parser.add_argument('--out', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Earlier --out file; exit non-zero on regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'Allowed slowdown / RSS growth vs the baseline (default: {DEFAULT_TOLERANCE})')
+    parser.add_argument('--verbose', action='store_true', help="Show the script's INFO logging")
+    args = parser.parse_args()
+    
+    picker_server = start_server(FakePickerServer(
+        args.page_size, args.latency_ms / 1000, args.throttle_rate, args.retry_after, args.drop_rate
+    ))
+    if args.azurite:
+        account_url = args.azurite.rstrip('/')
+    else:
+        # The same-name check reads the stored blob back, so keep every body
+        account_url = start_server(BlobStandInServer(None if args.same_name else STAND_IN_BODY_LIMIT)).account_url
+    logger.info(f"Fake Picker API: {picker_server.url}; Blob Storage: {account_url}")
+    
+    options = {
+        'chunk_size': args.chunk_mb * 1024 * 1024,
+        'range_parts': args.range_parts,
+        'range_min_size': args.range_min_mb * 1024 * 1024,
+        'max_inflight_bytes': args.max_inflight_mb * 1024 * 1024,
+        'upload_mode': args.upload_mode,
+        'verbose': args.verbose,
+        'verify_content': bool(args.drop_rate),
+    }
+    if args.same_name:
+        options['custom_filename'] = 'bench-same-name.jpg'
+    
+    results = []
+    for items in args.items:
+        for size_kb in args.sizes_kb:
+            for workers in args.workers:
+                case = {'items': items, 'size': size_kb * 1024, 'workers': workers}
+                azure_config = {
+                    'storage_account_name': AZURITE_ACCOUNT_NAME,
+                    'storage_account_key': AZURITE_ACCOUNT_KEY,
+                    'container_name': f"bench-{os.getpid()}-{len(results)}",
+                    'account_url': account_url,
+                }
+                logger.info(f"Running {case_key(case)}...")
+                results.append(run_case_in_child(case, picker_server.url + '/v1', azure_config, options))
+    
+    log_results(results)
+    if picker_server.throttled:
+        logger.info(f"Injected {picker_server.throttled} 429 response(s)")
+    if picker_server.dropped:
+        logger.info(f"Broke off {picker_server.dropped} media response(s) part-way")
+    
+    if args.out:
+        Path(args.out).write_text(json.dumps({
+            'created': datetime.now().astimezone().isoformat(),
+            'python': sys.version.split()[0],
+            'settings': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+            'results': results,
+        }, indent=2) + '\n')
+        logger.info(f"Wrote results to {args.out}")
+    
+    failed = [case_key(result) for result in results if not result['ok']]
+    if failed:
+        logger.error(f"Cases that did not complete: {', '.join(failed)}")
+    
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            logger.error(f"REGRESSION {regression}")
+        if not regressions:
+            logger.info(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Startup-Time Benchmark for process_picker_metadata.py
+
+Times fresh-process invocations of the lightweight commands and checks,
+with python -X importtime, that they do not import SDKs they never use:
+--help must not load requests, Azure, Google or Pillow, and list-sessions
+(run against the in-process Blob Storage stand-in) must not load Google or
+Pillow. Exits non-zero when a guard or an optional time budget is broken.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from benchmark_picker import AZURITE_ACCOUNT_KEY, AZURITE_ACCOUNT_NAME, BlobStandInServer, start_server
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SCRIPT = Path(__file__).parent / 'process_picker_metadata.py'
+
+# Top-level packages each command must not import
+FORBIDDEN_IMPORTS = {
+    'help': {'requests', 'azure', 'google', 'PIL'},
+    'list-sessions': {'google', 'PIL'},
+}
+
+DEFAULT_RUNS = 5
+
+
+def run_command(args: List[str]) -> Dict:
+    """
+    Run the script once in a fresh interpreter with -X importtime.
+    
+    Returns:
+        Dict with wall seconds and the set of top-level packages imported
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', str(SCRIPT)] + args,
+        capture_output=True, text=True
+    )
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} exited with {result.returncode}:\n{result.stderr[-2000:]}")
+    
+    packages = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            if name != 'package':
+                packages.add(name.split('.')[0])
+    return {'seconds': seconds, 'packages': packages}
+
+
+def measure(name: str, args: List[str], runs: int) -> Dict:
+    samples = [run_command(args) for _ in range(runs)]
+    packages: Set[str] = set().union(*(sample['packages'] for sample in samples))
+    forbidden = sorted(packages & FORBIDDEN_IMPORTS.get(name, set()))
+    return {
+        'command': name,
+        'median_ms': round(statistics.median(sample['seconds'] for sample in samples) * 1000, 1),
+        'min_ms': round(min(sample['seconds'] for sample in samples) * 1000, 1),
+        'forbidden_imports': forbidden,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark process_picker_metadata.py startup and guard against eager SDK imports'
+    )
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                        help=f'Fresh-process runs per command (default: {DEFAULT_RUNS})')
+    parser.add_argument('--max-help-ms', type=float,
+                        help='Fail if the median --help time exceeds this many milliseconds')
+    parser.add_argument('--max-list-ms', type=float,
+                        help='Fail if the median list-sessions time exceeds this many milliseconds')
+    parser.add_argument('--out', help='Write results to this JSON file')
+    args = parser.parse_args()
+    
+    blob_server = start_server(BlobStandInServer())
+    blob_server.containers['startup'] = {}
+    blob_server.blocks['startup'] = {}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = Path(tmp) / 'azure-config.json'
+        config_file.write_text(json.dumps({
+            'storage_account_name': AZURITE_ACCOUNT_NAME,
+            'storage_account_key': AZURITE_ACCOUNT_KEY,
+            'container_name': 'startup',
+            'account_url': blob_server.account_url,
+        }))
+        list_args = ['list-sessions', '--azure-config', str(config_file), '--catalog', str(Path(tmp) / 'catalog.sqlite3')]
+        
+        results = [
+            measure('help', ['--help'], args.runs),
+            measure('list-sessions', list_args, args.runs),
+        ]
+    
+    budgets = {'help': args.max_help_ms, 'list-sessions': args.max_list_ms}
+    failures = []
+    for result in results:
+        logger.info(
+            f"{result['command']:<14} median {result['median_ms']:>7} ms  min {result['min_ms']:>7} ms"
+        )
+        if result['forbidden_imports']:
+            failures.append(f"{result['command']} imported {', '.join(result['forbidden_imports'])}")
+        budget: Optional[float] = budgets[result['command']]
+        if budget and result['median_ms'] > budget:
+            failures.append(f"{result['command']} took {result['median_ms']} ms (budget {budget:g} ms)")
+    
+    if args.out:
+        Path(args.out).write_text(json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2) + '\n')
+        logger.info(f"Wrote results to {args.out}")
+    
+    for failure in failures:
+        logger.error(f"STARTUP REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+    logger.info("No eager SDK imports on the lightweight paths")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Optimize the Site's assets/img Images
+
+Recompresses the JPEG and PNG files under assets/img in place (only when that
+saves at least MIN_SAVING), capping them at --max-width, and writes responsive
+variants next to the site's other assets:
+    
+    assets/img/variants/<path>/<name>.<ext>-<width>w.{<ext>,webp}
+    assets/img/variants/<path>/<name>.<ext>.webp
+
+Variant names keep the source's extension, so foo.jpg and foo.png in the
+same folder never write the same files.
+
+The work runs in a process pool. A content-hash cache (optimize-assets-cache.json
+next to this script) records every file's hash after optimization, so reruns
+only touch images that are new or have changed since. Each run reports the
+bytes saved per file and per page that references the images.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = Path(__file__).parent
+SITE_DIR = SCRIPT_DIR.parent
+IMAGE_DIR = SITE_DIR / 'assets' / 'img'
+VARIANT_DIR = IMAGE_DIR / 'variants'
+SPRITE_DIR = IMAGE_DIR / 'sprites'
+CACHE_FILE = SCRIPT_DIR / 'optimize-assets-cache.json'
+
+SOURCE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+DEFAULT_QUALITY = 82
+DEFAULT_MAX_WIDTH = 2400
+DEFAULT_WIDTHS = '800,1600'
+MIN_SAVING = 0.05
+# Bumped when variant file names change, so cached images are re-rendered under the new names
+VARIANT_LAYOUT = 2
+
+# Site files scanned for /assets/img/ references in the per-page report
+PAGE_SUFFIXES = {'.md', '.markdown', '.html'}
+PAGE_SKIP_DIRS = {'_site', '.git', '.jekyll-cache', 'tools', 'assets', 'vendor', 'node_modules'}
+IMAGE_REF = re.compile(r'/assets/img/([^\s"\'()<>]+)')
+
+
+def _encode(image: Image.Image, image_format: str, quality: int, icc_profile: Optional[bytes]) -> bytes:
+    buffer = io.BytesIO()
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if image_format == 'JPEG':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True, **options)
+    elif image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=quality, method=4, **options)
+    else:
+        image.save(buffer, image_format, optimize=True, **options)
+    return buffer.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def optimize_image(
+    source: str,
+    quality: int,
+    max_width: int,
+    widths: List[int],
+    write: bool = True
+) -> Dict:
+    """
+    Recompress one image and render its variants.
+    
+    Runs in a worker process. EXIF orientation is applied to the pixels and
+    the remaining metadata is dropped, except for the ICC profile. The
+    original is only replaced when the recompressed file is at least
+    MIN_SAVING smaller; otherwise it is left byte-for-byte as it was.
+    
+    Args:
+        source: Image path under IMAGE_DIR
+        quality: JPEG/WebP quality
+        max_width: Width the recompressed original is capped at
+        widths: Variant widths (never upscaled)
+        write: False to only measure, leaving every file untouched
+    
+    Returns:
+        Dict with the path, the input's sha256, original and final bytes,
+        final sha256 and variant path -> bytes
+    """
+    path = Path(source)
+    rel = path.relative_to(IMAGE_DIR)
+    original = path.read_bytes()
+    image_format = SOURCE_FORMATS[path.suffix.lower()]
+    
+    with Image.open(io.BytesIO(original)) as opened:
+        icc_profile = opened.info.get('icc_profile')
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image_format == 'PNG' and image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+        image = image.convert('RGBA')
+    if image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.Resampling.LANCZOS)
+    
+    final = original
+    recompressed = _encode(image, image_format, quality, icc_profile)
+    if len(recompressed) <= len(original) * (1 - MIN_SAVING):
+        final = recompressed
+        if write:
+            _write_atomic(path, final)
+    
+    variants = {}
+    base = VARIANT_DIR / rel
+    webp_image = image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+    outputs = [(Path(f"{base}.webp"), webp_image, 'WEBP')]
+    for width in widths:
+        if width >= image.width:
+            continue
+        resized = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+        outputs.append((Path(f"{base}-{width}w{path.suffix.lower()}"), resized, image_format))
+        outputs.append((Path(f"{base}-{width}w.webp"), resized if image_format == 'JPEG' else resized.convert('RGBA'), 'WEBP'))
+    for variant_path, variant, variant_format in outputs:
+        data = _encode(variant, variant_format, quality, icc_profile)
+        if write:
+            _write_atomic(variant_path, data)
+        variants[variant_path.relative_to(IMAGE_DIR).as_posix()] = len(data)
+    
+    return {
+        'path': rel.as_posix(),
+        'source_sha256': hashlib.sha256(original).hexdigest(),
+        'original_bytes': len(original),
+        'bytes': len(final),
+        'sha256': hashlib.sha256(final).hexdigest(),
+        'variants': variants,
+    }
+
+
+def find_sources() -> List[Path]:
+    """JPEG and PNG files under IMAGE_DIR, excluding generated variants and sprite sheets."""
+    return sorted(
+        path for path in IMAGE_DIR.rglob('*')
+        if path.suffix.lower() in SOURCE_FORMATS
+        and VARIANT_DIR not in path.parents and SPRITE_DIR not in path.parents
+    )
+
+
+def load_cache(path: Path) -> Dict:
+    if not path.exists():
+        return {'settings': None, 'files': {}}
+    return json.loads(path.read_text())
+
+
+def page_references() -> Dict[str, List[str]]:
+    """
+    Find the site pages that reference images under /assets/img/.
+    
+    Returns:
+        Page path (relative to the site) -> image paths relative to IMAGE_DIR
+    """
+    pages = {}
+    for root, dirs, files in os.walk(SITE_DIR):
+        dirs[:] = [name for name in dirs if name not in PAGE_SKIP_DIRS]
+        for name in files:
+            if Path(name).suffix.lower() not in PAGE_SUFFIXES:
+                continue
+            path = Path(root) / name
+            refs = sorted(set(IMAGE_REF.findall(path.read_text(encoding='utf-8', errors='replace'))))
+            if refs:
+                pages[path.relative_to(SITE_DIR).as_posix()] = refs
+    return pages
+
+
+def log_report(results: List[Dict], cache: Dict) -> Dict:
+    """
+    Log bytes saved by this run per file, and in total per referencing page.
+    
+    Returns:
+        The report as a dict
+    """
+    if results:
+        logger.info(f"\n{'file':<44} {'before KB':>10} {'after KB':>10} {'saved':>7} {'variants':>9}")
+        for result in sorted(results, key=lambda r: r['original_bytes'] - r['bytes'], reverse=True):
+            saved = result['original_bytes'] - result['bytes']
+            logger.info(
+                f"{result['path']:<44} {result['original_bytes'] / 1024:>10.1f} {result['bytes'] / 1024:>10.1f} "
+                f"{saved / max(result['original_bytes'], 1):>7.1%} {len(result['variants']):>9}"
+            )
+    
+    files = cache['files']
+    before = sum(entry['original_bytes'] for entry in files.values())
+    after = sum(entry['bytes'] for entry in files.values())
+    logger.info(
+        f"\nAll {len(files)} image(s): {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB "
+        f"({(before - after) / 1024 / 1024:.1f} MB saved)"
+    )
+    
+    pages = []
+    for page, refs in page_references().items():
+        known = [files[ref] for ref in refs if ref in files]
+        if known:
+            pages.append({
+                'page': page,
+                'images': len(known),
+                'original_bytes': sum(entry['original_bytes'] for entry in known),
+                'bytes': sum(entry['bytes'] for entry in known),
+            })
+    pages.sort(key=lambda page: page['original_bytes'] - page['bytes'], reverse=True)
+    if pages:
+        logger.info(f"\n{'page':<52} {'images':>6} {'before KB':>10} {'after KB':>10}")
+        for page in pages:
+            logger.info(
+                f"{page['page']:<52} {page['images']:>6} "
+                f"{page['original_bytes'] / 1024:>10.1f} {page['bytes'] / 1024:>10.1f}"
+            )
+    
+    return {'files': results, 'total_original_bytes': before, 'total_bytes': after, 'pages': pages}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Recompress assets/img in place and write responsive JPEG/PNG and WebP variants'
+    )
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY,
+                        help=f'JPEG/WebP quality (default: {DEFAULT_QUALITY})')
+    parser.add_argument('--max-width', type=int, default=DEFAULT_MAX_WIDTH,
+                        help=f'Downscale originals wider than this (default: {DEFAULT_MAX_WIDTH})')
+    parser.add_argument('--widths', default=DEFAULT_WIDTHS,
+                        help=f'Comma-separated variant widths (default: {DEFAULT_WIDTHS})')
+    parser.add_argument('--processes', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--cache', default=str(CACHE_FILE),
+                        help=f'Content-hash cache file (default: {CACHE_FILE.name} next to this script)')
+    parser.add_argument('--force', action='store_true', help='Ignore the cache and process every image')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Report the savings without writing any image or the cache')
+    parser.add_argument('--out', help='Write the report to this JSON file')
+    args = parser.parse_args()
+    
+    widths = sorted(int(width) for width in args.widths.split(','))
+    settings = {'quality': args.quality, 'max_width': args.max_width, 'widths': widths, 'layout': VARIANT_LAYOUT}
+    cache_path = Path(args.cache)
+    cache = load_cache(cache_path)
+    known = dict(cache['files'])
+    if cache['settings'] != settings:
+        # Images already optimized with other settings are processed again
+        cache = {'settings': settings, 'files': {}}
+    
+    sources = find_sources()
+    current = {path.relative_to(IMAGE_DIR).as_posix() for path in sources}
+    for rel in set(known) - current:
+        cache['files'].pop(rel, None)
+        for variant in known[rel]['variants']:
+            if not args.dry_run:
+                (IMAGE_DIR / variant).unlink(missing_ok=True)
+        logger.info(f"Dropped {rel} (source removed) and its variants")
+    
+    pending = []
+    for path in sources:
+        entry = cache['files'].get(path.relative_to(IMAGE_DIR).as_posix())
+        if (
+            not args.force and entry
+            and entry['sha256'] == hashlib.sha256(path.read_bytes()).hexdigest()
+            and all((IMAGE_DIR / variant).exists() for variant in entry['variants'])
+        ):
+            continue
+        pending.append(path)
+    logger.info(f"{len(sources)} image(s) under {IMAGE_DIR.relative_to(SITE_DIR)}, {len(pending)} new or changed")
+    
+    results = []
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = {
+            pool.submit(optimize_image, str(path), args.quality, args.max_width, widths, not args.dry_run): path
+            for path in pending
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Error optimizing {futures[future]}: {e}")
+                failed += 1
+                continue
+            results.append(result)
+            previous = known.get(result['path'])
+            if previous:
+                if previous['sha256'] == result['source_sha256']:
+                    # Reprocessed as it was left last time: keep the size before any optimization
+                    result['original_bytes'] = previous['original_bytes']
+                # Drop variants it no longer produces
+                for variant in set(previous['variants']) - set(result['variants']):
+                    if not args.dry_run:
+                        (IMAGE_DIR / variant).unlink(missing_ok=True)
+            cache['files'][result['path']] = {
+                key: value for key, value in result.items() if key not in ('path', 'source_sha256')
+            }
+    
+    if not args.dry_run:
+        cache_path.write_text(json.dumps(cache, indent=2, sort_keys=True) + '\n')
+    
+    report = log_report(results, cache)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2) + '\n')
+        logger.info(f"Wrote report to {args.out}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the CDN for the Site's Photo Pages
+
+Reads the photo: front matter of every photo-page post and builds the exact
+image URLs the layouts reference on assets.jessefitz.me:
+
+- the original, linked from every photo page (images/<photo>)
+- with renditions in _data/renditions.json: the 200px thumbnail and every
+  800w/1600w JPEG and WebP rendition
+- without them: the cdn-cgi/image transforms for the /photos/ thumbnail and
+  the 800w page image
+
+Thumbnails are skipped for photos that /photos/ shows from a sprite sheet.
+format=auto transforms are requested once per ACCEPT_VARIANTS entry, since
+the CDN caches a separate AVIF/WebP/JPEG response for each.
+
+Requests go through a bounded client: at most --concurrency in flight on one
+keep-alive connection pool. Each URL's HTTP status, cache status
+(cf-cache-status, or X-Cache), time to first byte and total latency are
+logged and can be written to JSON. --stand-in runs against a local CDN
+stand-in instead of the real host, for tests.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from process_picker_metadata import (
+    ALIAS_MANIFEST_FILE, ASSET_BASE_URL, ASSET_IMAGES_PATH, PAGE_TRANSFORM, POSTS_DIR, RENDITION_MANIFEST_FILE, SPRITE_MAP_FILE,
+    THUMB_TRANSFORM, read_photo_posts
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Accept headers of the browsers format=auto has to serve: AVIF-capable, WebP-only, neither
+ACCEPT_VARIANTS = [
+    'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
+    'image/webp,image/*,*/*;q=0.8',
+    'image/*,*/*;q=0.8',
+]
+DEFAULT_ACCEPT = ACCEPT_VARIANTS[0]
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 60
+CACHE_HIT = 'HIT'
+
+
+def _load_json(path: Path) -> Dict:
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def photo_urls(
+    photo: str,
+    base_url: str,
+    renditions: Dict,
+    aliases: Dict,
+    sprites: Dict
+) -> List[Dict[str, str]]:
+    """
+    Build the image URLs the layouts reference for one photo.
+    
+    Args:
+        photo: The post's photo: value
+        base_url: CDN origin, e.g. ASSET_BASE_URL
+        renditions: _data/renditions.json
+        aliases: _data/aliases.json
+        sprites: The photos map of _data/sprites.json
+    
+    Returns:
+        List of dicts with kind, url and the Accept header to send
+    """
+    key = aliases.get(photo, photo)
+    images = f"{base_url}/{ASSET_IMAGES_PATH}"
+    urls = [{'kind': 'original', 'url': f"{images}/{key}"}]
+    
+    entry = renditions.get(photo)
+    if entry:
+        if photo not in sprites:
+            urls += [
+                {'kind': 'thumbnail', 'url': f"{images}/{entry['thumb'][fmt]}"}
+                for fmt in ('jpeg', 'webp')
+            ]
+        urls += [
+            {'kind': f"{width['width']}w", 'url': f"{images}/{width[fmt]}"}
+            for width in entry['widths'] for fmt in ('jpeg', 'webp')
+        ]
+    else:
+        if photo not in sprites:
+            urls.append({'kind': 'thumbnail', 'url': f"{base_url}/{THUMB_TRANSFORM}/{ASSET_IMAGES_PATH}/{key}"})
+        urls.append({'kind': '800w', 'url': f"{base_url}/{PAGE_TRANSFORM}/{ASSET_IMAGES_PATH}/{key}"})
+    
+    requests_to_send = []
+    for url in urls:
+        accepts = ACCEPT_VARIANTS if 'format=auto' in url['url'] else [DEFAULT_ACCEPT]
+        requests_to_send += [dict(url, photo=photo, accept=accept) for accept in accepts]
+    return requests_to_send
+
+
+def build_targets(posts_dir: Path, base_url: str) -> List[Dict[str, str]]:
+    """Every URL to warm for the photo-page posts in posts_dir, without duplicates."""
+    renditions = _load_json(RENDITION_MANIFEST_FILE)
+    aliases = _load_json(ALIAS_MANIFEST_FILE)
+    sprites = _load_json(SPRITE_MAP_FILE).get('photos', {})
+    
+    targets = []
+    seen = set()
+    for post in read_photo_posts(posts_dir):
+        for target in photo_urls(post['photo'], base_url, renditions, aliases, sprites):
+            if (target['url'], target['accept']) not in seen:
+                seen.add((target['url'], target['accept']))
+                targets.append(target)
+    return targets
+
+
+def warm_url(session: requests.Session, target: Dict[str, str], timeout: float) -> Dict:
+    """
+    Request one URL and read the whole body, so the CDN finishes caching it.
+    
+    Returns:
+        The target plus status, cache status, bytes, ttfb_ms and total_ms (or error)
+    """
+    result = dict(target)
+    started = time.monotonic()
+    try:
+        with session.get(target['url'], headers={'Accept': target['accept']}, stream=True, timeout=timeout) as response:
+            result['ttfb_ms'] = round((time.monotonic() - started) * 1000, 1)
+            size = sum(len(chunk) for chunk in response.iter_content(chunk_size=64 * 1024))
+            result.update(
+                status=response.status_code,
+                cache=(response.headers.get('cf-cache-status') or response.headers.get('X-Cache') or '-').upper(),
+                content_type=response.headers.get('Content-Type'),
+                bytes=size,
+            )
+    except requests.RequestException as e:
+        result.update(status=None, cache='-', error=str(e))
+    result['total_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+def warm(targets: List[Dict[str, str]], concurrency: int, timeout: float) -> List[Dict]:
+    """
+    Request every target with at most `concurrency` requests in flight.
+    
+    Returns:
+        Per-URL results, in target order
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    with session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda target: warm_url(session, target, timeout), targets))
+
+
+def summarize(results: List[Dict]) -> Dict:
+    """Counts by cache status and latency percentiles, overall and per URL kind."""
+    def latency(group: List[Dict]) -> Dict:
+        values = sorted(result['total_ms'] for result in group)
+        return {
+            'count': len(values),
+            'p50_ms': values[len(values) // 2],
+            'p90_ms': values[min(len(values) - 1, int(0.9 * len(values)))],
+            'max_ms': values[-1],
+            'mean_ms': round(statistics.fmean(values), 1),
+        }
+    
+    cache = {}
+    for result in results:
+        cache[result['cache']] = cache.get(result['cache'], 0) + 1
+    kinds = sorted({result['kind'] for result in results})
+    return {
+        'urls': len(results),
+        'failed': sum(1 for result in results if not result['status'] or result['status'] >= 400),
+        'cache': cache,
+        'latency': latency(results) if results else None,
+        'by_kind': {kind: latency([r for r in results if r['kind'] == kind]) for kind in kinds},
+    }
+
+
+class CdnStandInHandler(BaseHTTPRequestHandler):
+    """
+    CDN stand-in: any GET returns a small image-like body.
+    
+    The first request for a URL and Accept header waits the server's
+    latency and reports cf-cache-status: MISS; later ones are HITs.
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    
+    def log_message(self, *args) -> None:
+        pass
+    
+    def do_GET(self) -> None:
+        key = (self.path, self.headers.get('Accept'))
+        with self.server.lock:
+            hit = key in self.server.cached
+            self.server.cached.add(key)
+            self.server.requests += 1
+        if not hit:
+            time.sleep(self.server.latency)
+        body = self.path.encode() * 64
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/webp' if 'webp' in self.path else 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('cf-cache-status', CACHE_HIT if hit else 'MISS')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CdnStandInServer(ThreadingHTTPServer):
+    """Threaded CDN stand-in remembering which URLs it has 'cached'."""
+    
+    daemon_threads = True
+    
+    def __init__(self, latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), CdnStandInHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.cached = set()
+        self.requests = 0
+    
+    def handle_error(self, request, client_address) -> None:
+        # A client hanging up mid-response is expected, e.g. when a run is cancelled
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def log_summary(summary: Dict, run: int) -> None:
+    cache = ', '.join(f"{status} {count}" for status, count in sorted(summary['cache'].items()))
+    logger.info(f"Pass {run}: {summary['urls']} URL(s), {summary['failed']} failed; cache status: {cache}")
+    for kind, data in summary['by_kind'].items():
+        logger.info(
+            f"  {kind:<10} {data['count']:>5} URL(s)  p50 {data['p50_ms']:>8} ms  "
+            f"p90 {data['p90_ms']:>8} ms  max {data['max_ms']:>8} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Request the CDN URLs of every photo page so visitors hit a warm edge cache'
+    )
+    parser.add_argument('--posts-dir', default=str(POSTS_DIR),
+                        help=f"Directory of the photo-page posts (default: the site's {POSTS_DIR.name}/)")
+    parser.add_argument('--base-url', default=ASSET_BASE_URL,
+                        help=f'CDN origin the layouts use (default: {ASSET_BASE_URL})')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Requests in flight at once (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Per-request timeout in seconds (default: {DEFAULT_TIMEOUT})')
+    parser.add_argument('--passes', type=int, default=1,
+                        help='Request every URL this many times; a second pass shows what is now cached (default: 1)')
+    parser.add_argument('--dry-run', action='store_true', help='List the URLs without requesting them')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='Warm a local CDN stand-in instead of --base-url (for tests)')
+    parser.add_argument('--stand-in-latency-ms', type=float, default=50,
+                        help='Cold-request latency of the stand-in (default: 50)')
+    parser.add_argument('--out', help='Write per-URL results and summaries to this JSON file')
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.passes < 1:
+        parser.error('--passes must be at least 1')
+    
+    base_url = args.base_url.rstrip('/')
+    stand_in: Optional[CdnStandInServer] = None
+    if args.stand_in:
+        stand_in = CdnStandInServer(args.stand_in_latency_ms / 1000)
+        threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+        base_url = stand_in.url
+        logger.info(f"Warming the CDN stand-in at {base_url}")
+    
+    targets = build_targets(Path(args.posts_dir), base_url)
+    photos = len({target['photo'] for target in targets})
+    logger.info(f"{len(targets)} URL(s) for {photos} photo(s)")
+    if args.dry_run:
+        for target in targets:
+            logger.info(f"  {target['kind']:<10} {target['url']}  (Accept: {target['accept']})")
+        return
+    
+    passes = []
+    for run in range(1, args.passes + 1):
+        started = time.monotonic()
+        results = warm(targets, args.concurrency, args.timeout)
+        summary = summarize(results)
+        summary['seconds'] = round(time.monotonic() - started, 3)
+        log_summary(summary, run)
+        passes.append({'summary': summary, 'results': results})
+    
+    failed = [result for result in passes[-1]['results'] if not result['status'] or result['status'] >= 400]
+    for result in failed:
+        logger.error(f"{result['url']} -> {result.get('status') or result.get('error')}")
+    
+    if args.out:
+        Path(args.out).write_text(json.dumps({'base_url': base_url, 'passes': passes}, indent=2) + '\n')
+        logger.info(f"Wrote results to {args.out}")
+    if stand_in:
+        stand_in.shutdown()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,20 +6,52 @@ This script reads JSON metadata files created by the photo-picker.html tool,
 downloads the actual images from Google Photos, and uploads them to Azure Storage.
 """
 
+from __future__ import annotations
+
 import argparse
+import base64
+import cProfile
+import collections
+import contextlib
+import hashlib
+import io
+import itertools
 import json
 import logging
+import mimetypes
+import mmap
 import os
+import pstats
+import queue
+import random
+import re
+import signal
+import sqlite3
 import sys
 import tempfile
-from datetime import datetime
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+
+# requests, the Azure and Google SDKs and Pillow are imported where they are
+# first needed, so --help and list-sessions skip most of their import cost
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    
+    import requests
+    from google.oauth2.credentials import Credentials
+    from PIL import Image
 
-import requests
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS in the metrics report
+    resource = None
 
 # Configure logging
 logging.basicConfig(
@@ -30,20 +62,1087 @@ logger = logging.getLogger(__name__)
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
+SITE_DIR = SCRIPT_DIR.parent
+DATA_DIR = SITE_DIR / '_data'
 TOKEN_FILE = SCRIPT_DIR / 'token.json'
 AZURE_CONFIG_FILE = SCRIPT_DIR / 'azure-config.json'
 
 # Google Photos API scope
 SCOPES = ['https://www.googleapis.com/auth/photospicker.mediaitems.readonly']
 
+# Google access tokens: refreshed this long before they expire when a refresh
+# token exists; session-file tokens of unknown age are assumed to last an hour
+TOKEN_REFRESH_AHEAD_SECONDS = 300
+TOKEN_RETRY_SECONDS = 30
+TOKEN_LIFETIME_SECONDS = 3600
+TOKENINFO_URL = 'https://oauth2.googleapis.com/tokeninfo'
+
+# Google Photos Picker API endpoint (overridden by the offline benchmark)
+PICKER_API_BASE = 'https://photospicker.googleapis.com/v1'
+
+# Concurrency defaults
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_INFLIGHT_MB = 256
+DEFAULT_POOL_SIZE = 16
+
+# Throttling and retries: 429/503 shrink concurrency (AIMD), 5xx are retried
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+THROTTLE_STATUSES = {429, 503}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+AZURE_THROTTLE_CODES = {'ServerBusy', 'OperationTimedOut'}
+
+# Metrics and profiling (--metrics-out, --profile)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PROFILE_TOP = 25
+PROFILE_TRACEBACK_FRAMES = 10
+
+# Session metadata blobs and where they are moved once processed
+SESSION_PREFIX = 'picker-session-'
+PROCESSED_PREFIX = 'processed/'
+FAILED_PREFIX = 'failed/'
+DEFAULT_SESSION_WORKERS = 2
+DEFAULT_POLL_SECONDS = 3
+
+# Upload modes: always overwrite, skip identical content, or store each unique image once
+UPLOAD_OVERWRITE = 'overwrite'
+UPLOAD_DEDUPE = 'dedupe'
+UPLOAD_CONTENT_ADDRESSED = 'content-addressed'
+UPLOAD_MODES = [UPLOAD_OVERWRITE, UPLOAD_DEDUPE, UPLOAD_CONTENT_ADDRESSED]
+HASH_METADATA_KEY = 'sha256'
+OBJECTS_PREFIX = 'objects/'
+ALIAS_MANIFEST_BLOB = 'objects/aliases.json'
+ALIAS_MANIFEST_FILE = DATA_DIR / 'aliases.json'
+# Content-hashed keys never change content, so the CDN and browsers may keep them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Resume journal: per-item states recorded locally, keyed by session and media item ID
+JOURNAL_FILE = SCRIPT_DIR / 'picker-journal.sqlite3'
+JOURNAL_LISTED = 'listed'
+JOURNAL_DOWNLOADED = 'downloaded'
+JOURNAL_UPLOADED = 'uploaded'
+JOURNAL_FAILED = 'failed'
+
+# Responsive renditions generated at ingest time (see _layouts/photo-page.html)
+RENDITION_PREFIX = 'renditions/'
+RENDITION_MANIFEST_BLOB = 'renditions/manifest.json'
+RENDITION_MANIFEST_FILE = DATA_DIR / 'renditions.json'
+RENDITION_THUMB_SIZE = 200
+RENDITION_WIDTHS = [800, 1600]
+RENDITION_QUALITY = 85
+RENDITION_FORMATS = [
+    ('jpeg', 'JPEG', 'jpg', 'image/jpeg', {'optimize': True, 'progressive': True}),
+    ('webp', 'WEBP', 'webp', 'image/webp', {'method': 4}),
+]
+_LOCAL_MANIFEST_LOCK = threading.Lock()
+
+# Photo-page posts written at ingest time (see _posts/ and _layouts/photo-page.html)
+POSTS_DIR = SITE_DIR / '_posts'
+LQIP_SIZE = 16
+LQIP_QUALITY = 40
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+POST_ANALYSIS_KEYS = ['width', 'height', 'taken', 'orientation', 'lqip']
+_POSTS_LOCK = threading.Lock()
+
+# Thumbnail sprite sheets for the /photos/ index (see photos.md)
+SPRITE_DIR = SITE_DIR / 'assets' / 'img' / 'sprites'
+SPRITE_MAP_FILE = DATA_DIR / 'sprites.json'
+SPRITE_COLUMNS = 6
+SPRITE_PHOTOS_PER_SHEET = 24
+SPRITE_QUALITY = 80
+
+# Image URLs used by the layouts (_layouts/photo-page.html, photos.md); the
+# container is served under ASSET_IMAGES_PATH on the site's asset_base_url
+ASSET_BASE_URL = 'https://assets.jessefitz.me'
+ASSET_IMAGES_PATH = 'images'
+THUMB_TRANSFORM = 'cdn-cgi/image/width=200,height=200,fit=cover'
+PAGE_TRANSFORM = 'cdn-cgi/image/width=800,format=auto,quality=85'
+
+# Paged JSON feed behind the /photos/ grid: the first page is rendered by
+# Jekyll from _data/, later pages are fetched from assets/feeds/ on scroll
+FEED_DIR = SITE_DIR / 'assets' / 'feeds'
+FEED_INDEX_FILE = DATA_DIR / 'photo_feed.json'
+FEED_PAGE_SIZE = SPRITE_PHOTOS_PER_SHEET
+FEED_EXCERPT_WORDS = 50
+
+# Local catalog of the container's blobs, read instead of listing the container
+CATALOG_FILE = SCRIPT_DIR / 'blob-catalog.sqlite3'
+
+# Downloaded originals kept on disk, so reruns do not fetch them from Google again
+ORIGINALS_CACHE_DIR = SCRIPT_DIR / 'originals-cache'
+DEFAULT_CACHE_MB = 2048
+CACHE_INCOMING_PREFIX = '.incoming-'
+CACHE_STALE_SECONDS = 24 * 3600
+
+# Local-directory ingest (sync-dir): file hashes are remembered by path, size
+# and mtime, so a re-sync only reads new or modified files
+SYNC_HASH_INDEX_FILE = SCRIPT_DIR / 'sync-hashes.sqlite3'
+DEFAULT_HASH_WORKERS = 4
+HASH_READ_SIZE = 1024 * 1024
+SYNC_MEDIA_TYPES = ('image/', 'video/')
+
+# Offline mirror of the container for local Jekyll builds (mirror): blobs
+# are kept under ASSET_IMAGES_PATH and the layouts' transforms pre-rendered
+# beside them, so the site's asset_base_url can point at a plain file server
+MIRROR_DIR = SCRIPT_DIR / 'assets-mirror'
+MIRROR_STATE_FILE = '.mirror-state.json'
+MIRROR_SKIP_PREFIXES = (SESSION_PREFIX, PROCESSED_PREFIX, FAILED_PREFIX)
+DEFAULT_MIRROR_WORKERS = 8
+DEFAULT_MIRROR_PORT = 4001
+MIRROR_PAGE_WIDTH = 800
+MIRROR_QUALITY = 85
+
+# Streaming transfer: each item holds at most STREAM_QUEUE_DEPTH + 1 chunks
+DEFAULT_CHUNK_MB = 4
+STREAM_QUEUE_DEPTH = 2
+
+# Items at least this large are fetched as parallel HTTP Range requests
+DEFAULT_RANGE_PARTS = 4
+DEFAULT_RANGE_MIN_MB = 16
+
+
+def _pooled_session(pool_size: int) -> requests.Session:
+    """Create a keep-alive requests.Session whose connection pool fits pool_size workers."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _retry_after_seconds(headers) -> Optional[float]:
+    """Parse a Retry-After (seconds or HTTP date) or x-ms-retry-after-ms header."""
+    if headers.get('x-ms-retry-after-ms'):
+        try:
+            return int(headers['x-ms-retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateController:
+    """
+    Adaptive concurrency limit for one remote service, shared by every worker.
+    
+    Each request takes a slot before it is sent. Successful responses grow the
+    limit additively (about +1 per limit's worth of requests, up to the pool
+    size); a throttling response halves it and pauses new requests for the
+    server's Retry-After, or an exponential backoff with full jitter when the
+    server gives none. Only the first throttle of a pause halves the limit, so
+    a burst of 429s from requests already in flight counts as one signal.
+    """
+    
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.throttled = 0
+        self.retries = 0
+        self._consecutive_throttles = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+    
+    def acquire(self) -> None:
+        """Block until the service is not paused and a slot is free."""
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self._in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self._in_flight += 1
+    
+    def release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+    
+    def on_success(self) -> None:
+        with self._cond:
+            self._consecutive_throttles = 0
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self._cond.notify_all()
+    
+    def on_throttle(self, retry_after: Optional[float]) -> float:
+        """Record a throttling response; returns the delay imposed on new requests."""
+        with self._cond:
+            delay = retry_after if retry_after is not None else backoff_delay(self._consecutive_throttles)
+            now = time.monotonic()
+            self.throttled += 1
+            self._consecutive_throttles += 1
+            if now >= self._paused_until:
+                self.limit = max(1.0, self.limit / 2)
+            self._paused_until = max(self._paused_until, now + delay)
+        logger.warning(f"{self.name} throttled; pausing {delay:.1f}s, concurrency limit now {int(self.limit)}")
+        return delay
+    
+    def log_summary(self) -> None:
+        if self.throttled or self.retries:
+            logger.info(
+                f"{self.name}: {self.throttled} throttled response(s), {self.retries} retr(ies), "
+                f"final concurrency limit {int(self.limit)}/{self.max_concurrency}"
+            )
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given (0-based) retry attempt."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _request_with_backoff(
+    session: requests.Session,
+    limiter: RateController,
+    method: str,
+    url: str,
+    max_retries: int = MAX_RETRIES,
+    **kwargs
+) -> requests.Response:
+    """
+    Send a request through the rate controller, retrying throttled and transient failures.
+    
+    429 and 503 responses shrink the service's concurrency limit and wait for
+    Retry-After; other 5xx responses and connection errors are retried with
+    jittered backoff. A body that breaks off part-way counts as congestion,
+    like a throttle. A 401 on a request authorized by a TokenProvider
+    refreshes the token (once) and re-sends straight away. The last response
+    is returned as-is once retries run out, so callers still see (and log) the
+    final status.
+    
+    With stream=True the body has not been read yet when the response is
+    returned, so the request keeps its slot until the response is closed.
+    """
+    import requests
+    
+    reauthorized = False
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        streaming = False
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ChunkedEncodingError as e:
+            if attempt == max_retries:
+                raise
+            logger.warning(f"{limiter.name} response broke off ({e}); retrying")
+            delay = limiter.on_throttle(None)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"{limiter.name} request failed ({e}); retrying in {delay:.1f}s")
+        else:
+            if (response.status_code == 401 and not reauthorized and attempt < max_retries
+                    and isinstance(kwargs.get('auth'), TokenProvider)):
+                response.close()
+                kwargs['auth'].on_unauthorized(response.request.headers.get('Authorization'))
+                reauthorized = True
+                delay = 0
+            elif response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                if response.ok:
+                    limiter.on_success()
+                if kwargs.get('stream'):
+                    _release_on_close(response, limiter)
+                    streaming = True
+                return response
+            else:
+                response.close()
+                if response.status_code in THROTTLE_STATUSES:
+                    delay = limiter.on_throttle(_retry_after_seconds(response.headers))
+                else:
+                    delay = backoff_delay(attempt)
+                    logger.warning(f"{limiter.name} returned HTTP {response.status_code}; retrying in {delay:.1f}s")
+        finally:
+            if not streaming:
+                limiter.release()
+        limiter.retries += 1
+        time.sleep(delay)
+
+
+def _release_on_close(response: requests.Response, limiter: RateController) -> None:
+    """Hand the request's limiter slot to a streamed response; closing it (once or more) frees the slot."""
+    close = response.close
+    released = threading.Lock()
+    
+    def close_and_release() -> None:
+        try:
+            close()
+        finally:
+            if released.acquire(blocking=False):
+                limiter.release()
+    
+    response.close = close_and_release
+
+
+class _AzureThrottlePolicy:
+    """
+    Azure SDK pipeline policy feeding a RateController.
+    
+    Runs inside the SDK's retry policy, so every attempt takes a slot and
+    503 ServerBusy / OperationTimedOut (and 429) responses shrink the limit and
+    pause new requests; the SDK's own retry policy then re-sends the request.
+    Implements azure.core's HTTPPolicy interface (send() plus a next policy
+    set by the pipeline) without subclassing it, to keep azure.core out of
+    module import.
+    """
+    
+    def __init__(self, limiter: RateController):
+        self.next = None
+        self._limiter = limiter
+    
+    def send(self, request):
+        self._limiter.acquire()
+        try:
+            response = self.next.send(request)
+        finally:
+            self._limiter.release()
+        
+        http_response = response.http_response
+        if (http_response.status_code in THROTTLE_STATUSES
+                or http_response.headers.get('x-ms-error-code') in AZURE_THROTTLE_CODES):
+            self._limiter.on_throttle(_retry_after_seconds(http_response.headers))
+        elif http_response.status_code < 500:
+            self._limiter.on_success()
+        return response
+
+
+class RunMetrics:
+    """
+    Per-stage latency, byte and per-item counters for one run, shared by all workers.
+    
+    Stages are the places a slow run can spend its time: paging /mediaItems,
+    waiting for the first byte from Google, reading download chunks, Azure
+    writes, renditions, and waiting for a worker slot or byte budget. write()
+    turns them into a JSON report and a Prometheus textfile.
+    """
+    
+    def __init__(self):
+        self.started = datetime.now().astimezone()
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._durations = collections.defaultdict(list)
+        self._bytes = collections.Counter()
+        self.items = []
+    
+    def observe(self, stage: str, seconds: float, num_bytes: int = 0) -> None:
+        with self._lock:
+            self._durations[stage].append(seconds)
+            self._bytes[stage] += num_bytes
+    
+    @contextlib.contextmanager
+    def timed(self, stage: str, num_bytes: int = 0) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start, num_bytes)
+    
+    def record_item(self, name: str, num_bytes: int, seconds: float, ok: bool) -> None:
+        self.observe('item', seconds, num_bytes)
+        with self._lock:
+            self.items.append({
+                'name': name, 'bytes': num_bytes, 'seconds': round(seconds, 4), 'ok': ok,
+                'finished': round(time.monotonic() - self._start, 4),
+            })
+    
+    @staticmethod
+    def peak_rss_bytes() -> Optional[int]:
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    
+    def report(self, limiters: Iterable[RateController] = ()) -> Dict:
+        """Build the JSON-serializable report."""
+        wall = time.monotonic() - self._start
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+            stage_bytes = dict(self._bytes)
+            items = list(self.items)
+        
+        def quantile(values: List[float], q: float) -> float:
+            return values[min(len(values) - 1, int(q * len(values)))]
+        
+        stages = {}
+        for stage, values in sorted(durations.items()):
+            total = sum(values)
+            stages[stage] = {
+                'count': len(values),
+                'seconds': round(total, 4),
+                'bytes': stage_bytes.get(stage, 0),
+                'bytes_per_sec': round(stage_bytes[stage] / total) if total and stage_bytes.get(stage) else None,
+                'p50': round(quantile(values, 0.5), 4),
+                'p90': round(quantile(values, 0.9), 4),
+                'p99': round(quantile(values, 0.99), 4),
+                'max': round(values[-1], 4),
+                'buckets': {
+                    str(le): sum(1 for v in values if v <= le) for le in LATENCY_BUCKETS
+                },
+            }
+        
+        item_bytes = sum(item['bytes'] for item in items if item['ok'])
+        finished = [item['finished'] for item in items if item['ok']]
+        return {
+            'started': self.started.isoformat(),
+            'wall_seconds': round(wall, 3),
+            'peak_rss_bytes': self.peak_rss_bytes(),
+            'items': {
+                'succeeded': sum(1 for item in items if item['ok']),
+                'failed': sum(1 for item in items if not item['ok']),
+                'bytes': item_bytes,
+                'items_per_sec': round(len(items) / wall, 3) if wall else None,
+                'bytes_per_sec': round(item_bytes / wall) if wall else None,
+                'first_upload_seconds': min(finished) if finished else None,
+            },
+            'stages': stages,
+            'services': {
+                limiter.name: {
+                    'retries': limiter.retries,
+                    'throttled': limiter.throttled,
+                    'concurrency_limit': int(limiter.limit),
+                    'max_concurrency': limiter.max_concurrency,
+                }
+                for limiter in limiters
+            },
+            'per_item': items,
+        }
+    
+    @staticmethod
+    def to_prometheus(report: Dict) -> str:
+        """Render a report in the Prometheus text exposition format."""
+        lines = [
+            '# HELP picker_stage_seconds Time spent per stage operation.',
+            '# TYPE picker_stage_seconds histogram',
+        ]
+        for stage, data in report['stages'].items():
+            for le, count in data['buckets'].items():
+                lines.append(f'picker_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'picker_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {data["count"]}')
+            lines.append(f'picker_stage_seconds_sum{{stage="{stage}"}} {data["seconds"]}')
+            lines.append(f'picker_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        lines += ['# HELP picker_stage_bytes_total Bytes moved per stage.', '# TYPE picker_stage_bytes_total counter']
+        lines += [f'picker_stage_bytes_total{{stage="{stage}"}} {data["bytes"]}' for stage, data in report['stages'].items()]
+        lines += ['# HELP picker_items_total Media items by result.', '# TYPE picker_items_total counter']
+        lines.append(f'picker_items_total{{result="succeeded"}} {report["items"]["succeeded"]}')
+        lines.append(f'picker_items_total{{result="failed"}} {report["items"]["failed"]}')
+        for metric, key, kind in (
+            ('picker_retries_total', 'retries', 'counter'),
+            ('picker_throttled_total', 'throttled', 'counter'),
+            ('picker_concurrency_limit', 'concurrency_limit', 'gauge'),
+        ):
+            lines.append(f'# TYPE {metric} {kind}')
+            lines += [f'{metric}{{service="{name}"}} {data[key]}' for name, data in report['services'].items()]
+        lines += ['# TYPE picker_run_seconds gauge', f'picker_run_seconds {report["wall_seconds"]}']
+        if report['items']['first_upload_seconds'] is not None:
+            lines += ['# TYPE picker_first_upload_seconds gauge',
+                      f'picker_first_upload_seconds {report["items"]["first_upload_seconds"]}']
+        if report['peak_rss_bytes'] is not None:
+            lines += ['# TYPE picker_peak_rss_bytes gauge', f'picker_peak_rss_bytes {report["peak_rss_bytes"]}']
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, path: Path, limiters: Iterable[RateController] = ()) -> None:
+        """Write <path>.json and <path>.prom, each replaced atomically."""
+        report = self.report(limiters)
+        for suffix, text in (
+            ('.json', json.dumps(report, indent=2) + '\n'),
+            ('.prom', self.to_prometheus(report)),
+        ):
+            target = path.with_suffix(suffix)
+            tmp_path = target.with_name(target.name + '.tmp')
+            tmp_path.write_text(text)
+            os.replace(tmp_path, target)
+        logger.info(f"Wrote metrics to {path.with_suffix('.json')} and {path.with_suffix('.prom')}")
+
+
+@contextlib.contextmanager
+def metrics_report(clients: 'ClientContext', path: Optional[Path]) -> Iterator[None]:
+    """Write the run's metrics on exit, including after a failure or sys.exit()."""
+    try:
+        yield
+    finally:
+        if path:
+            clients.metrics.write(path, (clients.google_limiter, clients.azure_limiter))
+
+
+class _ThreadProfiler:
+    """
+    cProfile every thread started while active, plus tracemalloc.
+    
+    cProfile only sees the thread that enables it, and the work here happens
+    on worker and prefetch threads, so each new thread enables its own
+    profile and they are merged into one pstats report at the end.
+    """
+    
+    def __init__(self):
+        self._profiles = [cProfile.Profile()]
+        self._lock = threading.Lock()
+    
+    def _start_thread(self, *_) -> None:
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+    
+    def start(self) -> None:
+        tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        threading.setprofile(self._start_thread)
+        self._profiles[0].enable()
+    
+    def stop(self, out_path: Optional[Path]) -> None:
+        self._profiles[0].disable()
+        threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        with self._lock:
+            stats = pstats.Stats(*self._profiles, stream=sys.stderr)
+        if out_path:
+            stats.dump_stats(out_path.with_suffix('.pstats'))
+            logger.info(f"Wrote profile to {out_path.with_suffix('.pstats')}")
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        
+        logger.info(f"Peak traced Python memory: {peak / (1024 * 1024):.1f} MB; top allocation sites:")
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+            logger.info(f"  {stat}")
+
+
+@contextlib.contextmanager
+def profiling(enabled: bool, out_path: Optional[Path] = None) -> Iterator[None]:
+    """Wrap the run in cProfile and tracemalloc when enabled."""
+    if not enabled:
+        yield
+        return
+    profiler = _ThreadProfiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop(out_path)
+
+
+class ClientContext:
+    """
+    Run-scoped clients shared by every call site.
+    
+    Holds one requests.Session for Google calls and one BlobServiceClient /
+    ContainerClient for Azure, both backed by pooled keep-alive connections,
+    so TLS handshakes and pool setup happen once per run instead of per item.
+    Each service also gets a RateController that adapts concurrency to its
+    throttling responses.
+    """
+    
+    def __init__(self, azure_config: dict, pool_size: int = DEFAULT_POOL_SIZE):
+        from azure.storage.blob import BlobServiceClient
+        
+        self.azure_config = azure_config
+        self.http = _pooled_session(pool_size)
+        self.google_limiter = RateController('Google Photos', pool_size)
+        self.azure_limiter = RateController('Azure Storage', pool_size)
+        self.metrics = RunMetrics()
+        self.blob_locks = BlobNameLocks()
+        
+        # Azure SDK transport reuses our session rather than opening its own
+        self._azure_session = _pooled_session(pool_size)
+        # account_url points at a local emulator such as Azurite
+        account_url = azure_config.get('account_url') or \
+            f"https://{azure_config['storage_account_name']}.blob.core.windows.net"
+        throttle_policy = _AzureThrottlePolicy(self.azure_limiter)
+        self.blob_service_client = BlobServiceClient(
+            account_url=account_url,
+            credential=azure_config['storage_account_key'],
+            session=self._azure_session,
+            session_owner=False,
+            # Private hook, but the storage clients ignore azure.core's public
+            # per_retry_policies; it places the policy after the retry policy,
+            # so every attempt is seen. requirements.txt caps the SDK version.
+            _additional_pipeline_policies=[throttle_policy]
+        )
+        if throttle_policy.next is None:
+            logger.warning(
+                "This azure-storage-blob version did not install the Azure throttle policy; "
+                "Azure throttling will only be handled by the SDK's own retries"
+            )
+        self.container_client = self.blob_service_client.get_container_client(
+            azure_config['container_name']
+        )
+        
+        # Optional local index of the container and cache of originals, attached by main()
+        self.catalog: Optional['BlobCatalog'] = None
+        self.originals: Optional['OriginalsCache'] = None
+    
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET a Google URL through the rate controller, retrying throttled and transient failures."""
+        return _request_with_backoff(self.http, self.google_limiter, 'GET', url, **kwargs)
+    
+    def close(self) -> None:
+        """Close pooled connections."""
+        self.google_limiter.log_summary()
+        self.azure_limiter.log_summary()
+        self.blob_service_client.close()
+        self._azure_session.close()
+        self.http.close()
+    
+    def __enter__(self) -> 'ClientContext':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ByteBudget:
+    """
+    Global cap on the number of downloaded bytes held in memory at once.
+    
+    Workers acquire the size of an item before reading its body and release it
+    once the upload has finished. A single item larger than the whole budget is
+    clamped to the budget so it can still run, just on its own.
+    """
+    
+    def __init__(self, max_bytes: int, metrics: Optional[RunMetrics] = None):
+        self.max_bytes = max(1, max_bytes)
+        self.in_flight = 0
+        self._metrics = metrics
+        self._cond = threading.Condition()
+    
+    def acquire(self, num_bytes: int) -> int:
+        """Block until num_bytes fit in the budget; returns the amount reserved."""
+        num_bytes = min(max(num_bytes, 0), self.max_bytes)
+        with self._cond:
+            waited_since = None
+            while self.in_flight and self.in_flight + num_bytes > self.max_bytes:
+                waited_since = waited_since or time.monotonic()
+                self._cond.wait()
+            self.in_flight += num_bytes
+        if waited_since and self._metrics:
+            self._metrics.observe('budget_wait', time.monotonic() - waited_since)
+        return num_bytes
+    
+    def try_acquire(self, num_bytes: int) -> bool:
+        """Reserve num_bytes only if they fit right now."""
+        num_bytes = min(max(num_bytes, 0), self.max_bytes)
+        with self._cond:
+            if self.in_flight and self.in_flight + num_bytes > self.max_bytes:
+                return False
+            self.in_flight += num_bytes
+        return True
+    
+    def release(self, num_bytes: int) -> None:
+        """Return a previous reservation to the budget."""
+        num_bytes = min(max(num_bytes, 0), self.max_bytes)
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - num_bytes)
+            self._cond.notify_all()
+
+
+class BlobNameLocks:
+    """
+    One lock per blob name being written in this run.
+    
+    Items that resolve to the same blob name (e.g. every item of a session
+    with a customFilename) must take turns: committing a block list discards
+    any other upload's uncommitted blocks for that blob.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = {}
+    
+    @contextlib.contextmanager
+    def hold(self, name: str) -> Iterator[None]:
+        with self._lock:
+            entry = self._held.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(blocking=False):
+                logger.warning(f"Another item in this run is writing {name}; waiting for it to finish")
+                entry[0].acquire()
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._held[name]
+
+
+class _ChunkPrefetcher:
+    """
+    Read a streamed response body ahead of the consumer in fixed-size chunks.
+    
+    A background thread pulls chunks off the socket into a small bounded queue
+    while the caller uploads the previous one, so download and upload overlap
+    and memory per item stays at a few chunks regardless of item size. Every
+    queued chunk is charged to the byte budget; the consumer releases a chunk
+    once it has been uploaded, and close() returns whatever it still holds.
+    
+    If the body breaks off part-way and a reopen callable is given, the rest
+    is requested again from the first byte not yet read, up to MAX_RETRIES
+    times. The response is closed as soon as the body has been read.
+    """
+    
+    _END = object()
+    
+    def __init__(
+        self,
+        response: requests.Response,
+        chunk_size: int,
+        byte_budget: Optional[ByteBudget] = None,
+        depth: int = STREAM_QUEUE_DEPTH,
+        metrics: Optional[RunMetrics] = None,
+        reopen: Optional[Callable[[int], requests.Response]] = None
+    ):
+        self._response = response
+        self._chunk_size = chunk_size
+        self._byte_budget = byte_budget
+        self._metrics = metrics
+        self._reopen = reopen
+        self._handed_out = 0
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+    
+    def _put(self, obj) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(obj, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _read(self) -> None:
+        import requests
+        
+        offset = 0
+        resumes = 0
+        try:
+            while True:
+                try:
+                    started = time.monotonic()
+                    for chunk in self._response.iter_content(chunk_size=self._chunk_size):
+                        if not chunk:
+                            continue
+                        if self._metrics:
+                            self._metrics.observe('download', time.monotonic() - started, len(chunk))
+                        if self._byte_budget:
+                            self._byte_budget.acquire(len(chunk))
+                        if not self._put(chunk):
+                            self._return(len(chunk))
+                            return
+                        offset += len(chunk)
+                        started = time.monotonic()
+                    break
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                    if self._reopen is None or resumes == MAX_RETRIES or self._stop.is_set():
+                        raise
+                    resumes += 1
+                    logger.warning(f"Download broke off after {offset} bytes ({e}); resuming")
+                    self._response.close()
+                    self._response = self._reopen(offset)
+            self._put(self._END)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._response.close()
+    
+    def release(self, chunk: bytes) -> None:
+        """Return a consumed chunk to the byte budget."""
+        self._handed_out -= len(chunk)
+        self._return(len(chunk))
+    
+    def _return(self, num_bytes: int) -> None:
+        if self._byte_budget:
+            self._byte_budget.release(num_bytes)
+    
+    def __iter__(self):
+        while True:
+            obj = self._queue.get()
+            if obj is self._END:
+                return
+            if isinstance(obj, Exception):
+                raise obj
+            self._handed_out += len(obj)
+            yield obj
+    
+    def close(self) -> None:
+        """Stop the reader and release any chunks still queued or not yet released by the consumer."""
+        self._stop.set()
+        self._response.close()
+        self._drain()
+        self._thread.join()
+        self._drain()
+        self._return(self._handed_out)
+        self._handed_out = 0
+    
+    def _drain(self) -> None:
+        while True:
+            try:
+                obj = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(obj, bytes):
+                self._return(len(obj))
+
+
+class _RangePrefetcher:
+    """
+    Download a large body as parallel HTTP Range requests, yielding parts in order.
+    
+    The first part is read from the response that is already open; the rest
+    are fetched as byte ranges by up to `parts` threads. Parts are yielded
+    strictly in order so they can be hashed and staged as blocks exactly like
+    a sequential stream, while the following ranges are still downloading.
+    Lookahead ranges are only started when the byte budget has room right
+    away, so a worker never waits for budget while holding unconsumed parts.
+    close() returns the budget of every part not released by the consumer,
+    the first one included, even if iteration never started.
+    """
+    
+    def __init__(
+        self,
+        response: requests.Response,
+        clients: ClientContext,
+        download_url: str,
+        auth: TokenProvider,
+        total_size: int,
+        part_size: int,
+        parts: int,
+        byte_budget: Optional[ByteBudget] = None
+    ):
+        self._clients = clients
+        self._download_url = download_url
+        self._auth = auth
+        self._total_size = total_size
+        self._part_size = part_size
+        self._parts = parts
+        self._byte_budget = byte_budget
+        self._pending = collections.deque()
+        self._executor = ThreadPoolExecutor(max_workers=parts)
+        
+        # Part 0 comes from the response that is already open, or as a range
+        # through the retry path if that stream breaks off
+        import requests
+        
+        if byte_budget:
+            byte_budget.acquire(part_size)
+        first = bytearray()
+        started = time.monotonic()
+        try:
+            try:
+                for piece in response.iter_content(chunk_size=64 * 1024):
+                    first += piece
+                    if len(first) >= part_size:
+                        break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                logger.warning(f"Download broke off after {len(first)} bytes ({e}); fetching the first part as a range")
+                response.close()
+                clients.google_limiter.on_throttle(None)
+                clients.google_limiter.retries += 1
+                first = bytearray(self._fetch(0, part_size - 1))
+            if len(first) < part_size:
+                raise IOError(f"Download ended after {len(first)} of {total_size} bytes")
+        except Exception:
+            if byte_budget:
+                byte_budget.release(part_size)
+            self._executor.shutdown()
+            raise
+        finally:
+            response.close()
+        self._first = bytes(first[:part_size])
+        self._held = part_size
+        self._next_offset = part_size
+        clients.metrics.observe('download', time.monotonic() - started, part_size)
+    
+    @staticmethod
+    def supported(response: requests.Response, part_size: int, min_size: int) -> bool:
+        """True if the response is large enough and the server accepts byte ranges."""
+        total_size = int(response.headers.get('Content-Length') or 0)
+        return (
+            response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            and not response.headers.get('Content-Encoding')
+            and total_size >= max(min_size, 2 * part_size)
+        )
+    
+    def _fetch(self, start: int, end: int) -> bytes:
+        with self._clients.metrics.timed('download', end - start + 1):
+            response = self._clients.get(
+                self._download_url, auth=self._auth, headers={'Range': f"bytes={start}-{end}"}
+            )
+        response.raise_for_status()
+        if response.status_code != 206 or len(response.content) != end - start + 1:
+            raise IOError(f"Range {start}-{end} returned HTTP {response.status_code} with {len(response.content)} bytes")
+        return response.content
+    
+    def _submit_more(self) -> None:
+        while self._next_offset < self._total_size and len(self._pending) < self._parts:
+            start = self._next_offset
+            size = min(self._part_size, self._total_size - start)
+            if self._byte_budget:
+                if not self._pending:
+                    # Holding nothing, so it is safe to wait for room
+                    self._byte_budget.acquire(size)
+                elif not self._byte_budget.try_acquire(size):
+                    break
+            self._pending.append((self._executor.submit(self._fetch, start, start + size - 1), size))
+            self._next_offset += size
+    
+    def release(self, chunk: bytes) -> None:
+        """Return a consumed part to the byte budget."""
+        self._held -= len(chunk)
+        if self._byte_budget:
+            self._byte_budget.release(len(chunk))
+    
+    def __iter__(self):
+        self._submit_more()
+        yield self._first
+        while self._pending:
+            future, size = self._pending[0]
+            data = future.result()
+            self._pending.popleft()
+            self._held += size
+            self._submit_more()
+            yield data
+    
+    def close(self) -> None:
+        """Cancel outstanding ranges and release their budget, and that of parts not yet released."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        while self._pending:
+            future, size = self._pending.popleft()
+            self._held += size
+        if self._byte_budget:
+            self._byte_budget.release(self._held)
+        self._held = 0
+
+
+class _MappedChunks:
+    """
+    Chunks of a cached original read from its memory map, in place of a download.
+    
+    Has the same interface as _ChunkPrefetcher, so the upload code does not
+    care where the bytes come from. Nothing is charged to the byte budget:
+    the page cache holds the file, and only the chunk being uploaded is copied.
+    """
+    
+    def __init__(self, original: CachedOriginal, chunk_size: int, metrics: Optional[RunMetrics] = None):
+        self._original = original
+        self._chunk_size = chunk_size
+        self._metrics = metrics
+    
+    def __iter__(self):
+        for offset in range(0, self._original.size, self._chunk_size):
+            started = time.monotonic()
+            chunk = self._original.read(offset, self._chunk_size)
+            if self._metrics:
+                self._metrics.observe('cache_read', time.monotonic() - started, len(chunk))
+            yield chunk
+    
+    def release(self, chunk: bytes) -> None:
+        pass
+    
+    def close(self) -> None:
+        pass
+
+
+def run_media_items(
+    media_items: Iterable[Dict],
+    process_item: Callable[[int, Dict], bool],
+    workers: int = DEFAULT_WORKERS,
+    metrics: Optional[RunMetrics] = None
+) -> Tuple[int, int]:
+    """
+    Run process_item over every media item, optionally on a bounded thread pool.
+    
+    Items are handed to workers as media_items yields them, so a streamed
+    listing keeps paging while the first items transfer. If the listing
+    fails part-way, the items already listed still finish and the failure
+    counts as one failed item.
+    
+    Args:
+        media_items: Media items returned by the Picker API, as a list or a stream
+        process_item: Callable taking (1-based index, item) and returning success
+        workers: Number of items to download/upload concurrently
+        metrics: Optional run metrics; records how long items wait for a worker
+        
+    Returns:
+        Tuple of (successful, failed) counts
+    """
+    successful = 0
+    failed = 0
+    
+    def listed() -> Iterator[Tuple[int, Dict]]:
+        nonlocal failed
+        try:
+            yield from enumerate(media_items, 1)
+        except Exception as e:
+            logger.error(f"Listing media items failed part-way: {e}")
+            failed += 1
+    
+    if workers <= 1:
+        for i, item in listed():
+            if process_item(i, item):
+                successful += 1
+            else:
+                failed += 1
+        return successful, failed
+    
+    def queued_item(i: int, item: Dict, submitted: float) -> bool:
+        if metrics:
+            metrics.observe('queue_wait', time.monotonic() - submitted)
+        return process_item(i, item)
+    
+    logger.info(f"Processing with {workers} concurrent workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(queued_item, i, item, time.monotonic()): i
+            for i, item in listed()
+        }
+        for future in as_completed(futures):
+            try:
+                ok = future.result()
+            except Exception as e:
+                logger.error(f"Error processing media item {futures[future]}: {e}")
+                ok = False
+            if ok:
+                successful += 1
+            else:
+                failed += 1
+    
+    return successful, failed
+
 
-def load_azure_config() -> dict:
+def load_azure_config(config_file: Path = AZURE_CONFIG_FILE) -> dict:
     """Load Azure Storage configuration from JSON file."""
-    if not AZURE_CONFIG_FILE.exists():
-        logger.error(f"Azure config file not found: {AZURE_CONFIG_FILE}")
+    if not config_file.exists():
+        logger.error(f"Azure config file not found: {config_file}")
         sys.exit(1)
     
-    with open(AZURE_CONFIG_FILE, 'r') as f:
+    with open(config_file, 'r') as f:
         config = json.load(f)
     
     # Validate required keys
@@ -53,10 +1152,10 @@ def load_azure_config() -> dict:
     if missing_keys:
         logger.error(f"Azure config missing required keys: {missing_keys}")
         logger.error(f"Config has keys: {list(config.keys())}")
-        logger.error(f"Please check {AZURE_CONFIG_FILE}")
+        logger.error(f"Please check {config_file}")
         sys.exit(1)
     
-    logger.info(f"Loaded Azure config from {AZURE_CONFIG_FILE}")
+    logger.info(f"Loaded Azure config from {config_file}")
     return config
 
 
@@ -67,6 +1166,9 @@ def get_google_credentials() -> Credentials:
     Returns:
         Credentials object for Google Photos API
     """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    
     creds = None
     
     # Check if token file exists
@@ -112,551 +1214,3605 @@ def get_google_credentials() -> Credentials:
     return creds
 
 
-def list_metadata_files_from_azure(azure_config: dict) -> List[str]:
-    """
-    List all JSON metadata files in Azure Storage.
-    
-    Args:
-        azure_config: Azure Storage configuration
-        
-    Returns:
-        List of blob names (JSON metadata files)
-    """
-    try:
-        storage_account_name = azure_config['storage_account_name']
-        storage_account_key = azure_config['storage_account_key']
-        container_name = azure_config['container_name']
-        
-        # Create blob service client
-        account_url = f"https://{storage_account_name}.blob.core.windows.net"
-        blob_service_client = BlobServiceClient(
-            account_url=account_url,
-            credential=storage_account_key
-        )
-        
-        container_client = blob_service_client.get_container_client(container_name)
-        
-        # List all JSON files
-        json_blobs = []
-        for blob in container_client.list_blobs():
-            if blob.name.endswith('.json'):
-                json_blobs.append(blob.name)
-        
-        logger.info(f"Found {len(json_blobs)} JSON metadata file(s) in Azure Storage")
-        return json_blobs
-        
-    except Exception as e:
-        logger.error(f"Error listing metadata files from Azure: {e}")
-        return []
+def _as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """google-auth keeps expiry as naive UTC; make it comparable with aware datetimes."""
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
 
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(abs(seconds)), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
 
-def download_metadata_from_azure(blob_name: str, azure_config: dict) -> Optional[Dict]:
+
+class TokenExpiredError(RuntimeError):
+    """The access token has expired or been rejected, and cannot be refreshed."""
+
+
+class TokenProvider:
     """
-    Download a JSON metadata file from Azure Storage.
+    Thread-safe Google access token shared by every worker of a session.
     
-    Args:
-        blob_name: Name of the blob to download
-        azure_config: Azure Storage configuration
-        
-    Returns:
-        Metadata dictionary or None if failed
+    Passed to requests as the auth hook, so the Authorization header is set
+    when each request is sent, not when the item was queued. With a refresh
+    callback, a background thread refreshes the token
+    TOKEN_REFRESH_AHEAD_SECONDS before it expires. A worker that still finds
+    it expired, or gets a 401, refreshes it under the lock, and the workers
+    waiting on that lock reuse the new token instead of refreshing again.
+    Without a callback (a session file's bare access token), an expired or
+    rejected token raises TokenExpiredError at once instead of sending
+    requests that are bound to fail.
     """
-    try:
-        storage_account_name = azure_config['storage_account_name']
-        storage_account_key = azure_config['storage_account_key']
-        container_name = azure_config['container_name']
+    
+    def __init__(
+        self,
+        token: str,
+        expiry: Optional[datetime] = None,
+        refresh: Optional[Callable[[], Tuple[str, Optional[datetime]]]] = None,
+        source: str = 'access token'
+    ):
+        self._token = token
+        self._expiry = _as_utc(expiry)
+        self._refresh = refresh
+        self._source = source
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+    
+    @classmethod
+    def from_credentials(cls, creds: Credentials) -> 'TokenProvider':
+        """Track OAuth credentials from token.json, refreshing (and re-saving) them when possible."""
+        from google.auth.transport.requests import Request
         
-        # Create blob service client
-        account_url = f"https://{storage_account_name}.blob.core.windows.net"
-        blob_service_client = BlobServiceClient(
-            account_url=account_url,
-            credential=storage_account_key
-        )
+        def refresh() -> Tuple[str, Optional[datetime]]:
+            creds.refresh(Request())
+            TOKEN_FILE.write_text(creds.to_json())
+            return creds.token, creds.expiry
         
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name,
-            blob=blob_name
-        )
+        return cls(creds.token, creds.expiry, refresh if creds.refresh_token else None, TOKEN_FILE.name)
+    
+    @classmethod
+    def from_session(cls, metadata: Dict, clients: ClientContext) -> 'TokenProvider':
+        """
+        Track a session file's access token, working out when it expires.
         
-        # Download blob content
-        blob_data = blob_client.download_blob().readall()
-        metadata = json.loads(blob_data)
-        
-        logger.info(f"Downloaded metadata: {blob_name}")
-        return metadata
+        Uses accessTokenExpiresAt as written by photo-picker.html. For older
+        session files, Google's tokeninfo endpoint is asked, and if that is
+        unreachable, createdAt plus TOKEN_LIFETIME_SECONDS is used.
+        """
+        token = metadata['accessToken']
+        expiry = None
+        if metadata.get('accessTokenExpiresAt'):
+            expiry = datetime.fromisoformat(metadata['accessTokenExpiresAt'].replace('Z', '+00:00'))
+        else:
+            try:
+                response = clients.http.post(TOKENINFO_URL, data={'access_token': token}, timeout=10)
+                if response.ok:
+                    expiry = datetime.now(timezone.utc) + timedelta(seconds=int(response.json()['expires_in']))
+                elif response.status_code == 400:
+                    # tokeninfo rejects expired and revoked tokens
+                    expiry = datetime.now(timezone.utc)
+            except Exception as e:
+                logger.warning(f"Could not look up the access token's expiry: {e}")
+            if expiry is None and metadata.get('createdAt'):
+                created = datetime.fromisoformat(metadata['createdAt'].replace('Z', '+00:00'))
+                expiry = created + timedelta(seconds=TOKEN_LIFETIME_SECONDS)
+        return cls(token, expiry, source='session access token')
+    
+    @property
+    def refreshable(self) -> bool:
+        return self._refresh is not None
+    
+    def remaining(self) -> Optional[float]:
+        """Seconds until the token expires (negative once it has), or None if unknown."""
+        if self._expiry is None:
+            return None
+        return (self._expiry - datetime.now(timezone.utc)).total_seconds()
+    
+    def describe(self) -> str:
+        remaining = self.remaining()
+        if remaining is None:
+            return f"{self._source} expiry unknown"
+        if remaining > 0:
+            return f"{self._source} expires in {_format_seconds(remaining)}"
+        return f"{self._source} expired {_format_seconds(remaining)} ago"
+    
+    def token(self) -> str:
+        """Current token, refreshed first if it has expired."""
+        with self._lock:
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                if not self._refresh:
+                    raise TokenExpiredError(f"{self.describe()} and cannot be refreshed")
+                self._refresh_locked()
+            return self._token
+    
+    def on_unauthorized(self, rejected: Optional[str]) -> None:
+        """
+        Handle a 401 for the given Authorization header.
         
-    except Exception as e:
-        logger.error(f"Error downloading metadata from Azure: {e}")
-        return None
+        If another worker has already replaced that token, nothing happens.
+        Otherwise the token is refreshed, or, if it cannot be, marked as
+        expired so later requests fail fast.
+        """
+        with self._lock:
+            if rejected != f"Bearer {self._token}":
+                return
+            if self._refresh:
+                self._refresh_locked()
+            else:
+                logger.error(f"{self._source} was rejected ({self.describe()}); it cannot be refreshed")
+                self._expiry = datetime.now(timezone.utc)
+    
+    def _refresh_locked(self) -> None:
+        token, expiry = self._refresh()
+        self._token, self._expiry = token, _as_utc(expiry)
+        self.refreshes += 1
+        logger.info(f"Refreshed Google access token; {self.describe()}")
+    
+    def __call__(self, request):
+        request.headers['Authorization'] = f"Bearer {self.token()}"
+        return request
+    
+    def _refresh_ahead(self) -> None:
+        while True:
+            remaining = self.remaining()
+            if remaining is None:
+                return
+            if self._stop.wait(max(remaining - TOKEN_REFRESH_AHEAD_SECONDS, 0)):
+                return
+            try:
+                with self._lock:
+                    remaining = self.remaining()
+                    if remaining is not None and remaining <= TOKEN_REFRESH_AHEAD_SECONDS:
+                        self._refresh_locked()
+            except Exception as e:
+                logger.warning(f"Refreshing the access token ahead of expiry failed ({e}); "
+                               f"retrying in {TOKEN_RETRY_SECONDS}s, {self.describe()}")
+                if self._stop.wait(TOKEN_RETRY_SECONDS):
+                    return
+    
+    def start(self) -> 'TokenProvider':
+        """Start refreshing ahead of expiry in the background, if the token can be refreshed."""
+        if self._refresh and self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_ahead, name='token-refresh', daemon=True)
+            self._thread.start()
+        return self
+    
+    def close(self) -> None:
+        self._stop.set()
+    
+    def __enter__(self) -> 'TokenProvider':
+        return self.start()
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
-def download_image_from_google_photos(download_url: str, creds: Credentials) -> Optional[bytes]:
+def list_metadata_files_from_azure(clients: ClientContext, prefix: str = SESSION_PREFIX) -> List[str]:
     """
-    Download an image from Google Photos using the download URL.
+    List JSON metadata files under a prefix in Azure Storage.
+    
+    With a catalog attached, only that prefix is re-listed to pick up changes
+    and the names are read from the catalog; the rest of the container (every
+    uploaded image) is never scanned.
     
     Args:
-        download_url: The download URL from the metadata
-        creds: Google API credentials
+        clients: Run-scoped client context
+        prefix: Blob name prefix to list
         
     Returns:
-        Image data as bytes or None if failed
+        List of blob names (JSON metadata files)
     """
     try:
-        headers = {'Authorization': f'Bearer {creds.token}'}
-        
-        logger.info(f"Downloading image from Google Photos...")
-        response = requests.get(download_url, headers=headers)
-        response.raise_for_status()
+        if clients.catalog:
+            clients.catalog.refresh(clients.container_client, prefix)
+            names = clients.catalog.names(prefix)
+        else:
+            names = [blob.name for blob in clients.container_client.list_blobs(name_starts_with=prefix)]
         
-        logger.info(f"Successfully downloaded image ({len(response.content)} bytes)")
-        return response.content
+        json_blobs = [name for name in names if name.endswith('.json')]
+        logger.info(f"Found {len(json_blobs)} JSON metadata file(s) in Azure Storage")
+        return json_blobs
         
     except Exception as e:
-        logger.error(f"Error downloading image from Google Photos: {e}")
-        return None
+        logger.error(f"Error listing metadata files from Azure: {e}")
+        return []
 
 
-def upload_image_to_azure(
-    image_data: bytes,
-    blob_name: str,
-    azure_config: dict,
-    content_type: str = 'image/jpeg'
-) -> bool:
+def download_metadata_from_azure(blob_name: str, clients: ClientContext) -> Optional[Dict]:
     """
-    Upload image data to Azure Blob Storage.
+    Download a JSON metadata file from Azure Storage.
     
     Args:
-        image_data: Image data as bytes
-        blob_name: Name for the blob
-        azure_config: Azure Storage configuration
-        content_type: MIME type of the image
+        blob_name: Name of the blob to download
+        clients: Run-scoped client context
         
     Returns:
-        True if successful, False otherwise
+        Metadata dictionary or None if failed
     """
     try:
-        storage_account_name = azure_config['storage_account_name']
-        storage_account_key = azure_config['storage_account_key']
-        container_name = azure_config['container_name']
+        blob_client = clients.container_client.get_blob_client(blob_name)
         
-        # Create blob service client
-        account_url = f"https://{storage_account_name}.blob.core.windows.net"
-        blob_service_client = BlobServiceClient(
-            account_url=account_url,
-            credential=storage_account_key
-        )
-        
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name,
-            blob=blob_name
-        )
-        
-        # Upload blob
-        blob_client.upload_blob(
-            image_data,
-            overwrite=True,
-            content_settings=ContentSettings(content_type=content_type)
-        )
+        # Download blob content
+        blob_data = blob_client.download_blob().readall()
+        metadata = json.loads(blob_data)
         
-        blob_url = blob_client.url
-        logger.info(f"Successfully uploaded image to Azure: {blob_url}")
-        return True
+        logger.info(f"Downloaded metadata: {blob_name}")
+        return metadata
         
     except Exception as e:
-        logger.error(f"Error uploading image to Azure: {e}")
-        return False
+        logger.error(f"Error downloading metadata from Azure: {e}")
+        return None
 
 
-def process_picker_session_with_token(session_id: str, access_token: str, azure_config: dict, custom_filename: Optional[str] = None) -> bool:
+def list_pending_session_files(clients: ClientContext) -> List[str]:
     """
-    Process a Picker session using an access token: fetch media items and upload them to Azure.
+    List session metadata blobs that have not been processed yet.
+    
+    Processed and failed sessions are moved under their own prefixes, so a
+    prefix-scoped listing of picker-session-* only returns pending work.
     
     Args:
-        session_id: The Picker session ID
-        access_token: OAuth access token
-        azure_config: Azure Storage configuration
-        custom_filename: Optional custom filename to use instead of original
+        clients: Run-scoped client context
         
     Returns:
-        True if successful, False otherwise
+        List of pending session blob names
     """
-    logger.info(f"\n{'='*60}")
-    logger.info(f"Processing Picker Session: {session_id}")
-    logger.info(f"Using access token from session file")
-    if custom_filename:
-        logger.info(f"Custom filename: {custom_filename}")
-    logger.info(f"{'='*60}")
-    
-    try:
-        # Fetch media items from the session using the access token
-        media_items = fetch_session_media_items_with_token(session_id, access_token)
-        
-        if not media_items:
-            logger.warning("No media items found in session")
-            return False
-        
-        logger.info(f"Found {len(media_items)} media item(s) in session")
-        
-        # Process each media item
-        successful = 0
-        failed = 0
-        
-        for i, item in enumerate(media_items, 1):
-            # Log the full item structure to understand what we got
-            logger.info(f"\nMedia item {i} structure: {json.dumps(item, indent=2)}")
-            
-            # Extract data from the nested mediaFile object
-            media_file = item.get('mediaFile', {})
-            original_filename = media_file.get('filename', f'photo-{i}.jpg')
-            
-            # Use custom filename if provided, otherwise use original
-            filename = custom_filename if custom_filename else original_filename
-            
-            download_url = media_file.get('baseUrl')
-            mime_type = media_file.get('mimeType', 'image/jpeg')
-            
-            logger.info(f"\n[{i}/{len(media_items)}] Processing: {filename}")
-            if custom_filename:
-                logger.info(f"  Original: {original_filename}")
-                logger.info(f"  Custom: {filename}")
-            
-            if not download_url:
-                logger.error("No baseUrl found for media item")
-                failed += 1
-                continue
-            
-            # Download image using access token
-            download_url_with_param = f"{download_url}=d"
-            image_data = download_image_with_token(download_url_with_param, access_token)
-            
-            if not image_data:
-                failed += 1
-                continue
-            
-            # Upload to Azure
-            if upload_image_to_azure(image_data, filename, azure_config, mime_type):
-                successful += 1
-            else:
-                failed += 1
-        
-        # Summary
-        logger.info(f"\n{'='*60}")
-        logger.info(f"SESSION PROCESSING COMPLETE")
-        logger.info(f"{'='*60}")
-        logger.info(f"Total items: {len(media_items)}")
-        logger.info(f"Successful: {successful}")
-        logger.info(f"Failed: {failed}")
-        
-        return failed == 0
-        
-    except Exception as e:
-        logger.error(f"Error processing session: {e}")
-        return False
+    session_files = list_metadata_files_from_azure(clients, SESSION_PREFIX)
+    logger.info(f"Found {len(session_files)} pending session file(s) in Azure Storage")
+    return session_files
 
 
-def fetch_session_media_items_with_token(session_id: str, access_token: str) -> List[Dict]:
+def move_session_blob(blob_name: str, dest_prefix: str, clients: ClientContext) -> bool:
     """
-    Fetch all media items from a Picker session using an access token.
+    Move a session metadata blob under dest_prefix with a server-side copy.
+    
+    The catalog follows the move: the copy is recorded once it succeeds and
+    the source row is dropped with the source blob.
     
     Args:
-        session_id: The Picker session ID
-        access_token: OAuth access token
+        blob_name: Name of the session blob
+        dest_prefix: Destination prefix (PROCESSED_PREFIX or FAILED_PREFIX)
+        clients: Run-scoped client context
         
     Returns:
-        List of media item dictionaries
+        True if successful, False otherwise
     """
     try:
-        headers = {'Authorization': f'Bearer {access_token}'}
-        base_url = 'https://photospicker.googleapis.com/v1/mediaItems'
+        source = clients.container_client.get_blob_client(blob_name)
+        dest = clients.container_client.get_blob_client(f"{dest_prefix}{blob_name}")
         
-        all_items = []
-        page_token = None
-        
-        while True:
-            # Build query parameters
-            params = {'sessionId': session_id}
-            if page_token:
-                params['pageToken'] = page_token
-            
-            logger.info(f"Fetching media items from: {base_url}?sessionId={session_id}")
-            
-            response = requests.get(base_url, headers=headers, params=params)
-            
-            if not response.ok:
-                logger.error(f"HTTP {response.status_code}: {response.reason}")
-                try:
-                    error_data = response.json()
-                    logger.error(f"Error response: {json.dumps(error_data, indent=2)}")
-                except:
-                    logger.error(f"Error response: {response.text}")
-                
-                # Check if session exists by querying session status
-                logger.info("Checking session status...")
-                session_url = f'https://photospicker.googleapis.com/v1/sessions/{session_id}'
-                session_response = requests.get(session_url, headers=headers)
-                if session_response.ok:
-                    session_data = session_response.json()
-                    logger.info(f"Session status: {json.dumps(session_data, indent=2)}")
-                    
-                    # Check for pickup token or other properties
-                    if 'pickupToken' in session_data:
-                        logger.info(f"Found pickup token: {session_data['pickupToken']}")
-                        logger.error("This session uses a pickup token - you may need to use the Library API instead")
-                    
-                    if not session_data.get('mediaItemsSet'):
-                        logger.error("Session exists but mediaItemsSet is false - user may not have completed selection")
-                    else:
-                        logger.error("Session shows mediaItemsSet=true but /mediaItems endpoint returns 404")
-                        logger.error("This may be a limitation of the Picker API - it might not support listing media items")
-                else:
-                    logger.error(f"Session not found or expired (HTTP {session_response.status_code})")
-                
-                response.raise_for_status()
-            
-            data = response.json()
-            items = data.get('mediaItems', [])
-            all_items.extend(items)
-            
-            logger.info(f"Fetched {len(items)} items (total: {len(all_items)})")
-            
-            page_token = data.get('nextPageToken')
-            if not page_token:
-                break
+        copy = dest.start_copy_from_url(source.url)
+        status = copy.get('copy_status')
+        etag = copy.get('etag')
+        while status == 'pending':
+            time.sleep(0.5)
+            properties = dest.get_blob_properties()
+            status, etag = properties.copy.status, properties.etag
+        if status != 'success':
+            logger.error(f"Copy of {blob_name} to {dest_prefix} ended with status: {status}")
+            return False
+        if clients.catalog:
+            row = clients.catalog.get(blob_name) or {}
+            clients.catalog.record(dest.blob_name, size=row.get('size'), etag=etag, sha256=row.get('sha256'))
         
-        return all_items
+        source.delete_blob()
+        if clients.catalog:
+            clients.catalog.remove(blob_name)
+        logger.info(f"Moved {blob_name} to {dest_prefix}{blob_name}")
+        return True
         
     except Exception as e:
-        logger.error(f"Error fetching session media items: {e}")
-        return []
+        logger.error(f"Error moving {blob_name} to {dest_prefix}: {e}")
+        return False
+
+
+class ContentHasher:
+    """MD5 and SHA-256 of a blob, computed incrementally as chunks pass through."""
+    
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+    
+    def update(self, chunk: bytes) -> None:
+        self._md5.update(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+    
+    @property
+    def md5(self) -> bytes:
+        return self._md5.digest()
+    
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+    
+    def matches(self, properties) -> bool:
+        """True if an existing blob's stored hash matches this content."""
+        if properties.size != self.size:
+            return False
+        stored_sha256 = (properties.metadata or {}).get(HASH_METADATA_KEY)
+        if stored_sha256:
+            return stored_sha256 == self.sha256
+        stored_md5 = properties.content_settings.content_md5
+        return bool(stored_md5) and bytes(stored_md5) == self.md5
 
 
-def download_image_with_token(download_url: str, access_token: str) -> Optional[bytes]:
+class SessionJournal:
     """
-    Download an image from Google Photos using an access token.
+    Crash-safe local journal of per-item progress, keyed by session and media item ID.
     
-    Args:
-        download_url: The download URL with parameters
-        access_token: OAuth access token
-        
-    Returns:
-        Image data as bytes or None if failed
+    Each item moves through listed -> downloaded -> uploaded (or failed), and
+    the uploaded state records the blob name and ETag. A --resume rerun reads
+    the journal and only transfers items that have not been uploaded yet.
+    SQLite in WAL mode keeps every update durable without slowing workers down.
     """
-    try:
-        headers = {'Authorization': f'Bearer {access_token}'}
-        
-        logger.info(f"Downloading image from Google Photos...")
-        response = requests.get(download_url, headers=headers)
-        response.raise_for_status()
-        
-        logger.info(f"Successfully downloaded image ({len(response.content)} bytes)")
-        return response.content
-        
-    except Exception as e:
-        logger.error(f"Error downloading image: {e}")
-        return None
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS items (
+                session_id TEXT NOT NULL,
+                media_item_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                blob_name TEXT,
+                alias TEXT,
+                etag TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (session_id, media_item_id)
+            )'''
+        )
+    
+    def record(
+        self,
+        session_id: str,
+        media_item_id: str,
+        state: str,
+        blob_name: Optional[str] = None,
+        alias: Optional[str] = None,
+        etag: Optional[str] = None,
+        size: Optional[int] = None,
+        sha256: Optional[str] = None
+    ) -> None:
+        """Set an item's state, keeping previously recorded fields that are not given."""
+        with self._lock:
+            self._conn.execute(
+                '''INSERT INTO items (session_id, media_item_id, state, blob_name, alias, etag, size, sha256, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, media_item_id) DO UPDATE SET
+                    state = excluded.state,
+                    blob_name = COALESCE(excluded.blob_name, blob_name),
+                    alias = COALESCE(excluded.alias, alias),
+                    etag = COALESCE(excluded.etag, etag),
+                    size = COALESCE(excluded.size, size),
+                    sha256 = COALESCE(excluded.sha256, sha256),
+                    updated_at = excluded.updated_at''',
+                (session_id, media_item_id, state, blob_name, alias, etag, size, sha256,
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+    
+    def uploaded_items(self, session_id: str) -> Dict[str, Dict]:
+        """Return media item ID -> journal row for every uploaded item in a session."""
+        with self._lock:
+            cursor = self._conn.execute(
+                '''SELECT media_item_id, blob_name, alias, etag, size, sha256 FROM items
+                WHERE session_id = ? AND state = ?''',
+                (session_id, JOURNAL_UPLOADED)
+            )
+            columns = [c[0] for c in cursor.description]
+            return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+    
+    def __enter__(self) -> 'SessionJournal':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
-def process_picker_session(session_id: str, azure_config: dict, creds: Credentials) -> bool:
+def _prefix_condition(prefix: str) -> Tuple[str, Tuple[str, ...]]:
     """
-    Process a Picker session: fetch media items and upload them to Azure.
+    SQL condition (and its parameters) on name matching every name that starts with prefix.
     
-    Args:
-        session_id: The Picker session ID
-        azure_config: Azure Storage configuration
-        creds: Google API credentials
-        
-    Returns:
-        True if successful, False otherwise
+    Written as a range so the primary key index serves it. SQLite compares
+    TEXT as UTF-8 bytes, which sorts by code point, so the upper bound is the
+    prefix with its last character moved to the next code point; a last
+    character that has no successor is dropped and the one before it moved.
     """
-    logger.info(f"\n{'='*60}")
-    logger.info(f"Processing Picker Session: {session_id}")
-    logger.info(f"{'='*60}")
+    end = prefix
+    while end:
+        code_point = ord(end[-1]) + 1
+        if 0xD800 <= code_point <= 0xDFFF:
+            # Surrogates cannot be stored; the next character is U+E000
+            code_point = 0xE000
+        if code_point <= sys.maxunicode:
+            return 'name >= ? AND name < ?', (prefix, end[:-1] + chr(code_point))
+        end = end[:-1]
+    return 'name >= ?', (prefix,)
+
+
+class BlobCatalog:
+    """
+    Local SQLite index of the container: name, size, ETag, content hash,
+    image dimensions and last-modified time for every blob we know about.
     
-    try:
-        # Fetch media items from the session
-        media_items = fetch_session_media_items(session_id, creds)
+    Lookups read the catalog instead of listing the container. It is kept
+    fresh two ways: uploads made by this script are written through as they
+    happen, and refresh() re-lists a single prefix (e.g. picker-session-),
+    only rewriting rows whose ETag changed and dropping blobs that are gone.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS blobs (
+                name TEXT PRIMARY KEY,
+                size INTEGER,
+                etag TEXT,
+                sha256 TEXT,
+                content_md5 TEXT,
+                width INTEGER,
+                height INTEGER,
+                last_modified TEXT
+            )'''
+        )
+    
+    def refresh(
+        self,
+        container_client,
+        prefix: str = '',
+        skip: Tuple[str, ...] = (),
+        subdirs: Optional[Iterable[str]] = None
+    ) -> Tuple[int, int]:
+        """
+        Re-list blobs under prefix and apply changes to the catalog.
         
-        if not media_items:
-            logger.warning("No media items found in session")
-            return False
+        With skip or subdirs, the prefix is listed one level at a time. Blobs
+        and virtual directories starting with a skipped prefix, and virtual
+        directories not named in subdirs (full names ending in '/'), are
+        neither listed nor touched in the catalog.
         
-        logger.info(f"Found {len(media_items)} media item(s) in session")
+        Returns:
+            Tuple of (rows added or changed, rows removed)
+        """
+        subdirs = None if subdirs is None else set(subdirs)
         
-        # Process each media item
-        successful = 0
-        failed = 0
+        def in_scope(name: str) -> bool:
+            if name.startswith(skip):
+                return False
+            if subdirs is None or '/' not in name[len(prefix):]:
+                return True
+            return name[:name.index('/', len(prefix)) + 1] in subdirs
         
-        for i, item in enumerate(media_items, 1):
-            filename = item.get('filename', f'photo-{i}.jpg')
-            download_url = item.get('baseUrl')
-            mime_type = item.get('mimeType', 'image/jpeg')
-            
-            logger.info(f"\n[{i}/{len(media_items)}] Processing: {filename}")
-            
-            if not download_url:
-                logger.error("No baseUrl found for media item")
-                failed += 1
-                continue
-            
-            # Download image
-            download_url_with_param = f"{download_url}=d"
-            image_data = download_image_from_google_photos(download_url_with_param, creds)
-            
-            if not image_data:
-                failed += 1
+        condition, params = _prefix_condition(prefix)
+        with self._lock:
+            known = {
+                name: etag for name, etag in self._conn.execute(
+                    f"SELECT name, etag FROM blobs WHERE {condition}", params
+                ).fetchall()
+                if in_scope(name)
+            }
+        
+        changed = []
+        for blob in self._list(container_client, prefix, skip, subdirs):
+            if known.pop(blob.name, None) == blob.etag:
                 continue
-            
-            # Upload to Azure
-            if upload_image_to_azure(image_data, filename, azure_config, mime_type):
-                successful += 1
-            else:
-                failed += 1
+            content_md5 = blob.content_settings.content_md5 if blob.content_settings else None
+            changed.append((
+                blob.name, blob.size, blob.etag,
+                (blob.metadata or {}).get(HASH_METADATA_KEY),
+                base64.b64encode(bytes(content_md5)).decode() if content_md5 else None,
+                blob.last_modified.isoformat() if blob.last_modified else None,
+            ))
         
-        # Summary
-        logger.info(f"\n{'='*60}")
-        logger.info(f"SESSION PROCESSING COMPLETE")
-        logger.info(f"{'='*60}")
-        logger.info(f"Total items: {len(media_items)}")
-        logger.info(f"Successful: {successful}")
-        logger.info(f"Failed: {failed}")
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                '''INSERT INTO blobs (name, size, etag, sha256, content_md5, last_modified)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    size = excluded.size,
+                    etag = excluded.etag,
+                    sha256 = excluded.sha256,
+                    content_md5 = excluded.content_md5,
+                    last_modified = excluded.last_modified''',
+                changed
+            )
+            self._conn.executemany("DELETE FROM blobs WHERE name = ?", [(name,) for name in known])
+            self._conn.execute('COMMIT')
+        
+        logger.info(f"Catalog refreshed for prefix '{prefix}': {len(changed)} added/changed, {len(known)} removed")
+        return len(changed), len(known)
+    
+    @staticmethod
+    def _list(container_client, prefix: str, skip: Tuple[str, ...], subdirs: Optional[set]) -> Iterator:
+        if not skip and subdirs is None:
+            yield from container_client.list_blobs(name_starts_with=prefix or None, include=['metadata'])
+            return
         
-        return failed == 0
+        from azure.storage.blob import BlobPrefix
         
-    except Exception as e:
-        logger.error(f"Error processing session: {e}")
-        return False
+        for item in container_client.walk_blobs(name_starts_with=prefix or None, include=['metadata']):
+            if item.name.startswith(skip):
+                continue
+            if isinstance(item, BlobPrefix):
+                if subdirs is None or item.name in subdirs:
+                    yield from container_client.list_blobs(name_starts_with=item.name, include=['metadata'])
+            else:
+                yield item
+    
+    def record(
+        self,
+        name: str,
+        size: Optional[int] = None,
+        etag: Optional[str] = None,
+        sha256: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None
+    ) -> None:
+        """Write through a blob this script just stored, keeping fields that are not given."""
+        with self._lock:
+            self._conn.execute(
+                '''INSERT INTO blobs (name, size, etag, sha256, width, height, last_modified)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    size = COALESCE(excluded.size, size),
+                    etag = COALESCE(excluded.etag, etag),
+                    sha256 = COALESCE(excluded.sha256, sha256),
+                    width = COALESCE(excluded.width, width),
+                    height = COALESCE(excluded.height, height),
+                    last_modified = COALESCE(excluded.last_modified, last_modified)''',
+                (name, size, etag, sha256, width, height, datetime.now().astimezone().isoformat() if etag else None)
+            )
+    
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM blobs WHERE name = ?", (name,))
+    
+    def get(self, name: str) -> Optional[Dict]:
+        """Return the catalog row for a blob, or None if it is not known."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM blobs WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            return dict(zip([c[0] for c in cursor.description], row)) if row else None
+    
+    def names(self, prefix: str = '') -> List[str]:
+        """Return every known blob name under prefix, sorted."""
+        condition, params = _prefix_condition(prefix)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT name FROM blobs WHERE {condition} ORDER BY name", params
+            )]
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+    
+    def __enter__(self) -> 'BlobCatalog':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
-def fetch_session_media_items(session_id: str, creds: Credentials) -> List[Dict]:
+class FileHashIndex:
     """
-    Fetch all media items from a Picker session.
+    Local SQLite record of the content hashes of files synced by sync-dir.
     
-    Args:
-        session_id: The Picker session ID
-        creds: Google API credentials
-        
-    Returns:
-        List of media item dictionaries
+    Rows are keyed by absolute path and are only trusted while the file's
+    size and mtime are unchanged, so a re-sync reads nothing but new or
+    modified files.
     """
-    try:
-        headers = {'Authorization': f'Bearer {creds.token}'}
-        base_url = 'https://photospicker.googleapis.com/v1/mediaItems'
-        
-        all_items = []
-        page_token = None
-        
-        while True:
-            # Build query parameters
-            params = {'sessionId': session_id}
-            if page_token:
-                params['pageToken'] = page_token
-            
-            logger.info(f"Fetching media items from: {base_url}?sessionId={session_id}")
-            
-            response = requests.get(base_url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            items = data.get('mediaItems', [])
-            all_items.extend(items)
-            
-            logger.info(f"Fetched {len(items)} items (total: {len(all_items)})")
-            
-            page_token = data.get('nextPageToken')
-            if not page_token:
-                break
-        
-        return all_items
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                sha256 TEXT,
+                content_md5 TEXT
+            )'''
+        )
+    
+    def lookup(self, path: str, size: int, mtime_ns: int) -> Optional[Tuple[str, str]]:
+        """Return (sha256, base64 MD5) recorded for the file, or None if it changed or is new."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sha256, content_md5 FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, size, mtime_ns)
+            ).fetchone()
+    
+    def record(self, path: str, size: int, mtime_ns: int, sha256: str, content_md5: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                '''INSERT INTO files (path, size, mtime_ns, sha256, content_md5)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns,
+                    sha256 = excluded.sha256,
+                    content_md5 = excluded.content_md5''',
+                (path, size, mtime_ns, sha256, content_md5)
+            )
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+    
+    def __enter__(self) -> 'FileHashIndex':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class CachedOriginal:
+    """A cached original opened as a read-only memory map."""
+    
+    def __init__(self, path: Path, sha256: str):
+        self.path = path
+        self.sha256 = sha256
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._map)
+    
+    def read(self, offset: int, size: int) -> bytes:
+        return self._map[offset:offset + size]
+    
+    def close(self) -> None:
+        self._map.close()
+    
+    def __enter__(self) -> 'CachedOriginal':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class OriginalsCache:
+    """
+    Size-bounded on-disk cache of downloaded originals, keyed by media item ID and content hash.
+    
+    Each original is stored once under objects/<sha256><suffix>, and a SQLite
+    index maps media item IDs to it. A retried session, a different
+    customFilename or regenerated renditions then read the original from
+    disk instead of downloading it again within the token's hour. Downloads
+    are written to an incoming temp file in the cache directory and renamed
+    into place once complete, so a crash never leaves a partial original
+    under a valid name. Past max_bytes, the least recently used originals
+    are evicted.
+    """
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._objects = directory / 'objects'
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(directory / 'index.sqlite3'), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS objects (
+                sha256 TEXT PRIMARY KEY,
+                suffix TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )'''
+        )
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS items (
+                media_item_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL
+            )'''
+        )
+        self.hits = 0
+        self.misses = 0
+        
+        # Incoming files left behind by a crashed run
+        for path in directory.glob(f"{CACHE_INCOMING_PREFIX}*"):
+            try:
+                if time.time() - path.stat().st_mtime > CACHE_STALE_SECONDS:
+                    path.unlink()
+            except OSError:
+                pass
+    
+    def _path(self, sha256: str, suffix: str) -> Path:
+        return self._objects / f"{sha256}{suffix}"
+    
+    def open(self, media_item_id: str) -> Optional[CachedOriginal]:
+        """
+        Open a media item's cached original and mark it as recently used.
+        
+        Returns:
+            The memory-mapped original, or None on a miss (including a file
+            that went missing or changed size since it was cached)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                '''SELECT objects.sha256, suffix, size FROM items JOIN objects USING (sha256)
+                WHERE media_item_id = ?''',
+                (media_item_id,)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE objects SET last_used = ? WHERE sha256 = ?", (time.time(), row[0]))
+        
+        original = None
+        if row:
+            sha256, suffix, size = row
+            try:
+                original = CachedOriginal(self._path(sha256, suffix), sha256)
+                if original.size != size:
+                    original.close()
+                    original = None
+            except (OSError, ValueError):
+                original = None
+            if original is None:
+                logger.warning(f"Cached original for {media_item_id} is missing or damaged; downloading it again")
+                self._forget(sha256)
+        
+        with self._lock:
+            if original:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return original
+    
+    def incoming(self, suffix: str = '') -> BinaryIO:
+        """Temp file in the cache directory for a download; pass it to store() once complete."""
+        return tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=CACHE_INCOMING_PREFIX, suffix=suffix, delete=False
+        )
+    
+    def store(self, media_item_id: str, incoming: Path, sha256: str, suffix: str = '') -> Optional[Path]:
+        """
+        Atomically move a complete download into the cache, then evict down to max_bytes.
+        
+        Returns:
+            Path of the cached original, or None if it is larger than the whole
+            cache (incoming is then left for the caller to delete)
+        """
+        size = incoming.stat().st_size
+        if size > self.max_bytes:
+            return None
+        
+        suffix = suffix.lower()
+        path = self._path(sha256, suffix)
+        if path.exists() and path.stat().st_size == size:
+            # Same content cached for another media item (and possibly mapped right now)
+            incoming.unlink()
+        else:
+            os.replace(incoming, path)
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute(
+                '''INSERT INTO objects (sha256, suffix, size, last_used) VALUES (?, ?, ?, ?)
+                ON CONFLICT (sha256) DO UPDATE SET
+                    suffix = excluded.suffix,
+                    size = excluded.size,
+                    last_used = excluded.last_used''',
+                (sha256, suffix, size, time.time())
+            )
+            self._conn.execute(
+                '''INSERT INTO items (media_item_id, sha256) VALUES (?, ?)
+                ON CONFLICT (media_item_id) DO UPDATE SET sha256 = excluded.sha256''',
+                (media_item_id, sha256)
+            )
+            self._conn.execute('COMMIT')
+        self._evict(keep=sha256)
+        return path
+    
+    def discard(self, sha256: str) -> None:
+        """Drop an original, e.g. one whose content no longer matches its hash."""
+        with contextlib.suppress(OSError):
+            for path in self._objects.glob(f"{sha256}*"):
+                path.unlink()
+        self._forget(sha256)
+    
+    def _forget(self, sha256: str) -> None:
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute("DELETE FROM items WHERE sha256 = ?", (sha256,))
+            self._conn.execute("DELETE FROM objects WHERE sha256 = ?", (sha256,))
+            self._conn.execute('COMMIT')
+    
+    def _evict(self, keep: str) -> None:
+        """Delete least recently used originals until the cache fits in max_bytes."""
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            candidates = self._conn.execute(
+                "SELECT sha256, suffix, size FROM objects WHERE sha256 != ? ORDER BY last_used",
+                (keep,)
+            ).fetchall()
+        
+        evicted = 0
+        for sha256, suffix, size in candidates:
+            if total <= self.max_bytes:
+                break
+            try:
+                self._path(sha256, suffix).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # Windows refuses to delete a file another worker has mapped
+                logger.debug(f"Could not evict cached original {sha256}: {e}")
+                continue
+            self._forget(sha256)
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} original(s) from the cache; {total / (1024 * 1024):.1f} MB in use")
+    
+    def log_summary(self) -> None:
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        if self.hits or self.misses:
+            logger.info(
+                f"Originals cache: {self.hits} hit(s), {self.misses} miss(es), "
+                f"{total / (1024 * 1024):.1f} of {self.max_bytes / (1024 * 1024):.0f} MB in use"
+            )
+    
+    def close(self) -> None:
+        self.log_summary()
+        with self._lock:
+            self._conn.close()
+    
+    def __enter__(self) -> 'OriginalsCache':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class TransferStats:
+    """Thread-safe byte counters reported in the session summary."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+        self.skipped = 0
+        self.resumed = 0
+    
+    def add(self, uploaded: int = 0, saved: int = 0, skipped: int = 0, resumed: int = 0) -> None:
+        with self._lock:
+            self.bytes_uploaded += uploaded
+            self.bytes_saved += saved
+            self.skipped += skipped
+            self.resumed += resumed
+    
+    def log_summary(self) -> None:
+        logger.info(f"Bytes uploaded: {self.bytes_uploaded}")
+        if self.resumed:
+            logger.info(f"Resumed (uploaded in an earlier run): {self.resumed}")
+        if self.skipped:
+            logger.info(f"Skipped (already stored): {self.skipped}")
+            logger.info(f"Bytes saved: {self.bytes_saved}")
+
+
+def _get_blob_properties(blob_client):
+    """Return a blob's properties, or None if it does not exist."""
+    from azure.core.exceptions import ResourceNotFoundError
+    
+    try:
+        return blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+
+
+def _upload_chunks(
+    blob_client,
+    chunks: Iterable[bytes],
+    content_type: str,
+    hasher: ContentHasher,
+    release: Callable[[bytes], None] = lambda chunk: None,
+    cache_control: Optional[str] = None,
+    metrics: Optional[RunMetrics] = None
+) -> Tuple[int, str]:
+    """
+    Upload a sequence of chunks as one block blob, hashing as they go.
+    
+    Each chunk is staged as a block as soon as it is available and the block
+    list is committed at the end with the content hash attached. A body that
+    fits in a single chunk is uploaded with one put instead.
+    
+    Returns:
+        Tuple of (bytes uploaded, ETag of the committed blob)
+    """
+    from azure.storage.blob import ContentSettings
+    
+    timed = metrics.timed if metrics else lambda stage, num_bytes=0: contextlib.nullcontext()
+    chunk_iter = iter(chunks)
+    first = next(chunk_iter, None)
+    if first is None:
+        raise ValueError("Downloaded image is empty")
+    second = next(chunk_iter, None)
+    
+    if second is None:
+        # Whole item fits in one chunk: a single put is cheaper
+        try:
+            hasher.update(first)
+            with timed('upload', len(first)):
+                result = blob_client.upload_blob(
+                    first,
+                    overwrite=True,
+                    content_settings=ContentSettings(
+                        content_type=content_type,
+                        content_md5=bytearray(hasher.md5),
+                        cache_control=cache_control
+                    ),
+                    metadata={HASH_METADATA_KEY: hasher.sha256}
+                )
+        finally:
+            release(first)
+        return len(first), result['etag']
+    
+    # Block IDs are unique to this upload, so another writer's uncommitted
+    # blocks for the same blob are never mistaken for ours
+    upload_id = uuid.uuid4().hex
+    block_ids = []
+    for chunk in itertools.chain((first, second), chunk_iter):
+        block_id = base64.b64encode(f"{upload_id}-{len(block_ids):08d}".encode()).decode()
+        try:
+            hasher.update(chunk)
+            with timed('upload', len(chunk)):
+                blob_client.stage_block(block_id, chunk)
+        finally:
+            release(chunk)
+        block_ids.append(block_id)
+    
+    with timed('commit'):
+        result = blob_client.commit_block_list(
+            block_ids,
+            content_settings=ContentSettings(
+                content_type=content_type,
+                content_md5=bytearray(hasher.md5),
+                cache_control=cache_control
+            ),
+            metadata={HASH_METADATA_KEY: hasher.sha256}
+        )
+    return hasher.size, result['etag']
+
+
+def _spool_chunks(
+    chunks: Iterable[bytes],
+    spool,
+    hasher: ContentHasher,
+    release: Callable[[bytes], None] = lambda chunk: None
+) -> None:
+    """Write a download to a local spool file while hashing it."""
+    for chunk in chunks:
+        try:
+            hasher.update(chunk)
+            spool.write(chunk)
+        finally:
+            release(chunk)
+    spool.seek(0)
+
+
+def _tee_chunks(chunks: Iterable[bytes], copy_to: BinaryIO) -> Iterator[bytes]:
+    """Pass chunks through unchanged while also writing them to copy_to."""
+    for chunk in chunks:
+        copy_to.write(chunk)
+        yield chunk
+    copy_to.flush()
+
+
+def _iter_spool(spool, chunk_size: int) -> Iterator[bytes]:
+    return iter(lambda: spool.read(chunk_size), b'')
+
+
+def content_addressed_name(sha256: str, filename: str) -> str:
+    """Blob name under which content with the given hash is stored once."""
+    return f"{OBJECTS_PREFIX}{sha256}{Path(filename).suffix.lower()}"
+
+
+def stream_image_to_azure(
+    download_url: str,
+    auth: TokenProvider,
+    blob_name: str,
+    clients: ClientContext,
+    content_type: str = 'image/jpeg',
+    chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+    byte_budget: Optional[ByteBudget] = None,
+    upload_mode: str = UPLOAD_OVERWRITE,
+    stats: Optional[TransferStats] = None,
+    aliases: Optional[Dict[str, str]] = None,
+    on_downloaded: Optional[Callable[[ContentHasher], None]] = None,
+    copy_to: Optional[BinaryIO] = None,
+    range_parts: int = 1,
+    range_min_size: int = DEFAULT_RANGE_MIN_MB * 1024 * 1024,
+    cached: Optional[CachedOriginal] = None
+) -> Optional[Dict]:
+    """
+    Stream an image from Google Photos straight into an Azure block blob.
+    
+    In the default overwrite mode each downloaded chunk is staged as a block
+    as soon as it arrives. The dedupe mode first checks for an existing blob
+    of the same size; if there is one, the download is hashed into a local
+    spool file and only uploaded when the hash differs. The content-addressed
+    mode always spools, stores the bytes once under objects/<sha256> with
+    IMMUTABLE_CACHE_CONTROL, and records blob_name -> objects/<sha256> in
+    aliases. An object stored before without that header gets it set.
+    
+    With a cached original, the bytes are read from its memory map instead
+    of Google, and the modes that hash before uploading use the cached file
+    in place of a spool file.
+    
+    Args:
+        download_url: The download URL with parameters
+        auth: Google access token, sent with the download and any range requests
+        blob_name: Name for the blob
+        clients: Run-scoped client context
+        content_type: MIME type of the image
+        chunk_size: Size of each staged block in bytes
+        byte_budget: Optional in-flight byte cap shared between workers
+        upload_mode: UPLOAD_OVERWRITE, UPLOAD_DEDUPE or UPLOAD_CONTENT_ADDRESSED
+        stats: Optional counters for uploaded and saved bytes
+        aliases: Friendly name -> object name map filled in content-addressed mode
+        on_downloaded: Called with the content hasher once the whole body has been read
+        copy_to: Optional local file that also receives the downloaded bytes
+        range_parts: Parallel Range requests for large items (1 disables)
+        range_min_size: Smallest item, in bytes, worth splitting into ranges
+        cached: The item's original from the local cache (or a local file); skips the download
+        
+    Returns:
+        Dict with the stored blob_name, etag, size and sha256, or None if failed
+    """
+    stats = stats or TransferStats()
+    try:
+        blob_client = clients.container_client.get_blob_client(blob_name)
+        hasher = ContentHasher()
+        if cached is not None:
+            logger.info(f"Reading {cached.size} bytes from {cached.path} instead of Google Photos")
+            chunks = _MappedChunks(cached, chunk_size, metrics=clients.metrics)
+            expected_size = cached.size
+        else:
+            logger.info(f"Streaming image from Google Photos to Azure...")
+            with clients.metrics.timed('first_byte'):
+                response = clients.get(download_url, auth=auth, stream=True)
+            if not response.ok:
+                response.close()
+            response.raise_for_status()
+            expected_size = response.headers.get('Content-Length')
+            if range_parts > 1 and _RangePrefetcher.supported(response, chunk_size, range_min_size):
+                total_size = int(response.headers['Content-Length'])
+                logger.info(f"Downloading {total_size} bytes as {range_parts} parallel ranges")
+                chunks = _RangePrefetcher(
+                    response, clients, download_url, auth,
+                    total_size, chunk_size, range_parts, byte_budget
+                )
+            else:
+                reopen = None
+                if response.headers.get('Accept-Ranges', '').lower() == 'bytes' \
+                        and not response.headers.get('Content-Encoding'):
+                    reopen = lambda offset: _resume_download(clients, download_url, auth, offset)
+                chunks = _ChunkPrefetcher(
+                    response, chunk_size, byte_budget, metrics=clients.metrics, reopen=reopen
+                )
+        source = chunks if copy_to is None else _tee_chunks(chunks, copy_to)
+        
+        try:
+            existing = None
+            if upload_mode == UPLOAD_DEDUPE:
+                existing = _get_blob_properties(blob_client)
+                if existing and expected_size and int(expected_size) != existing.size:
+                    existing = None
+            
+            if upload_mode == UPLOAD_OVERWRITE or (upload_mode == UPLOAD_DEDUPE and not existing):
+                total, etag = _upload_chunks(
+                    blob_client, source, content_type, hasher, chunks.release, metrics=clients.metrics
+                )
+                if on_downloaded:
+                    on_downloaded(hasher)
+                stats.add(uploaded=total)
+                logger.info(f"Successfully streamed image to Azure ({total} bytes): {blob_client.url}")
+                return _stored_blob(blob_client, etag, hasher)
+            
+            # Hash before writing so identical content is never re-sent; a
+            # cached original is already on disk and needs no spool file
+            with tempfile.TemporaryFile() if cached is None else contextlib.nullcontext() as spool:
+                if cached is None:
+                    _spool_chunks(source, spool, hasher, chunks.release)
+                    replay = _iter_spool(spool, chunk_size)
+                else:
+                    for chunk in source:
+                        hasher.update(chunk)
+                    replay = iter(_MappedChunks(cached, chunk_size))
+                if not hasher.size:
+                    raise ValueError("Downloaded image is empty")
+                if on_downloaded:
+                    on_downloaded(hasher)
+                
+                if upload_mode == UPLOAD_CONTENT_ADDRESSED:
+                    object_name = content_addressed_name(hasher.sha256, blob_name)
+                    blob_client = clients.container_client.get_blob_client(object_name)
+                    existing = _get_blob_properties(blob_client)
+                
+                cache_control = IMMUTABLE_CACHE_CONTROL if upload_mode == UPLOAD_CONTENT_ADDRESSED else None
+                if existing and hasher.matches(existing):
+                    etag = existing.etag
+                    if cache_control and existing.content_settings.cache_control != cache_control:
+                        etag = _set_cache_control(blob_client, existing, cache_control)
+                    stats.add(saved=hasher.size, skipped=1)
+                    logger.info(f"Identical content already stored, skipped upload ({hasher.size} bytes): {blob_client.url}")
+                else:
+                    total, etag = _upload_chunks(
+                        blob_client, replay, content_type, ContentHasher(),
+                        cache_control=cache_control, metrics=clients.metrics
+                    )
+                    stats.add(uploaded=total)
+                    logger.info(f"Successfully uploaded image to Azure ({total} bytes): {blob_client.url}")
+                
+                if upload_mode == UPLOAD_CONTENT_ADDRESSED and aliases is not None:
+                    aliases[blob_name] = object_name
+                return _stored_blob(blob_client, etag, hasher)
+        finally:
+            chunks.close()
+        
+    except Exception as e:
+        logger.error(f"Error streaming image to Azure: {e}")
+        return None
+
+
+def _resume_download(clients: ClientContext, download_url: str, auth: TokenProvider, offset: int) -> requests.Response:
+    """
+    Re-request a download that broke off, from byte offset on.
+    
+    A dropped stream counts as a congestion signal, like a throttle, so the
+    Google limiter shrinks and pauses before the range request goes out
+    through the usual retry path.
+    """
+    clients.google_limiter.on_throttle(None)
+    clients.google_limiter.retries += 1
+    response = clients.get(download_url, auth=auth, stream=True, headers={'Range': f"bytes={offset}-"})
+    if response.status_code != 206 or not response.headers.get('Content-Range', '').startswith(f"bytes {offset}-"):
+        response.close()
+        raise IOError(f"Resuming at byte {offset} returned HTTP {response.status_code}")
+    return response
+
+
+def _set_cache_control(blob_client, properties, cache_control: str) -> str:
+    """Set Cache-Control on an existing blob, keeping its other content settings; returns the new ETag."""
+    content_settings = properties.content_settings
+    content_settings.cache_control = cache_control
+    result = blob_client.set_http_headers(content_settings=content_settings)
+    logger.info(f"Set Cache-Control on {blob_client.blob_name}")
+    return result['etag']
+
+
+def _stored_blob(blob_client, etag: str, hasher: ContentHasher) -> Dict:
+    return {
+        'blob_name': blob_client.blob_name,
+        'etag': etag,
+        'size': hasher.size,
+        'sha256': hasher.sha256,
+    }
+
+
+def load_json_manifest(blob_name: str, clients: ClientContext) -> Tuple[Dict, Optional[str]]:
+    """
+    Download a JSON manifest blob.
+    
+    Returns:
+        Tuple of (manifest, etag); etag is None when the manifest does not exist yet
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    
+    blob_client = clients.container_client.get_blob_client(blob_name)
+    try:
+        download = blob_client.download_blob()
+    except ResourceNotFoundError:
+        return {}, None
+    return json.loads(download.readall()), download.properties.etag
+
+
+def merge_json_manifest(blob_name: str, entries: Dict, clients: ClientContext, attempts: int = 5) -> bool:
+    """
+    Merge entries into a JSON manifest blob with an ETag-conditional write.
+    
+    Concurrent sessions may update the manifest at the same time, so the
+    read-merge-write is retried when another writer got there first.
+    
+    Args:
+        blob_name: Manifest blob name
+        entries: Top-level keys to add or replace
+        clients: Run-scoped client context
+        attempts: Number of read-merge-write attempts
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    if not entries:
+        return True
+    
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+    from azure.storage.blob import ContentSettings
+    
+    blob_client = clients.container_client.get_blob_client(blob_name)
+    try:
+        for _ in range(attempts):
+            manifest, etag = load_json_manifest(blob_name, clients)
+            manifest.update(entries)
+            if etag:
+                condition = {'etag': etag, 'match_condition': MatchConditions.IfNotModified}
+            else:
+                condition = {'match_condition': MatchConditions.IfMissing}
+            try:
+                blob_client.upload_blob(
+                    json.dumps(manifest, indent=2, sort_keys=True),
+                    overwrite=True,
+                    content_settings=ContentSettings(content_type='application/json'),
+                    **condition
+                )
+                logger.info(f"Updated {blob_name} with {len(entries)} entr{'y' if len(entries) == 1 else 'ies'}")
+                return True
+            except (ResourceModifiedError, ResourceExistsError):
+                logger.info(f"{blob_name} changed while updating, retrying...")
+        
+        logger.error(f"Gave up updating {blob_name} after {attempts} attempts")
+        return False
+        
+    except Exception as e:
+        logger.error(f"Error updating {blob_name}: {e}")
+        return False
+
+
+def save_alias_manifest(aliases: Dict[str, str], clients: ClientContext) -> bool:
+    """
+    Merge friendly name -> content-addressed object entries into the alias
+    manifest blob and the site's _data file, which layouts resolve photo
+    names through at build time.
+    """
+    if not aliases:
+        return True
+    if not merge_json_manifest(ALIAS_MANIFEST_BLOB, aliases, clients):
+        return False
+    try:
+        merge_local_manifest(ALIAS_MANIFEST_FILE, aliases)
+        return True
+    except Exception as e:
+        logger.error(f"Error updating {ALIAS_MANIFEST_FILE}: {e}")
+        return False
+
+
+def merge_local_manifest(path: Path, entries: Dict) -> None:
+    """
+    Merge entries into a local JSON manifest (e.g. under _data/) atomically.
+    """
+    with _LOCAL_MANIFEST_LOCK:
+        manifest = json.loads(path.read_text()) if path.exists() else {}
+        manifest.update(entries)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+        os.replace(tmp_path, path)
+    logger.info(f"Updated {path} with {len(entries)} entr{'y' if len(entries) == 1 else 'ies'}")
+
+
+def _exif_details(original: Image.Image) -> Tuple[int, Optional[str]]:
+    """
+    Read the EXIF orientation and capture time of an opened image.
+    
+    Returns:
+        Tuple of (orientation, ISO 8601 capture time or None)
+    """
+    exif = original.getexif()
+    try:
+        orientation = int(exif.get(EXIF_ORIENTATION, 1))
+    except (TypeError, ValueError):
+        orientation = 1
+    raw = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    taken = None
+    if raw:
+        try:
+            taken = datetime.strptime(str(raw).strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+        except ValueError:
+            pass
+    return orientation, taken
+
+
+def _photo_analysis(width: int, height: int, orientation: int, taken: Optional[str], upright: Image.Image) -> Dict:
+    """Build the front-matter fields of a photo, encoding its LQIP from an upright RGB image."""
+    from PIL import Image
+    
+    scale = LQIP_SIZE / max(upright.size)
+    size = (max(1, round(upright.width * scale)), max(1, round(upright.height * scale)))
+    buffer = io.BytesIO()
+    # WebP: a 16px JPEG would be mostly quantization tables
+    upright.resize(size, Image.Resampling.BOX).save(buffer, 'WEBP', quality=LQIP_QUALITY)
+    return {
+        'width': width,
+        'height': height,
+        'taken': taken,
+        'orientation': orientation,
+        'lqip': 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode(),
+    }
+
+
+def analyze_image(source_path: str) -> Dict:
+    """
+    Work out a photo's dimensions, EXIF date and orientation, and LQIP.
+    
+    The size and EXIF come from the header; JPEGs are then decoded in draft
+    mode at a fraction of full size, which is all the placeholder needs.
+    render_renditions does the same from its full decode, so an image is
+    only ever decoded once.
+    
+    Args:
+        source_path: Local file holding the original image
+        
+    Returns:
+        Dict with the upright width and height, taken, orientation and lqip
+    """
+    from PIL import Image, ImageOps
+    
+    with Image.open(source_path) as original:
+        orientation, taken = _exif_details(original)
+        width, height = original.size
+        original.draft('RGB', (LQIP_SIZE * 4, LQIP_SIZE * 4))
+        upright = ImageOps.exif_transpose(original).convert('RGB')
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return _photo_analysis(width, height, orientation, taken, upright)
+
+
+def render_renditions(source_path: str, photo_name: str, key: Optional[str] = None) -> Dict:
+    """
+    Render the thumbnail and responsive widths of one image.
+    
+    Runs in a worker process. Produces a center-cropped square thumbnail plus
+    800w and 1600w resizes (never upscaled), each as JPEG and WebP, named
+    renditions/<key>/<variant>.<ext>. The same decode also yields the
+    photo-page analysis (see analyze_image).
+    
+    Args:
+        source_path: Local file holding the original image
+        photo_name: Blob name of the original (e.g., wren.jpg)
+        key: Rendition folder name; defaults to photo_name
+        
+    Returns:
+        Dict with 'manifest' (the manifest entry), 'files' (list of
+        (blob_name, data, content_type) tuples to upload) and 'analysis'
+    """
+    from PIL import Image, ImageOps
+    
+    prefix = f"{RENDITION_PREFIX}{key or photo_name}/"
+    files = []
+    
+    def encode(image: Image.Image, variant: str) -> Dict[str, str]:
+        names = {}
+        for key, image_format, ext, content_type, options in RENDITION_FORMATS:
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, quality=RENDITION_QUALITY, **options)
+            blob_name = f"{prefix}{variant}.{ext}"
+            files.append((blob_name, buffer.getvalue(), content_type))
+            names[key] = blob_name
+        return names
+    
+    with Image.open(source_path) as original:
+        orientation, taken = _exif_details(original)
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    width, height = image.size
+    analysis = _photo_analysis(width, height, orientation, taken, image)
+    
+    thumb_size = (RENDITION_THUMB_SIZE, RENDITION_THUMB_SIZE)
+    thumb = ImageOps.fit(image, thumb_size, Image.Resampling.LANCZOS)
+    manifest = {
+        'width': width,
+        'height': height,
+        'thumb': encode(thumb, 'thumb'),
+        'widths': [],
+    }
+    
+    for target_width in RENDITION_WIDTHS:
+        rendition_width = min(target_width, width)
+        rendition_height = round(height * rendition_width / width)
+        if rendition_width == width:
+            resized = image
+        else:
+            resized = image.resize((rendition_width, rendition_height), Image.Resampling.LANCZOS)
+        entry = {'width': rendition_width, 'height': rendition_height}
+        entry.update(encode(resized, f"{rendition_width}w"))
+        manifest['widths'].append(entry)
+        if rendition_width == width:
+            break
+    
+    return {'manifest': manifest, 'files': files, 'analysis': analysis}
+
+
+def create_rendition_pool(processes: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Create the process pool used for Pillow work.
+    
+    Workers are spawned rather than forked because the pool starts while
+    download threads are running.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def generate_renditions(
+    source_path: str,
+    photo_name: str,
+    clients: ClientContext,
+    rendition_pool: ProcessPoolExecutor,
+    renditions: Dict[str, Dict],
+    content_hash: Optional[str] = None
+) -> Optional[Dict]:
+    """
+    Render an image's renditions in the process pool and upload them.
+    
+    With a content hash, the renditions are stored under renditions/<hash>/
+    with IMMUTABLE_CACHE_CONTROL instead of under the photo's mutable name.
+    The manifest entry is still keyed by the photo name.
+    
+    Args:
+        source_path: Local file holding the original image
+        photo_name: Blob name of the original
+        clients: Run-scoped client context
+        rendition_pool: Process pool doing the Pillow work
+        renditions: Photo name -> manifest entry map filled on success
+        content_hash: sha256 of the original in content-addressed mode
+        
+    Returns:
+        The photo's analysis (see analyze_image) if successful, None otherwise
+    """
+    from azure.storage.blob import ContentSettings
+    
+    try:
+        with clients.metrics.timed('render'):
+            result = rendition_pool.submit(render_renditions, source_path, photo_name, content_hash).result()
+        cache_control = IMMUTABLE_CACHE_CONTROL if content_hash else None
+        for blob_name, data, content_type in result['files']:
+            with clients.metrics.timed('upload_rendition', len(data)):
+                uploaded = clients.container_client.get_blob_client(blob_name).upload_blob(
+                    data,
+                    overwrite=True,
+                    content_settings=ContentSettings(content_type=content_type, cache_control=cache_control)
+                )
+            if clients.catalog:
+                clients.catalog.record(blob_name, size=len(data), etag=uploaded['etag'])
+        renditions[photo_name] = result['manifest']
+        if clients.catalog:
+            clients.catalog.record(
+                photo_name, width=result['manifest']['width'], height=result['manifest']['height']
+            )
+        logger.info(f"Uploaded {len(result['files'])} rendition(s) for {photo_name}")
+        return result['analysis']
+        
+    except Exception as e:
+        logger.error(f"Error generating renditions for {photo_name}: {e}")
+        return None
+
+
+def analyze_photo(source_path: str, photo_name: str, clients: ClientContext) -> Optional[Dict]:
+    """Run analyze_image on a downloaded photo when no renditions are being rendered."""
+    try:
+        with clients.metrics.timed('analyze'):
+            analysis = analyze_image(source_path)
+        if clients.catalog:
+            clients.catalog.record(photo_name, width=analysis['width'], height=analysis['height'])
+        return analysis
+    except Exception as e:
+        logger.error(f"Error analyzing {photo_name}: {e}")
+        return None
+
+
+def save_rendition_manifest(renditions: Dict[str, Dict], clients: ClientContext) -> bool:
+    """Merge rendition entries into the blob manifest and the site's _data file."""
+    if not renditions:
+        return True
+    if not merge_json_manifest(RENDITION_MANIFEST_BLOB, renditions, clients):
+        return False
+    try:
+        merge_local_manifest(RENDITION_MANIFEST_FILE, renditions)
+        return True
+    except Exception as e:
+        logger.error(f"Error updating {RENDITION_MANIFEST_FILE}: {e}")
+        return False
+
+
+def _split_front_matter(text: str) -> Tuple[List[str], str]:
+    """Split a post into its front-matter lines and the rest; ([], text) if it has none."""
+    lines = text.split('\n')
+    if lines[0].strip() == '---':
+        for end in range(1, len(lines)):
+            if lines[end].strip() == '---':
+                return lines[1:end], '\n'.join(lines[end + 1:])
+    return [], text
+
+
+def _front_matter_value(value) -> str:
+    """Format a scalar for front matter; strings are double-quoted unless plain."""
+    if isinstance(value, str) and not re.fullmatch(r'[\w.~-]+', value):
+        return json.dumps(value)
+    return str(value)
+
+
+def find_photo_post(photo_name: str, posts_dir: Path = POSTS_DIR) -> Optional[Path]:
+    """Find the post whose front matter has photo: <photo_name>."""
+    for path in sorted(posts_dir.glob('*.md')):
+        lines, _ = _split_front_matter(path.read_text(encoding='utf-8'))
+        for line in lines:
+            key, _, value = line.partition(':')
+            if key.strip() == 'photo' and value.strip().strip('"\'') == photo_name:
+                return path
+    return None
+
+
+def write_photo_post(
+    photo_name: str,
+    analysis: Dict,
+    posts_dir: Path = POSTS_DIR,
+    taken: Optional[str] = None
+) -> Optional[Path]:
+    """
+    Write the photo-page post for an ingested photo, or refresh an existing one.
+    
+    A post that already shows the photo keeps its title, date, excerpt and
+    body; only the analysis fields are replaced or added. Otherwise a new
+    _posts/<today>-<slug>.md is created with a title taken from the file
+    name, ready to edit and commit.
+    
+    Args:
+        photo_name: Blob name of the photo (the post's photo: field)
+        analysis: Result of analyze_image
+        posts_dir: Directory holding the site's posts
+        taken: Capture time to use when the image has no EXIF date
+            (e.g. the Picker item's createTime)
+        
+    Returns:
+        Path of the written post, or None if failed
+    """
+    fields = dict(analysis)
+    fields['taken'] = fields.get('taken') or taken
+    fields = {key: fields[key] for key in POST_ANALYSIS_KEYS if fields.get(key) is not None}
+    try:
+        with _POSTS_LOCK:
+            path = find_photo_post(photo_name, posts_dir)
+            if path:
+                lines, rest = _split_front_matter(path.read_text(encoding='utf-8'))
+                front_matter = []
+                for line in lines:
+                    key = line.partition(':')[0].strip()
+                    if key in fields:
+                        front_matter.append(f"{key}: {_front_matter_value(fields.pop(key))}")
+                    else:
+                        front_matter.append(line)
+                front_matter += [f"{key}: {_front_matter_value(value)}" for key, value in fields.items()]
+                action = 'Updated'
+            else:
+                stem = Path(photo_name).stem
+                slug = re.sub(r'[^a-z0-9]+', '-', stem.lower()).strip('-') or 'photo'
+                date = datetime.now().strftime('%Y-%m-%d')
+                path = posts_dir / f"{date}-{slug}.md"
+                suffix = 2
+                while path.exists():
+                    path = posts_dir / f"{date}-{slug}-{suffix}.md"
+                    suffix += 1
+                front_matter = [
+                    'layout: photo-page',
+                    f"title: {json.dumps(re.sub(r'[-_]+', ' ', stem).strip().title() or slug)}",
+                    f"date: {date}",
+                    f"photo: {_front_matter_value(photo_name)}",
+                ]
+                front_matter += [f"{key}: {_front_matter_value(value)}" for key, value in fields.items()]
+                front_matter += ['excerpt: ""', 'published: true']
+                rest = '\n'
+                action = 'Wrote'
+            
+            posts_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_text('---\n' + '\n'.join(front_matter) + '\n---\n' + rest, encoding='utf-8')
+            os.replace(tmp_path, path)
+        logger.info(f"{action} photo post {path}")
+        return path
+        
+    except Exception as e:
+        logger.error(f"Error writing photo post for {photo_name}: {e}")
+        return None
+
+
+def read_photo_posts(posts_dir: Path = POSTS_DIR) -> List[Dict[str, str]]:
+    """
+    Read the published photo-page posts, oldest file first.
+    
+    Returns:
+        List of dicts with each post's front-matter fields (as strings), its
+        path and body, and a title that defaults to ''
+    """
+    posts = []
+    for path in sorted(posts_dir.glob('*.md')):
+        lines, body = _split_front_matter(path.read_text(encoding='utf-8'))
+        fields = {}
+        for line in lines:
+            key, _, value = line.partition(':')
+            fields[key.strip()] = value.strip().strip('"\'')
+        if fields.get('layout') == 'photo-page' and fields.get('photo') and fields.get('published') != 'false':
+            posts.append(dict(fields, path=str(path), body=body, title=fields.get('title', '')))
+    return posts
+
+
+def compose_sprite_sheet(thumbnails: List[bytes]) -> bytes:
+    """
+    Pack images into one JPEG sprite sheet of square cells.
+    
+    Runs in a worker process. Each image is center-cropped to a
+    RENDITION_THUMB_SIZE square and placed left to right, top to bottom,
+    SPRITE_COLUMNS to a row.
+    
+    Args:
+        thumbnails: Encoded source images, in sheet order
+        
+    Returns:
+        The encoded sheet
+    """
+    from PIL import Image, ImageOps
+    
+    cell = RENDITION_THUMB_SIZE
+    columns = min(SPRITE_COLUMNS, len(thumbnails))
+    rows = -(-len(thumbnails) // SPRITE_COLUMNS)
+    sheet = Image.new('RGB', (columns * cell, rows * cell), 'white')
+    for i, data in enumerate(thumbnails):
+        with Image.open(io.BytesIO(data)) as source:
+            source.draft('RGB', (cell, cell))
+            thumb = ImageOps.fit(ImageOps.exif_transpose(source).convert('RGB'), (cell, cell), Image.Resampling.LANCZOS)
+        sheet.paste(thumb, ((i % SPRITE_COLUMNS) * cell, (i // SPRITE_COLUMNS) * cell))
+    buffer = io.BytesIO()
+    sheet.save(buffer, 'JPEG', quality=SPRITE_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _sprite_source(
+    photo: str,
+    clients: ClientContext,
+    renditions: Dict[str, Dict],
+    aliases: Dict[str, str]
+) -> Optional[Tuple[str, str]]:
+    """
+    Pick the blob a photo's sprite cell is cut from: its rendered thumbnail, else the original.
+    
+    The catalog rows written at upload time are tried first; only when none
+    of the candidates is catalogued are they looked up in the container, and
+    a hit is recorded so the next build finds it in the catalog.
+    """
+    candidates = [
+        blob_name for blob_name in (
+            renditions.get(photo, {}).get('thumb', {}).get('jpeg'),
+            f"{RENDITION_PREFIX}{photo}/thumb.jpg",
+            aliases.get(photo),
+            photo,
+        ) if blob_name
+    ]
+    if clients.catalog:
+        for blob_name in candidates:
+            row = clients.catalog.get(blob_name)
+            if row and row['etag']:
+                return blob_name, row['etag']
+    for blob_name in candidates:
+        properties = _get_blob_properties(clients.container_client.get_blob_client(blob_name))
+        if properties:
+            if clients.catalog:
+                clients.catalog.record(blob_name, size=properties.size, etag=properties.etag)
+            return blob_name, properties.etag
+    return None
+
+
+def build_sprite_sheets(
+    clients: ClientContext,
+    pool: ProcessPoolExecutor,
+    posts_dir: Path = POSTS_DIR,
+    sprite_dir: Path = SPRITE_DIR,
+    map_file: Path = SPRITE_MAP_FILE,
+    workers: int = DEFAULT_POOL_SIZE
+) -> bool:
+    """
+    Build the /photos/ thumbnail sprite sheets and their offset map.
+    
+    Photo-page posts are split, in file order, into sheets of
+    SPRITE_PHOTOS_PER_SHEET, so a new post only touches the last sheet. Each
+    sheet's signature hashes its members' names and source ETags; sheets
+    whose signature matches the current map are kept as they are. The rest
+    have their sources downloaded in parallel and are composed in the
+    process pool. The resulting files are named by content hash. The map
+    in _data/ lists the sheets and each photo's sheet and x/y offset. Sheet
+    files no longer in the map are deleted.
+    
+    Args:
+        clients: Run-scoped client context
+        pool: Process pool composing the sheets
+        posts_dir: Directory holding the site's posts
+        sprite_dir: Directory the sheet files are written to (under the site)
+        map_file: The _data JSON map the page reads
+        workers: Source images downloaded concurrently
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        renditions = json.loads(RENDITION_MANIFEST_FILE.read_text()) if RENDITION_MANIFEST_FILE.exists() else {}
+        aliases = json.loads(ALIAS_MANIFEST_FILE.read_text()) if ALIAS_MANIFEST_FILE.exists() else {}
+        members = []
+        for post in read_photo_posts(posts_dir):
+            source = _sprite_source(post['photo'], clients, renditions, aliases)
+            if source:
+                members.append([post['photo'], *source])
+            else:
+                logger.warning(f"No image found for {post['photo']} ({post['path']}), leaving it out of the sprites")
+        
+        previous = json.loads(map_file.read_text()) if map_file.exists() else {}
+        kept = {sheet['signature']: sheet for sheet in previous.get('sheets', [])}
+        sheets = []
+        stale = []
+        for start in range(0, len(members), SPRITE_PHOTOS_PER_SHEET):
+            group = members[start:start + SPRITE_PHOTOS_PER_SHEET]
+            signature = hashlib.sha256(json.dumps(group).encode()).hexdigest()
+            sheet = kept.get(signature)
+            if not sheet or not (sprite_dir / Path(sheet['file']).name).exists():
+                sheet = {'signature': signature, 'photos': [photo for photo, _, _ in group]}
+                stale.append((sheet, [blob_name for _, blob_name, _ in group]))
+            sheets.append(sheet)
+        logger.info(f"{len(members)} photo(s) in {len(sheets)} sprite sheet(s), {len(stale)} to rebuild")
+        
+        def download(blob_name: str) -> bytes:
+            started = time.monotonic()
+            data = clients.container_client.get_blob_client(blob_name).download_blob().readall()
+            clients.metrics.observe('download', time.monotonic() - started, len(data))
+            return data
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (sheet, pool.submit(compose_sprite_sheet, list(executor.map(download, sources))))
+                for sheet, sources in stale
+            ]
+        
+        sprite_dir.mkdir(parents=True, exist_ok=True)
+        site_path = '/' + sprite_dir.resolve().relative_to(SITE_DIR.resolve()).as_posix()
+        for sheet, future in futures:
+            with clients.metrics.timed('render'):
+                data = future.result()
+            name = f"photos-{hashlib.sha256(data).hexdigest()[:16]}.jpg"
+            tmp_path = sprite_dir / f".{name}.tmp"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, sprite_dir / name)
+            count = len(sheet['photos'])
+            sheet.update({
+                'file': f"{site_path}/{name}",
+                'width': min(SPRITE_COLUMNS, count) * RENDITION_THUMB_SIZE,
+                'height': -(-count // SPRITE_COLUMNS) * RENDITION_THUMB_SIZE,
+            })
+            logger.info(f"Wrote sprite sheet {name} ({count} photos, {len(data)} bytes)")
+        
+        photos = {}
+        for index, sheet in enumerate(sheets):
+            for position, photo in enumerate(sheet['photos']):
+                photos[photo] = {
+                    'sheet': index,
+                    'x': (position % SPRITE_COLUMNS) * RENDITION_THUMB_SIZE,
+                    'y': (position // SPRITE_COLUMNS) * RENDITION_THUMB_SIZE,
+                }
+        
+        map_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = map_file.with_name(f".{map_file.name}.tmp")
+        tmp_path.write_text(json.dumps({'cell': RENDITION_THUMB_SIZE, 'sheets': sheets, 'photos': photos}, indent=2) + '\n')
+        os.replace(tmp_path, map_file)
+        logger.info(f"Updated {map_file} with {len(photos)} photo(s)")
+        
+        in_use = {Path(sheet['file']).name for sheet in sheets}
+        for path in sprite_dir.glob('photos-*.jpg'):
+            if path.name not in in_use:
+                path.unlink()
+                logger.info(f"Removed unused sprite sheet {path.name}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error building sprite sheets: {e}")
+        return False
+
+
+def _post_url(post: Dict[str, str]) -> str:
+    """
+    The URL Jekyll gives a post under the default permalink style.
+    
+    /<categories>/<yyyy>/<mm>/<dd>/<slug>.html, with the date from the front
+    matter if set, else from the file name; a permalink: field wins.
+    """
+    if post.get('permalink'):
+        return post['permalink']
+    stem = Path(post['path']).stem
+    date = re.match(r'(\d{4})-(\d{1,2})-(\d{1,2})', post.get('date') or stem)
+    slug = re.sub(r'^\d{4}-\d{2}-\d{2}-', '', stem)
+    categories = (post.get('categories') or post.get('category') or '').strip('[]').replace(',', ' ').split()
+    year, month, day = (int(part) for part in date.groups())
+    return '/' + '/'.join([*categories, f"{year:04d}", f"{month:02d}", f"{day:02d}", f"{slug}.html"])
+
+
+def _post_excerpt(post: Dict[str, str]) -> str:
+    """The excerpt photos.md shows: excerpt: or the first paragraph, tags stripped, FEED_EXCERPT_WORDS words."""
+    text = post.get('excerpt') or post['body'].strip().split('\n\n')[0]
+    words = re.sub(r'<[^>]+>', '', text).split()
+    if len(words) > FEED_EXCERPT_WORDS:
+        return ' '.join(words[:FEED_EXCERPT_WORDS]) + '...'
+    return ' '.join(words)
+
+
+def photo_feed_entry(
+    post: Dict[str, str],
+    renditions: Dict[str, Dict],
+    aliases: Dict[str, str],
+    sprites: Dict
+) -> Dict:
+    """
+    One /photos/ grid entry, with the same thumbnail choice as photos.md.
+    
+    The thumbnail is a sprite cell if the photo is in a sprite sheet, else
+    its rendered 200px thumbnail (JPEG plus WebP), else the CDN transform.
+    Thumbnail paths are relative to the asset host, which the page prefixes
+    with site.asset_base_url so dev builds can point at a local mirror.
+    """
+    photo = post['photo']
+    entry = {'title': post['title'], 'url': _post_url(post), 'excerpt': _post_excerpt(post)}
+    for key in ('width', 'height'):
+        if post.get(key, '').isdigit():
+            entry[key] = int(post[key])
+    if post.get('lqip'):
+        entry['lqip'] = post['lqip']
+    
+    sprite = sprites.get('photos', {}).get(photo)
+    thumb = renditions.get(photo, {}).get('thumb')
+    if sprite:
+        entry['sprite'] = {'file': sprites['sheets'][sprite['sheet']]['file'], 'x': sprite['x'], 'y': sprite['y']}
+    elif thumb:
+        entry['thumbnail'] = f"{ASSET_IMAGES_PATH}/{thumb['jpeg']}"
+        entry['thumbnail_webp'] = f"{ASSET_IMAGES_PATH}/{thumb['webp']}"
+    else:
+        entry['thumbnail'] = f"{THUMB_TRANSFORM}/{ASSET_IMAGES_PATH}/{aliases.get(photo, photo)}"
+    return entry
+
+
+def build_photo_feed(
+    posts_dir: Path = POSTS_DIR,
+    feed_dir: Path = FEED_DIR,
+    index_file: Path = FEED_INDEX_FILE
+) -> bool:
+    """
+    Write the paged JSON feed behind the /photos/ grid.
+    
+    Photo-page posts are listed newest file first, FEED_PAGE_SIZE to a page,
+    so each page spans at most two sprite sheets (which are packed oldest
+    first). Every page is written to feed_dir under a content-hashed name, so
+    it can be cached forever; pages whose content did not change keep their
+    file. The index in _data/ holds the page URLs and the first page's
+    entries, which photos.md renders statically; the page script fetches
+    the rest on scroll. Page files no longer in the index are deleted.
+    
+    Args:
+        posts_dir: Directory holding the site's posts
+        feed_dir: Directory the page files are written to (under the site)
+        index_file: The _data JSON index the page reads
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        renditions = json.loads(RENDITION_MANIFEST_FILE.read_text()) if RENDITION_MANIFEST_FILE.exists() else {}
+        aliases = json.loads(ALIAS_MANIFEST_FILE.read_text()) if ALIAS_MANIFEST_FILE.exists() else {}
+        sprites = json.loads(SPRITE_MAP_FILE.read_text()) if SPRITE_MAP_FILE.exists() else {}
+        
+        entries = [
+            photo_feed_entry(post, renditions, aliases, sprites)
+            for post in reversed(read_photo_posts(posts_dir))
+        ]
+        
+        feed_dir.mkdir(parents=True, exist_ok=True)
+        site_path = '/' + feed_dir.resolve().relative_to(SITE_DIR.resolve()).as_posix()
+        pages = []
+        for start in range(0, len(entries), FEED_PAGE_SIZE):
+            data = json.dumps({'photos': entries[start:start + FEED_PAGE_SIZE]}, separators=(',', ':')).encode()
+            name = f"photos-{hashlib.sha256(data).hexdigest()[:16]}.json"
+            if not (feed_dir / name).exists():
+                tmp_path = feed_dir / f".{name}.tmp"
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, feed_dir / name)
+                logger.info(f"Wrote feed page {name} ({len(data)} bytes)")
+            pages.append(f"{site_path}/{name}")
+        
+        index = {
+            'page_size': FEED_PAGE_SIZE,
+            'total': len(entries),
+            'pages': pages,
+            'first': entries[:FEED_PAGE_SIZE],
+        }
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_file.with_name(f".{index_file.name}.tmp")
+        tmp_path.write_text(json.dumps(index, indent=2) + '\n')
+        os.replace(tmp_path, index_file)
+        logger.info(f"Updated {index_file} with {len(entries)} photo(s) in {len(pages)} page(s)")
+        
+        in_use = {Path(page).name for page in pages}
+        for path in feed_dir.glob('photos-*.json'):
+            if path.name not in in_use:
+                path.unlink()
+                logger.info(f"Removed unused feed page {path.name}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error building the photo feed: {e}")
+        return False
+
+
+def _media_item_id(item: Dict, index: int) -> str:
+    return item.get('id') or f"item-{index}"
+
+
+def _journal_session(
+    journal: Optional[SessionJournal],
+    session_id: str,
+    media_items: Iterable[Dict],
+    resume: bool
+) -> Tuple[Iterator[Dict], Dict[str, Dict]]:
+    """
+    Record items in the journal as they are listed, and look up those already uploaded when resuming.
+    
+    Returns:
+        Tuple of (the media items, journaled as they are consumed; media item ID -> journal row
+        for items uploaded by an earlier run)
+    """
+    if not journal:
+        return iter(media_items), {}
+    
+    previous = journal.uploaded_items(session_id) if resume else {}
+    if resume:
+        logger.info(f"Resuming: {len(previous)} item(s) already uploaded by an earlier run")
+    
+    def listed() -> Iterator[Dict]:
+        for i, item in enumerate(media_items, 1):
+            media_item_id = _media_item_id(item, i)
+            if media_item_id not in previous:
+                journal.record(session_id, media_item_id, JOURNAL_LISTED)
+            yield item
+    
+    return listed(), previous
+
+
+class SessionRun:
+    """
+    Per-session settings and shared state handed to every item transfer.
+    
+    Workers add to the stats, alias and rendition maps as items finish; the
+    manifests are written once by finish() when the whole session is done.
+    """
+    
+    def __init__(
+        self,
+        session_id: str,
+        clients: ClientContext,
+        chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+        byte_budget: Optional[ByteBudget] = None,
+        upload_mode: str = UPLOAD_OVERWRITE,
+        journal: Optional[SessionJournal] = None,
+        rendition_pool: Optional[ProcessPoolExecutor] = None,
+        range_parts: int = DEFAULT_RANGE_PARTS,
+        range_min_size: int = DEFAULT_RANGE_MIN_MB * 1024 * 1024,
+        posts_dir: Optional[Path] = None
+    ):
+        self.session_id = session_id
+        self.clients = clients
+        self.chunk_size = chunk_size
+        self.byte_budget = byte_budget
+        self.upload_mode = upload_mode
+        self.journal = journal
+        self.rendition_pool = rendition_pool
+        self.range_parts = range_parts
+        self.range_min_size = range_min_size
+        self.posts_dir = posts_dir
+        self.stats = TransferStats()
+        self.aliases = {}
+        self.renditions = {}
+    
+    def finish(self) -> bool:
+        """Write the alias and rendition manifests; returns False if either failed."""
+        ok = True
+        if self.upload_mode == UPLOAD_CONTENT_ADDRESSED:
+            ok = save_alias_manifest(self.aliases, self.clients) and ok
+        if self.rendition_pool:
+            ok = save_rendition_manifest(self.renditions, self.clients) and ok
+        return ok
+
+
+def transfer_media_item(
+    run: SessionRun,
+    media_item_id: str,
+    filename: str,
+    download_url: str,
+    auth: TokenProvider,
+    mime_type: str,
+    previous: Optional[Dict] = None,
+    create_time: Optional[str] = None,
+    local: Optional[CachedOriginal] = None
+) -> bool:
+    """
+    Transfer one media item to Azure, recording progress in the journal.
+    
+    When renditions or photo posts are enabled, image bytes are also copied
+    to a local temp file as they stream. The renditions and the post's
+    analysis are produced from it afterwards with a single decode. Failures
+    there are logged but do not fail the item; pages fall back to
+    on-the-fly transforms for photos missing from the manifest.
+    
+    With an originals cache attached to the clients, a cached item is read
+    from disk instead of Google, and a downloaded one is copied into the
+    cache (which then also serves as the renditions' local file). A local
+    file (sync-dir) is read the same way and bypasses the cache.
+    
+    Args:
+        run: Per-session settings and shared state
+        media_item_id: The media item ID (journal key)
+        filename: Blob name to store the item under
+        download_url: The download URL with parameters
+        auth: Google access token for the download
+        mime_type: MIME type of the item
+        previous: Journal row if this item was already uploaded by an earlier run
+        create_time: Picker createTime, used for the post when the image has no EXIF date
+        local: The item as a mapped local file with its expected hash; closed when done
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    if previous:
+        logger.info(f"Already uploaded in an earlier run (ETag {previous['etag']}), skipping: {filename}")
+        if previous['alias']:
+            run.aliases[previous['alias']] = previous['blob_name']
+        run.stats.add(resumed=1)
+        return True
+    
+    started = time.monotonic()
+    
+    def on_downloaded(hasher: ContentHasher) -> None:
+        if run.journal:
+            run.journal.record(
+                run.session_id, media_item_id, JOURNAL_DOWNLOADED,
+                size=hasher.size, sha256=hasher.sha256
+            )
+    
+    suffix = Path(filename).suffix
+    cache = None if local else run.clients.originals
+    cached = local or (cache.open(media_item_id) if cache else None)
+    wants_local = (run.rendition_pool or run.posts_dir) and mime_type.startswith('image/')
+    copy_to = None
+    if cached is None and cache:
+        copy_to = cache.incoming(suffix)
+    elif cached is None and wants_local:
+        copy_to = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    
+    # Items that resolve to the same blob name upload one at a time
+    with run.clients.blob_locks.hold(filename):
+        try:
+            stored = stream_image_to_azure(
+                download_url, auth, filename, run.clients,
+                mime_type, run.chunk_size, run.byte_budget,
+                upload_mode=run.upload_mode, stats=run.stats, aliases=run.aliases,
+                on_downloaded=on_downloaded, copy_to=copy_to,
+                range_parts=run.range_parts, range_min_size=run.range_min_size,
+                cached=cached
+            )
+            if stored and cached and stored['sha256'] != cached.sha256:
+                if local:
+                    logger.error(f"{local.path} changed while it was being uploaded; sync again to pick up the new content")
+                else:
+                    logger.error(f"Cached original for {filename} does not match its recorded hash; rerun to download it again")
+                    cache.discard(cached.sha256)
+                stored = None
+            if stored and run.clients.catalog:
+                run.clients.catalog.record(
+                    stored['blob_name'], size=stored['size'], etag=stored['etag'], sha256=stored['sha256']
+                )
+            local_path = cached.path if cached else None
+            if stored and copy_to:
+                copy_to.close()
+                if cache:
+                    # The cache is only an optimisation: on a disk error keep using the download
+                    try:
+                        local_path = cache.store(media_item_id, Path(copy_to.name), stored['sha256'], suffix)
+                    except OSError as e:
+                        logger.warning(f"Could not cache the original of {filename}, using the download: {e}")
+                local_path = local_path or Path(copy_to.name)
+            if stored and local_path and wants_local:
+                analysis = None
+                if run.rendition_pool:
+                    analysis = generate_renditions(
+                        str(local_path), filename, run.clients, run.rendition_pool, run.renditions,
+                        stored['sha256'] if run.upload_mode == UPLOAD_CONTENT_ADDRESSED else None
+                    )
+                if run.posts_dir:
+                    analysis = analysis or analyze_photo(str(local_path), filename, run.clients)
+                    if analysis:
+                        write_photo_post(filename, analysis, run.posts_dir, create_time)
+        finally:
+            if cached:
+                cached.close()
+            if copy_to:
+                copy_to.close()
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(copy_to.name)
+    
+    if run.journal:
+        if stored:
+            run.journal.record(
+                run.session_id, media_item_id, JOURNAL_UPLOADED,
+                blob_name=stored['blob_name'],
+                alias=filename if run.upload_mode == UPLOAD_CONTENT_ADDRESSED else None,
+                etag=stored['etag'], size=stored['size'], sha256=stored['sha256']
+            )
+        else:
+            run.journal.record(run.session_id, media_item_id, JOURNAL_FAILED)
+    
+    run.clients.metrics.record_item(
+        filename, stored['size'] if stored else 0, time.monotonic() - started, stored is not None
+    )
+    return stored is not None
+
+
+def process_picker_session_with_token(
+    session_id: str,
+    access_token: 'str | TokenProvider',
+    clients: ClientContext,
+    custom_filename: Optional[str] = None,
+    workers: int = DEFAULT_WORKERS,
+    max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_MB * 1024 * 1024,
+    chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+    upload_mode: str = UPLOAD_OVERWRITE,
+    journal: Optional[SessionJournal] = None,
+    resume: bool = False,
+    rendition_pool: Optional[ProcessPoolExecutor] = None,
+    range_parts: int = DEFAULT_RANGE_PARTS,
+    range_min_size: int = DEFAULT_RANGE_MIN_MB * 1024 * 1024,
+    posts_dir: Optional[Path] = None
+) -> bool:
+    """
+    Process a Picker session using an access token: fetch media items and upload them to Azure.
+    
+    A session whose token has already expired (and cannot be refreshed) is
+    rejected before any request is sent.
+    
+    Args:
+        session_id: The Picker session ID
+        access_token: OAuth access token, or a TokenProvider tracking its expiry
+        clients: Run-scoped client context
+        custom_filename: Optional custom filename to use instead of original
+        workers: Number of items to download/upload concurrently
+        max_inflight_bytes: Cap on downloaded bytes held in memory across workers
+        chunk_size: Size of each streamed block in bytes
+        upload_mode: UPLOAD_OVERWRITE, UPLOAD_DEDUPE or UPLOAD_CONTENT_ADDRESSED
+        journal: Optional journal recording per-item progress
+        resume: Skip items the journal shows as already uploaded
+        rendition_pool: Process pool for rendering renditions; None disables them
+        range_parts: Parallel Range requests for large items (1 disables)
+        range_min_size: Smallest item, in bytes, worth splitting into ranges
+        posts_dir: Write a photo-page post here for each new image; None disables them
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    logger.info(f"\n{'='*60}")
+    logger.info(f"Processing Picker Session: {session_id}")
+    logger.info(f"Using access token from session file")
+    if custom_filename:
+        logger.info(f"Custom filename: {custom_filename}")
+    logger.info(f"{'='*60}")
+    
+    tokens = access_token if isinstance(access_token, TokenProvider) else TokenProvider(access_token)
+    remaining = tokens.remaining()
+    if remaining is not None:
+        if remaining <= 0 and not tokens.refreshable:
+            logger.error(f"Not processing session: {tokens.describe()}; pick the photos again for a new token")
+            return False
+        logger.info(f"Access token: {tokens.describe()}")
+    
+    try:
+        # Fetch media items from the session using the access token
+        # Transfers start as soon as the first page arrives
+        media_items = fetch_session_media_items_with_token(session_id, tokens, clients)
+        first = next(media_items, None)
+        if first is None:
+            logger.warning("No media items found in session")
+            return False
+        
+        byte_budget = ByteBudget(max_inflight_bytes, clients.metrics) if workers > 1 else None
+        run = SessionRun(
+            session_id, clients, chunk_size, byte_budget, upload_mode, journal,
+            rendition_pool, range_parts, range_min_size, posts_dir
+        )
+        listed, previous = _journal_session(journal, session_id, itertools.chain([first], media_items), resume)
+        
+        def process_item(i: int, item: Dict) -> bool:
+            # Log the full item structure to understand what we got
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"\nMedia item {i} structure: {json.dumps(item, indent=2)}")
+            
+            # Extract data from the nested mediaFile object
+            media_file = item.get('mediaFile', {})
+            original_filename = media_file.get('filename', f'photo-{i}.jpg')
+            
+            # Use custom filename if provided, otherwise use original
+            filename = custom_filename if custom_filename else original_filename
+            
+            download_url = media_file.get('baseUrl')
+            mime_type = media_file.get('mimeType', 'image/jpeg')
+            
+            logger.info(f"\n[{i}] Processing: {filename}")
+            if custom_filename:
+                logger.info(f"  Original: {original_filename}")
+                logger.info(f"  Custom: {filename}")
+            
+            if not download_url:
+                logger.error("No baseUrl found for media item")
+                return False
+            
+            # Stream image from Google to Azure using access token
+            download_url_with_param = f"{download_url}=d"
+            media_item_id = _media_item_id(item, i)
+            return transfer_media_item(
+                run, media_item_id, filename, download_url_with_param, tokens,
+                mime_type, previous.get(media_item_id), item.get('createTime')
+            )
+        
+        successful, failed = run_media_items(listed, process_item, workers, clients.metrics)
+        
+        manifest_saved = run.finish()
+        
+        # Summary
+        logger.info(f"\n{'='*60}")
+        logger.info(f"SESSION PROCESSING COMPLETE")
+        logger.info(f"{'='*60}")
+        logger.info(f"Total items: {successful + failed}")
+        logger.info(f"Successful: {successful}")
+        logger.info(f"Failed: {failed}")
+        run.stats.log_summary()
+        if failed and not tokens.refreshable and (tokens.remaining() or 1) <= 0:
+            logger.error(f"{tokens.describe()}; pick the photos again and rerun with --resume to finish the rest")
+        
+        return failed == 0 and manifest_saved
+        
+    except Exception as e:
+        logger.error(f"Error processing session: {e}")
+        return False
+
+
+def _prefetch_pages(fetch_page: Callable[[Optional[str]], Dict]) -> Iterator[Dict]:
+    """
+    Yield the media items of each page as it arrives, fetching the next one in the background.
+    
+    While the caller works through a page's items, the page for its
+    nextPageToken is already being requested, so consumers never wait on more
+    than one round trip at a time.
+    
+    Args:
+        fetch_page: Callable taking a page token (None for the first page) and returning the page's JSON
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='list-pages') as executor:
+        future = executor.submit(fetch_page, None)
+        listed = 0
+        while future is not None:
+            data = future.result()
+            page_token = data.get('nextPageToken')
+            future = executor.submit(fetch_page, page_token) if page_token else None
+            
+            items = data.get('mediaItems', [])
+            listed += len(items)
+            logger.info(f"Fetched {len(items)} items (total: {listed})")
+            yield from items
+
+
+def fetch_session_media_items_with_token(session_id: str, tokens: TokenProvider, clients: ClientContext) -> Iterator[Dict]:
+    """
+    Stream all media items from a Picker session using an access token.
+    
+    Items are yielded page by page as the Picker API returns them, so
+    transfers can start after the first page; see _prefetch_pages.
+    
+    Args:
+        session_id: The Picker session ID
+        tokens: Access token for the session
+        clients: Run-scoped client context
+        
+    Yields:
+        Media item dictionaries
+    """
+    base_url = f'{PICKER_API_BASE}/mediaItems'
+    
+    def fetch_page(page_token: Optional[str]) -> Dict:
+        # Build query parameters
+        params = {'sessionId': session_id}
+        if page_token:
+            params['pageToken'] = page_token
+        
+        logger.info(f"Fetching media items from: {base_url}?sessionId={session_id}")
+        
+        with clients.metrics.timed('list_media_items'):
+            response = clients.get(base_url, auth=tokens, params=params)
+        
+        if not response.ok:
+            logger.error(f"HTTP {response.status_code}: {response.reason}")
+            try:
+                error_data = response.json()
+                logger.error(f"Error response: {json.dumps(error_data, indent=2)}")
+            except:
+                logger.error(f"Error response: {response.text}")
+            
+            # Check if session exists by querying session status
+            logger.info("Checking session status...")
+            session_url = f'{PICKER_API_BASE}/sessions/{session_id}'
+            session_response = clients.get(session_url, auth=tokens)
+            if session_response.ok:
+                session_data = session_response.json()
+                logger.info(f"Session status: {json.dumps(session_data, indent=2)}")
+                
+                # Check for pickup token or other properties
+                if 'pickupToken' in session_data:
+                    logger.info(f"Found pickup token: {session_data['pickupToken']}")
+                    logger.error("This session uses a pickup token - you may need to use the Library API instead")
+                
+                if not session_data.get('mediaItemsSet'):
+                    logger.error("Session exists but mediaItemsSet is false - user may not have completed selection")
+                else:
+                    logger.error("Session shows mediaItemsSet=true but /mediaItems endpoint returns 404")
+                    logger.error("This may be a limitation of the Picker API - it might not support listing media items")
+            else:
+                logger.error(f"Session not found or expired (HTTP {session_response.status_code})")
+            
+            response.raise_for_status()
+        
+        return response.json()
+    
+    return _prefetch_pages(fetch_page)
+
+
+def process_picker_session(
+    session_id: str,
+    clients: ClientContext,
+    creds: Credentials,
+    workers: int = DEFAULT_WORKERS,
+    max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_MB * 1024 * 1024,
+    chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+    upload_mode: str = UPLOAD_OVERWRITE,
+    journal: Optional[SessionJournal] = None,
+    resume: bool = False,
+    rendition_pool: Optional[ProcessPoolExecutor] = None,
+    range_parts: int = DEFAULT_RANGE_PARTS,
+    range_min_size: int = DEFAULT_RANGE_MIN_MB * 1024 * 1024,
+    posts_dir: Optional[Path] = None
+) -> bool:
+    """
+    Process a Picker session: fetch media items and upload them to Azure.
+    
+    The credentials' token is refreshed in the background ahead of expiry,
+    so long batches keep going past the first token's hour.
+    
+    Args:
+        session_id: The Picker session ID
+        clients: Run-scoped client context
+        creds: Google API credentials
+        workers: Number of items to download/upload concurrently
+        max_inflight_bytes: Cap on downloaded bytes held in memory across workers
+        chunk_size: Size of each streamed block in bytes
+        upload_mode: UPLOAD_OVERWRITE, UPLOAD_DEDUPE or UPLOAD_CONTENT_ADDRESSED
+        journal: Optional journal recording per-item progress
+        resume: Skip items the journal shows as already uploaded
+        rendition_pool: Process pool for rendering renditions; None disables them
+        range_parts: Parallel Range requests for large items (1 disables)
+        range_min_size: Smallest item, in bytes, worth splitting into ranges
+        posts_dir: Write a photo-page post here for each new image; None disables them
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    logger.info(f"\n{'='*60}")
+    logger.info(f"Processing Picker Session: {session_id}")
+    logger.info(f"{'='*60}")
+    
+    tokens = TokenProvider.from_credentials(creds).start()
+    try:
+        # Fetch media items from the session
+        # Transfers start as soon as the first page arrives
+        media_items = fetch_session_media_items(session_id, tokens, clients)
+        first = next(media_items, None)
+        if first is None:
+            logger.warning("No media items found in session")
+            return False
+        
+        byte_budget = ByteBudget(max_inflight_bytes, clients.metrics) if workers > 1 else None
+        run = SessionRun(
+            session_id, clients, chunk_size, byte_budget, upload_mode, journal,
+            rendition_pool, range_parts, range_min_size, posts_dir
+        )
+        listed, previous = _journal_session(journal, session_id, itertools.chain([first], media_items), resume)
+        
+        def process_item(i: int, item: Dict) -> bool:
+            filename = item.get('filename', f'photo-{i}.jpg')
+            download_url = item.get('baseUrl')
+            mime_type = item.get('mimeType', 'image/jpeg')
+            
+            logger.info(f"\n[{i}] Processing: {filename}")
+            
+            if not download_url:
+                logger.error("No baseUrl found for media item")
+                return False
+            
+            # Stream image from Google to Azure
+            download_url_with_param = f"{download_url}=d"
+            media_item_id = _media_item_id(item, i)
+            return transfer_media_item(
+                run, media_item_id, filename, download_url_with_param, tokens,
+                mime_type, previous.get(media_item_id), item.get('createTime')
+            )
+        
+        successful, failed = run_media_items(listed, process_item, workers, clients.metrics)
+        
+        manifest_saved = run.finish()
+        
+        # Summary
+        logger.info(f"\n{'='*60}")
+        logger.info(f"SESSION PROCESSING COMPLETE")
+        logger.info(f"{'='*60}")
+        logger.info(f"Total items: {successful + failed}")
+        logger.info(f"Successful: {successful}")
+        logger.info(f"Failed: {failed}")
+        run.stats.log_summary()
+        
+        return failed == 0 and manifest_saved
+        
+    except Exception as e:
+        logger.error(f"Error processing session: {e}")
+        return False
+    finally:
+        tokens.close()
+
+
+def fetch_session_media_items(session_id: str, tokens: TokenProvider, clients: ClientContext) -> Iterator[Dict]:
+    """
+    Stream all media items from a Picker session, page by page as they arrive.
+    
+    Args:
+        session_id: The Picker session ID
+        tokens: Access token from the Google API credentials
+        clients: Run-scoped client context
+        
+    Yields:
+        Media item dictionaries
+    """
+    base_url = f'{PICKER_API_BASE}/mediaItems'
+    
+    def fetch_page(page_token: Optional[str]) -> Dict:
+        # Build query parameters
+        params = {'sessionId': session_id}
+        if page_token:
+            params['pageToken'] = page_token
+        
+        logger.info(f"Fetching media items from: {base_url}?sessionId={session_id}")
+        
+        with clients.metrics.timed('list_media_items'):
+            response = clients.get(base_url, auth=tokens, params=params)
+        response.raise_for_status()
+        return response.json()
+    
+    return _prefetch_pages(fetch_page)
+
+
+def process_session_file(
+    blob_name: str,
+    clients: ClientContext,
+    workers: int = DEFAULT_WORKERS,
+    max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_MB * 1024 * 1024,
+    chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+    upload_mode: str = UPLOAD_OVERWRITE,
+    journal: Optional[SessionJournal] = None,
+    resume: bool = False,
+    rendition_pool: Optional[ProcessPoolExecutor] = None,
+    range_parts: int = DEFAULT_RANGE_PARTS,
+    range_min_size: int = DEFAULT_RANGE_MIN_MB * 1024 * 1024,
+    posts_dir: Optional[Path] = None
+) -> bool:
+    """
+    Read a session metadata blob and process the session it describes.
+    
+    Args:
+        blob_name: Session metadata blob (e.g., picker-session-123456.json)
+        clients: Run-scoped client context
+        workers: Number of items to download/upload concurrently
+        max_inflight_bytes: Cap on downloaded bytes held in memory across workers
+        chunk_size: Size of each streamed block in bytes
+        upload_mode: UPLOAD_OVERWRITE, UPLOAD_DEDUPE or UPLOAD_CONTENT_ADDRESSED
+        journal: Optional journal recording per-item progress
+        resume: Skip items the journal shows as already uploaded
+        rendition_pool: Process pool for rendering renditions; None disables them
+        range_parts: Parallel Range requests for large items (1 disables)
+        range_min_size: Smallest item, in bytes, worth splitting into ranges
+        posts_dir: Write a photo-page post here for each new image; None disables them
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    # Read session ID and access token from file
+    metadata = download_metadata_from_azure(blob_name, clients)
+    if not metadata:
+        return False
+    
+    session_id = metadata.get('sessionId')
+    access_token = metadata.get('accessToken')
+    custom_filename = metadata.get('customFilename')  # Extract custom filename
+    if not session_id:
+        logger.error(f"No sessionId found in {blob_name}")
+        return False
+    if not access_token:
+        logger.error(f"No accessToken found in {blob_name}")
+        return False
+    logger.info("Found access token in session file - will use it instead of credentials")
+    if custom_filename:
+        logger.info(f"Found custom filename in session file: {custom_filename}")
+    
+    logger.info(f"Processing Picker session: {session_id}")
+    return process_picker_session_with_token(
+        session_id, TokenProvider.from_session(metadata, clients), clients, custom_filename,
+        workers=workers, max_inflight_bytes=max_inflight_bytes,
+        chunk_size=chunk_size, upload_mode=upload_mode,
+        journal=journal, resume=resume, rendition_pool=rendition_pool,
+        range_parts=range_parts, range_min_size=range_min_size, posts_dir=posts_dir
+    )
+
+
+def process_and_archive_session(blob_name: str, clients: ClientContext, **session_options) -> bool:
+    """Process one session file, then move it to processed/ or failed/."""
+    try:
+        ok = process_session_file(blob_name, clients, **session_options)
+    except Exception as e:
+        logger.error(f"Error processing {blob_name}: {e}")
+        ok = False
+    move_session_blob(blob_name, PROCESSED_PREFIX if ok else FAILED_PREFIX, clients)
+    return ok
+
+
+def process_all_pending_sessions(
+    clients: ClientContext,
+    session_workers: int = DEFAULT_SESSION_WORKERS,
+    **session_options
+) -> bool:
+    """
+    Drain every pending picker-session-*.json blob in one run.
+    
+    Sessions are pulled from a shared work queue by session_workers threads.
+    Each finished session blob is moved to processed/ or failed/ so later
+    runs never list or download it again.
+    
+    Args:
+        clients: Run-scoped client context
+        session_workers: Number of sessions processed concurrently
+        **session_options: Passed through to process_session_file
+        
+    Returns:
+        True if every session succeeded, False otherwise
+    """
+    session_files = list_pending_session_files(clients)
+    if not session_files:
+        logger.info("No pending session files found in Azure Storage")
+        return True
+    
+    # Sessions run side by side, so split the in-flight byte cap between them
+    if 'max_inflight_bytes' in session_options:
+        session_options['max_inflight_bytes'] //= min(session_workers, len(session_files))
+    
+    succeeded = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=session_workers) as executor:
+        futures = {
+            executor.submit(process_and_archive_session, name, clients, **session_options): name
+            for name in session_files
+        }
+        for future in as_completed(futures):
+            (succeeded if future.result() else failed).append(futures[future])
+    
+    logger.info(f"\n{'='*60}")
+    logger.info(f"ALL PENDING SESSIONS COMPLETE")
+    logger.info(f"{'='*60}")
+    logger.info(f"Total sessions: {len(session_files)}")
+    logger.info(f"Successful: {len(succeeded)}")
+    logger.info(f"Failed: {len(failed)}")
+    for blob_name in sorted(failed):
+        logger.info(f"  Failed: {blob_name} (moved to {FAILED_PREFIX})")
+    
+    return not failed
+
+
+class SessionWatermark:
+    """
+    Last-modified high-water mark for session discovery.
+    
+    A listed session is new if it was written after the newest one already
+    picked up. Names written in that same last-modified tick are remembered
+    too, since Azure timestamps have one-second resolution and two uploads
+    can share one. A re-uploaded blob gets a newer timestamp and is picked
+    up again; one that could not be moved away is not retried in a loop.
+    """
+    
+    def __init__(self):
+        self.last_modified = None
+        self._names_at_mark = set()
+    
+    def new_blobs(self, blobs: Iterable) -> List:
+        """Return the blobs not seen before, oldest first, and advance the mark."""
+        new = sorted(
+            (
+                blob for blob in blobs
+                if self.last_modified is None
+                or blob.last_modified > self.last_modified
+                or (blob.last_modified == self.last_modified and blob.name not in self._names_at_mark)
+            ),
+            key=lambda blob: blob.last_modified
+        )
+        for blob in new:
+            if self.last_modified is None or blob.last_modified > self.last_modified:
+                self.last_modified = blob.last_modified
+                self._names_at_mark = set()
+            self._names_at_mark.add(blob.name)
+        return new
+
+
+def watch_sessions(
+    clients: ClientContext,
+    session_workers: int = DEFAULT_SESSION_WORKERS,
+    poll_interval: float = DEFAULT_POLL_SECONDS,
+    stop: Optional[threading.Event] = None,
+    metrics_path: Optional[Path] = None,
+    **session_options
+) -> None:
+    """
+    Keep running and ingest picker-session-*.json blobs as they are uploaded.
+    
+    Clients, journal, rendition pool and session workers stay warm for the
+    whole run, so a new session starts within one poll interval instead of
+    paying process startup and token/config loading each time. Discovery polls
+    only the picker-session- prefix (finished sessions are moved out of it)
+    and uses a last-modified watermark to pick out new uploads.
+    
+    Args:
+        clients: Run-scoped client context
+        session_workers: Number of sessions processed concurrently
+        poll_interval: Seconds between listings of the session prefix
+        stop: Event that ends the watch; Ctrl+C also stops it
+        metrics_path: If set, metrics are rewritten here after each finished session
+        **session_options: Passed through to process_session_file
+    """
+    stop = stop or threading.Event()
+    if 'max_inflight_bytes' in session_options:
+        session_options['max_inflight_bytes'] //= session_workers
+    
+    watermark = SessionWatermark()
+    running = {}
+    logger.info(f"Watching for new {SESSION_PREFIX}*.json blobs every {poll_interval:g}s (Ctrl+C to stop)")
+    
+    def complete(futures: List) -> None:
+        # The session blob was already moved by process_and_archive_session
+        for future in futures:
+            blob_name = running.pop(future)
+            if future.result():
+                logger.info(f"✓ Finished {blob_name}")
+            else:
+                logger.error(f"✗ {blob_name} failed (moved to {FAILED_PREFIX})")
+        if futures and metrics_path:
+            clients.metrics.write(metrics_path, (clients.google_limiter, clients.azure_limiter))
+    
+    with ThreadPoolExecutor(max_workers=session_workers) as executor:
+        try:
+            while not stop.is_set():
+                try:
+                    listed = [
+                        blob for blob in clients.container_client.list_blobs(name_starts_with=SESSION_PREFIX)
+                        if blob.name.endswith('.json')
+                    ]
+                except Exception as e:
+                    logger.error(f"Error listing session files: {e}")
+                    listed = []
+                
+                for blob in watermark.new_blobs(listed):
+                    age = (datetime.now(timezone.utc) - blob.last_modified).total_seconds()
+                    logger.info(f"New session file {blob.name} (uploaded {age:.1f}s ago)")
+                    future = executor.submit(process_and_archive_session, blob.name, clients, **session_options)
+                    running[future] = blob.name
+                
+                complete([future for future in running if future.done()])
+                stop.wait(poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Stopping watch...")
+        
+        if running:
+            logger.info(f"Waiting for {len(running)} session(s) in progress to finish")
+            for future in as_completed(list(running)):
+                complete([future])
+
+
+def scan_local_files(directory: Path) -> Iterator[Tuple[Path, os.stat_result, str]]:
+    """
+    Walk a directory for photos and videos, skipping hidden entries and other
+    files (such as the JSON sidecars of a Google Takeout export).
+    
+    Returns:
+        Iterator of (path, stat result, MIME type), in sorted order per directory
+    """
+    with os.scandir(directory) as scan:
+        entries = sorted(scan, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan_local_files(Path(entry.path))
+            continue
+        mime_type = mimetypes.guess_type(entry.name)[0] or ''
+        if entry.is_file() and mime_type.startswith(SYNC_MEDIA_TYPES):
+            stat = entry.stat()
+            if stat.st_size:
+                yield Path(entry.path), stat, mime_type
+
+
+def hash_local_file(path: Path) -> ContentHasher:
+    """Read a file once, computing the MD5 and SHA-256 the container records."""
+    hasher = ContentHasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def _stored_unchanged(row: Optional[Dict], item: Dict) -> bool:
+    """True if a catalog row describes a blob with the local file's size and content."""
+    if not row or row['size'] != item['size']:
+        return False
+    if row['sha256']:
+        return row['sha256'] == item['sha256']
+    return bool(row['content_md5']) and row['content_md5'] == item['content_md5']
+
+
+def sync_directory(
+    directory: Path,
+    clients: ClientContext,
+    hash_index: FileHashIndex,
+    prefix: str = '',
+    hash_workers: int = DEFAULT_HASH_WORKERS,
+    dry_run: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    chunk_size: int = DEFAULT_CHUNK_MB * 1024 * 1024,
+    upload_mode: str = UPLOAD_OVERWRITE,
+    rendition_pool: Optional[ProcessPoolExecutor] = None,
+    posts_dir: Optional[Path] = None
+) -> bool:
+    """
+    Upload the new or changed photos and videos in a local directory.
+    
+    Each file is stored under prefix + its path relative to directory. Files
+    are hashed on a thread pool, except those whose size and mtime match the
+    hash index, and compared by size and hash with the blob catalog, which
+    is re-listed once up front for the prefix (without one, only the
+    container root and the top-level directories being synced). Only files
+    whose blob is missing or differs are pushed, through the same transfer
+    as Picker items (renditions and posts included), and they start
+    uploading while the rest still hash. In content-addressed mode the
+    comparison is against objects/<sha256>, and files whose object already
+    exists only get their alias recorded.
+    
+    Args:
+        directory: Directory to sync, walked recursively
+        clients: Run-scoped client context
+        hash_index: Remembered hashes of files seen by earlier syncs
+        prefix: Blob name prefix for the synced files
+        hash_workers: Files hashed concurrently
+        dry_run: Log what would be uploaded without uploading it
+        workers: Number of files to upload concurrently
+        chunk_size: Size of each uploaded block in bytes
+        upload_mode: UPLOAD_OVERWRITE, UPLOAD_DEDUPE or UPLOAD_CONTENT_ADDRESSED
+        rendition_pool: Process pool for rendering renditions; None disables them
+        posts_dir: Write a photo-page post here for each new image; None disables them
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    directory = directory.resolve()
+    logger.info(f"\n{'='*60}")
+    logger.info(f"Syncing directory: {directory}")
+    logger.info(f"{'='*60}")
+    
+    content_addressed = upload_mode == UPLOAD_CONTENT_ADDRESSED
+    try:
+        files = list(scan_local_files(directory))
+        logger.info(f"Found {len(files)} photo/video file(s)")
+        if content_addressed:
+            clients.catalog.refresh(clients.container_client, OBJECTS_PREFIX)
+        elif prefix:
+            clients.catalog.refresh(clients.container_client, prefix)
+        else:
+            logger.warning("No --prefix given: files are stored at the container root, beside the Picker uploads")
+            subdirs = {
+                path.relative_to(directory).parts[0] + '/'
+                for path, _, _ in files if len(path.relative_to(directory).parts) > 1
+            }
+            clients.catalog.refresh(clients.container_client, '', subdirs=subdirs)
+        known_aliases = json.loads(ALIAS_MANIFEST_FILE.read_text()) if ALIAS_MANIFEST_FILE.exists() else {}
+        
+        run = SessionRun(
+            f"sync-dir:{directory}", clients, chunk_size, upload_mode=upload_mode,
+            rendition_pool=rendition_pool, posts_dir=posts_dir
+        )
+        counts = {'unchanged': 0, 'hashed': 0, 'hash_failed': 0}
+        
+        def local_item(path: Path, stat: os.stat_result, mime_type: str, sha256: str, content_md5: str) -> Dict:
+            return {
+                'id': str(path),
+                'path': path,
+                'blob_name': prefix + path.relative_to(directory).as_posix(),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'mime_type': mime_type,
+                'sha256': sha256,
+                'content_md5': content_md5,
+            }
+        
+        def needs_upload(item: Dict) -> bool:
+            if content_addressed:
+                object_name = content_addressed_name(item['sha256'], item['blob_name'])
+                if not _stored_unchanged(clients.catalog.get(object_name), item):
+                    return True
+                if known_aliases.get(item['blob_name']) != object_name:
+                    run.aliases[item['blob_name']] = object_name
+            elif not _stored_unchanged(clients.catalog.get(item['blob_name']), item):
+                return True
+            counts['unchanged'] += 1
+            return False
+        
+        def hash_file(path: Path, stat: os.stat_result) -> ContentHasher:
+            with clients.metrics.timed('hash', stat.st_size):
+                return hash_local_file(path)
+        
+        def changed() -> Iterator[Dict]:
+            # Files with a remembered hash are compared first, while the rest hash
+            with ThreadPoolExecutor(max_workers=hash_workers) as hash_pool:
+                futures = {}
+                for path, stat, mime_type in files:
+                    remembered = hash_index.lookup(str(path), stat.st_size, stat.st_mtime_ns)
+                    if remembered:
+                        item = local_item(path, stat, mime_type, *remembered)
+                        if needs_upload(item):
+                            yield item
+                    else:
+                        futures[hash_pool.submit(hash_file, path, stat)] = (path, stat, mime_type)
+                
+                for future in as_completed(futures):
+                    path, stat, mime_type = futures[future]
+                    try:
+                        hasher = future.result()
+                    except OSError as e:
+                        logger.error(f"Could not read {path}: {e}")
+                        counts['hash_failed'] += 1
+                        continue
+                    content_md5 = base64.b64encode(hasher.md5).decode()
+                    hash_index.record(str(path), stat.st_size, stat.st_mtime_ns, hasher.sha256, content_md5)
+                    counts['hashed'] += 1
+                    item = local_item(path, stat, mime_type, hasher.sha256, content_md5)
+                    if needs_upload(item):
+                        yield item
+        
+        def process_item(i: int, item: Dict) -> bool:
+            logger.info(f"\n[{i}] {'Would upload' if dry_run else 'Uploading'}: {item['blob_name']} ({item['size']} bytes)")
+            if dry_run:
+                return True
+            try:
+                local = CachedOriginal(item['path'], item['sha256'])
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not open {item['path']}: {e}")
+                return False
+            taken = datetime.fromtimestamp(item['mtime']).isoformat(timespec='seconds')
+            return transfer_media_item(
+                run, item['id'], item['blob_name'], str(item['path']), None,
+                item['mime_type'], create_time=taken, local=local
+            )
+        
+        successful, failed = run_media_items(changed(), process_item, workers, clients.metrics)
+        manifest_saved = dry_run or run.finish()
+        
+        # Summary
+        logger.info(f"\n{'='*60}")
+        logger.info(f"DIRECTORY SYNC {'DRY RUN ' if dry_run else ''}COMPLETE")
+        logger.info(f"{'='*60}")
+        logger.info(f"Files: {len(files)}")
+        logger.info(f"Hashed: {counts['hashed']} (the rest matched the hash index)")
+        logger.info(f"Unchanged: {counts['unchanged']}")
+        logger.info(f"{'To upload' if dry_run else 'Uploaded'}: {successful}")
+        logger.info(f"Failed: {failed + counts['hash_failed']}")
+        if not dry_run:
+            run.stats.log_summary()
+        
+        return failed == 0 and counts['hash_failed'] == 0 and manifest_saved
         
     except Exception as e:
-        logger.error(f"Error fetching session media items: {e}")
-        return []
+        logger.error(f"Error syncing {directory}: {e}")
+        return False
 
 
-def main():
-    """Main entry point for the script."""
-    parser = argparse.ArgumentParser(
-        description='Process Google Photos Picker sessions and upload images to Azure'
+def render_mirror_transforms(source_path: str, thumb_path: str, page_path: str) -> None:
+    """
+    Render the CDN transforms the layouts request for one image.
+    
+    Runs in a worker process. THUMB_TRANSFORM is a 200x200 center crop and
+    PAGE_TRANSFORM an 800px-wide resize (never upscaled), both EXIF-rotated
+    and saved in the source's format, as format=auto does for browsers
+    without AVIF/WebP.
+    """
+    from PIL import Image, ImageOps
+    
+    with Image.open(source_path) as original:
+        image_format = original.format
+        image = ImageOps.exif_transpose(original)
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+    width, height = image.size
+    page_width = min(MIRROR_PAGE_WIDTH, width)
+    outputs = [
+        (thumb_path, ImageOps.fit(image, (RENDITION_THUMB_SIZE, RENDITION_THUMB_SIZE), Image.Resampling.LANCZOS)),
+        (page_path, image if page_width == width else image.resize(
+            (page_width, round(height * page_width / width)), Image.Resampling.LANCZOS
+        )),
+    ]
+    for path, rendered in outputs:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        rendered.save(tmp_path, image_format, quality=MIRROR_QUALITY)
+        os.replace(tmp_path, path)
+
+
+def download_mirror_blob(
+    blob_name: str,
+    path: Path,
+    clients: ClientContext,
+    etag: Optional[str] = None
+) -> Optional[Dict]:
+    """
+    Download one blob into the mirror, conditional on the copy already there.
+    
+    With an ETag for the local copy the request carries If-None-Match, so an
+    unchanged blob answers 304 and nothing is transferred.
+    
+    Args:
+        blob_name: Name of the blob
+        path: Local file the blob is mirrored to
+        clients: Run-scoped client context
+        etag: ETag of the local copy, if there is one
+        
+    Returns:
+        Dict with the blob's etag, size and whether it was modified, or None if failed
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import HttpResponseError
+    
+    blob_client = clients.container_client.get_blob_client(blob_name)
+    condition = {'etag': etag, 'match_condition': MatchConditions.IfModified} if etag and path.exists() else {}
+    try:
+        try:
+            downloader = blob_client.download_blob(**condition)
+        except HttpResponseError as e:
+            # Some SDK versions raise ResourceNotModifiedError, others a bare 304
+            if e.status_code != 304:
+                raise
+            return {'etag': etag, 'size': path.stat().st_size, 'modified': False}
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with clients.metrics.timed('download', downloader.size):
+            with open(tmp_path, 'wb') as f:
+                downloader.readinto(f)
+        os.replace(tmp_path, path)
+        return {'etag': downloader.properties.etag, 'size': downloader.size, 'modified': True}
+        
+    except Exception as e:
+        logger.error(f"Error mirroring {blob_name}: {e}")
+        return None
+
+
+def mirror_container(
+    clients: ClientContext,
+    pool: ProcessPoolExecutor,
+    mirror_dir: Path = MIRROR_DIR,
+    workers: int = DEFAULT_MIRROR_WORKERS
+) -> bool:
+    """
+    Mirror the container into a local directory for offline Jekyll builds.
+    
+    Blobs are written to mirror_dir/images/<name> (session files are left
+    out: they hold access tokens) and every image also gets the THUMB_ and
+    PAGE_TRANSFORM renders under mirror_dir/cdn-cgi/image/..., the same
+    paths the layouts request from the CDN. The container is listed once
+    through the blob catalog, without descending into the skipped prefixes.
+    Blobs whose ETag or content hash matches the mirror's state file are
+    skipped without a request; the rest are fetched in parallel with
+    If-None-Match on the local copy's ETag, and rendered in the process pool
+    as they land. Files of blobs that were deleted are removed.
+    
+    Args:
+        clients: Run-scoped client context
+        pool: Process pool rendering the transforms
+        mirror_dir: Directory to mirror into (served as the site's asset_base_url)
+        workers: Blobs downloaded concurrently
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    state_file = mirror_dir / MIRROR_STATE_FILE
+    state = json.loads(state_file.read_text()) if state_file.exists() else {}
+    counts = collections.Counter()
+    
+    def mirror_paths(blob_name: str) -> Tuple[Path, Path, Path]:
+        return (
+            mirror_dir / ASSET_IMAGES_PATH / blob_name,
+            mirror_dir / THUMB_TRANSFORM / ASSET_IMAGES_PATH / blob_name,
+            mirror_dir / PAGE_TRANSFORM / ASSET_IMAGES_PATH / blob_name,
+        )
+    
+    def transformed(blob_name: str) -> bool:
+        # Renditions are already sized; the layouts only transform originals
+        mime_type = mimetypes.guess_type(blob_name)[0] or ''
+        return mime_type.startswith('image/') and not blob_name.startswith(RENDITION_PREFIX)
+    
+    try:
+        clients.catalog.refresh(clients.container_client, '', skip=MIRROR_SKIP_PREFIXES)
+        names = [
+            name for name in clients.catalog.names()
+            if not name.startswith(MIRROR_SKIP_PREFIXES)
+            and mirror_dir.resolve() in (mirror_dir / ASSET_IMAGES_PATH / name).resolve().parents
+        ]
+        logger.info(f"Mirroring {len(names)} blob(s) into {mirror_dir}")
+        
+        renders = {}
+        
+        def render(blob_name: str) -> None:
+            renders[pool.submit(render_mirror_transforms, *map(str, mirror_paths(blob_name)))] = blob_name
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            downloads = {}
+            for name in names:
+                row = clients.catalog.get(name)
+                local = state.get(name, {})
+                path, thumb_path, page_path = mirror_paths(name)
+                if path.exists() and (
+                    local.get('etag') == row['etag']
+                    or (row['sha256'] and local.get('sha256') == row['sha256'])
+                ):
+                    # Unchanged, or only its headers changed
+                    state[name] = dict(local, etag=row['etag'], sha256=row['sha256'])
+                    counts['unchanged'] += 1
+                    if transformed(name) and local.get('transforms', True) and not (thumb_path.exists() and page_path.exists()):
+                        render(name)
+                    continue
+                downloads[executor.submit(download_mirror_blob, name, path, clients, local.get('etag'))] = name
+            
+            for future in as_completed(downloads):
+                name = downloads[future]
+                result = future.result()
+                if result is None:
+                    counts['failed'] += 1
+                    continue
+                state[name] = {'etag': result['etag'], 'sha256': clients.catalog.get(name)['sha256']}
+                if result['modified']:
+                    counts['downloaded'] += 1
+                    counts['bytes'] += result['size']
+                else:
+                    counts['not_modified'] += 1
+                _, thumb_path, page_path = mirror_paths(name)
+                if transformed(name) and (result['modified'] or not (thumb_path.exists() and page_path.exists())):
+                    render(name)
+        
+        for future in as_completed(renders):
+            try:
+                future.result()
+                counts['rendered'] += 1
+            except Exception as e:
+                # Formats Pillow cannot open (e.g. HEIC) only lose their transforms,
+                # and are not retried until the blob changes
+                logger.warning(f"Could not render transforms of {renders[future]}: {e}")
+                state[renders[future]]['transforms'] = False
+        
+        for name in set(state) - set(names):
+            for path in mirror_paths(name):
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+            del state[name]
+            counts['removed'] += 1
+        
+    except Exception as e:
+        logger.error(f"Error mirroring the container: {e}")
+        return False
+    
+    finally:
+        mirror_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = state_file.with_name(f"{state_file.name}.tmp")
+        tmp_path.write_text(json.dumps(state, indent=2, sort_keys=True) + '\n')
+        os.replace(tmp_path, state_file)
+    
+    logger.info(f"\n{'='*60}")
+    logger.info(f"MIRROR COMPLETE")
+    logger.info(f"{'='*60}")
+    logger.info(f"Blobs: {len(names)}")
+    logger.info(f"Unchanged (skipped by ETag/hash): {counts['unchanged']}")
+    logger.info(f"Not modified (304): {counts['not_modified']}")
+    logger.info(f"Downloaded: {counts['downloaded']} ({counts['bytes']} bytes)")
+    logger.info(f"Transforms rendered: {counts['rendered']}")
+    logger.info(f"Removed: {counts['removed']}")
+    logger.info(f"Failed: {counts['failed']}")
+    return counts['failed'] == 0
+
+
+def _add_common_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--azure-config',
+        default=str(AZURE_CONFIG_FILE),
+        help=f'Path of the Azure Storage config (default: {AZURE_CONFIG_FILE.name} next to this script)'
     )
     parser.add_argument(
-        '--session-id',
-        help='Process a specific Picker session ID'
+        '--catalog',
+        default=str(CATALOG_FILE),
+        help=f'Path of the local blob catalog (default: {CATALOG_FILE.name} next to this script)'
+    )
+    parser.add_argument(
+        '--metrics-out',
+        metavar='PATH',
+        help='Write per-stage metrics to PATH.json and a Prometheus textfile to PATH.prom'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Profile the run with cProfile (all threads) and tracemalloc; '
+             'the stats are logged and saved to PATH.pstats with --metrics-out'
+    )
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        help=f'Keep-alive connections per host for Google and Azure (default: max({DEFAULT_POOL_SIZE}, --workers))'
+    )
+
+
+def _add_upload_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Number of media items to download/upload concurrently (default: {DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--chunk-mb',
+        type=int,
+        default=DEFAULT_CHUNK_MB,
+        help=f'Block size used when streaming images into Azure, in MB (default: {DEFAULT_CHUNK_MB})'
+    )
+    parser.add_argument(
+        '--upload-mode',
+        choices=UPLOAD_MODES,
+        default=UPLOAD_OVERWRITE,
+        help='overwrite: always upload; dedupe: skip items whose blob already has identical content; '
+             'content-addressed: store each unique image once under objects/ and alias filenames to it '
+             f'(default: {UPLOAD_OVERWRITE})'
+    )
+    parser.add_argument(
+        '--renditions',
+        action='store_true',
+        help='Also render 200px thumbnails and 800w/1600w JPEG+WebP renditions, upload them under '
+             f'{RENDITION_PREFIX} and update {RENDITION_MANIFEST_FILE.relative_to(SITE_DIR)}'
+    )
+    parser.add_argument(
+        '--rendition-processes',
+        type=int,
+        help='Worker processes for rendering renditions (default: CPU count)'
+    )
+    parser.add_argument(
+        '--posts',
+        action='store_true',
+        help='Write a photo-page post for each new image with its dimensions, EXIF date and orientation, '
+             'and a base64 LQIP placeholder; existing posts for the photo get those fields refreshed'
+    )
+    parser.add_argument(
+        '--posts-dir',
+        default=str(POSTS_DIR),
+        help=f'Directory the photo-page posts are written to (default: the site\'s {POSTS_DIR.name}/)'
+    )
+
+
+def _add_transfer_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--max-inflight-mb',
+        type=int,
+        default=DEFAULT_MAX_INFLIGHT_MB,
+        help=f'Cap on downloaded data held in memory across workers, in MB (default: {DEFAULT_MAX_INFLIGHT_MB})'
     )
     parser.add_argument(
+        '--range-parts',
+        type=int,
+        default=DEFAULT_RANGE_PARTS,
+        help='Parallel HTTP Range requests per large item; 1 downloads every item as a single stream '
+             f'(default: {DEFAULT_RANGE_PARTS})'
+    )
+    parser.add_argument(
+        '--range-min-mb',
+        type=int,
+        default=DEFAULT_RANGE_MIN_MB,
+        help=f'Only split items at least this large into ranges, in MB (default: {DEFAULT_RANGE_MIN_MB})'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip media items the journal shows as uploaded by an earlier, interrupted run'
+    )
+    parser.add_argument(
+        '--journal',
+        default=str(JOURNAL_FILE),
+        help=f'Path of the per-item progress journal (default: {JOURNAL_FILE.name} next to this script)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=str(ORIGINALS_CACHE_DIR),
+        help=f'Directory of the local cache of downloaded originals (default: {ORIGINALS_CACHE_DIR.name}/ next to this script)'
+    )
+    parser.add_argument(
+        '--cache-mb',
+        type=int,
+        default=DEFAULT_CACHE_MB,
+        help='Disk space for cached originals, in MB; least recently used ones are evicted beyond it, '
+             f'0 disables the cache (default: {DEFAULT_CACHE_MB})'
+    )
+    _add_upload_options(parser)
+
+
+def _add_session_worker_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--session-workers',
+        type=int,
+        default=DEFAULT_SESSION_WORKERS,
+        help=f'Number of sessions processed concurrently (default: {DEFAULT_SESSION_WORKERS})'
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the subcommand parser."""
+    parser = argparse.ArgumentParser(
+        description='Process Google Photos Picker sessions and upload images to Azure',
+        epilog='The older flag style (--session-file NAME, --all-pending, --watch, --list-sessions, '
+               '--refresh-catalog) is still accepted.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+    
+    process = commands.add_parser('process', help='Process one Picker session')
+    source = process.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         '--session-file',
         help='Process a session from a JSON file in Azure Storage (e.g., picker-session-123456.json)'
     )
-    parser.add_argument(
-        '--list-sessions',
+    source.add_argument(
+        '--session-id',
+        help='Process a specific Picker session ID'
+    )
+    _add_transfer_options(process)
+    _add_common_options(process)
+    
+    all_pending = commands.add_parser(
+        'all-pending',
+        help='Process every pending session file, moving each to processed/ or failed/ when done'
+    )
+    _add_session_worker_options(all_pending)
+    _add_transfer_options(all_pending)
+    _add_common_options(all_pending)
+    
+    watch = commands.add_parser('watch', help='Keep running and process new session files as they are uploaded')
+    watch.add_argument(
+        '--poll-interval',
+        type=float,
+        default=DEFAULT_POLL_SECONDS,
+        help=f'Seconds between checks for new session files (default: {DEFAULT_POLL_SECONDS})'
+    )
+    _add_session_worker_options(watch)
+    _add_transfer_options(watch)
+    _add_common_options(watch)
+    
+    list_sessions = commands.add_parser('list-sessions', help='List all session files in Azure Storage')
+    _add_common_options(list_sessions)
+    
+    refresh_catalog = commands.add_parser(
+        'refresh-catalog',
+        help='Re-list blobs under a prefix into the local catalog'
+    )
+    refresh_catalog.add_argument(
+        'prefix',
+        nargs='?',
+        default='',
+        help='Blob name prefix to refresh (default: the whole container)'
+    )
+    _add_common_options(refresh_catalog)
+    
+    sprites = commands.add_parser(
+        'sprites',
+        help='Rebuild the /photos/ thumbnail sprite sheets whose photos changed'
+    )
+    sprites.add_argument(
+        '--posts-dir',
+        default=str(POSTS_DIR),
+        help=f'Directory the photo-page posts are read from (default: the site\'s {POSTS_DIR.name}/)'
+    )
+    sprites.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help=f'Source images downloaded concurrently (default: {DEFAULT_POOL_SIZE})'
+    )
+    sprites.add_argument(
+        '--processes',
+        type=int,
+        help='Worker processes composing sheets (default: CPU count)'
+    )
+    _add_common_options(sprites)
+    
+    sync_dir = commands.add_parser(
+        'sync-dir',
+        help='Upload the new or changed photos and videos in a local directory'
+    )
+    sync_dir.add_argument(
+        'directory',
+        help='Directory to sync, including its subdirectories'
+    )
+    sync_dir.add_argument(
+        '--prefix',
+        default='',
+        help='Blob name prefix; each file is stored under it by its path relative to DIRECTORY (default: none)'
+    )
+    sync_dir.add_argument(
+        '--hash-workers',
+        type=int,
+        default=DEFAULT_HASH_WORKERS,
+        help=f'Files hashed concurrently (default: {DEFAULT_HASH_WORKERS})'
+    )
+    sync_dir.add_argument(
+        '--hash-index',
+        default=str(SYNC_HASH_INDEX_FILE),
+        help=f'Path of the local index of file hashes from earlier syncs (default: {SYNC_HASH_INDEX_FILE.name} next to this script)'
+    )
+    sync_dir.add_argument(
+        '--dry-run',
         action='store_true',
-        help='List all session files in Azure Storage'
+        help='List the files that would be uploaded without uploading them'
     )
+    _add_upload_options(sync_dir)
+    _add_common_options(sync_dir)
     
-    args = parser.parse_args()
+    mirror = commands.add_parser(
+        'mirror',
+        help='Mirror the container and its CDN transforms into a local directory for offline Jekyll builds'
+    )
+    mirror.add_argument(
+        '--mirror-dir',
+        default=str(MIRROR_DIR),
+        help=f'Directory to mirror into (default: {MIRROR_DIR.name}/ next to this script)'
+    )
+    mirror.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_MIRROR_WORKERS,
+        help=f'Blobs downloaded concurrently (default: {DEFAULT_MIRROR_WORKERS})'
+    )
+    mirror.add_argument(
+        '--processes',
+        type=int,
+        help='Worker processes rendering transforms (default: CPU count)'
+    )
+    _add_common_options(mirror)
     
-    # Load Azure configuration
-    azure_config = load_azure_config()
-    
-    # List sessions mode
-    if args.list_sessions:
-        session_files = list_metadata_files_from_azure(azure_config)
-        session_files = [f for f in session_files if f.startswith('picker-session-')]
-        if not session_files:
-            logger.info("No session files found in Azure Storage")
-            return
-        logger.info("\nPicker session files in Azure Storage:")
-        for i, blob_name in enumerate(session_files, 1):
-            logger.info(f"  {i}. {blob_name}")
-        return
+    feed = commands.add_parser(
+        'feed',
+        help='Rewrite the paged JSON feed behind the /photos/ grid (no Azure access needed)'
+    )
+    feed.add_argument(
+        '--posts-dir',
+        default=str(POSTS_DIR),
+        help=f'Directory the photo-page posts are read from (default: the site\'s {POSTS_DIR.name}/)'
+    )
     
-    # Determine session ID and access token
-    session_id = None
-    access_token = None
-    custom_filename = None
-    
-    if args.session_id:
-        session_id = args.session_id
-        # No access token available, will need credentials
-        creds = get_google_credentials()
-    elif args.session_file:
-        # Read session ID and access token from file
-        metadata = download_metadata_from_azure(args.session_file, azure_config)
-        if metadata:
-            session_id = metadata.get('sessionId')
-            access_token = metadata.get('accessToken')
-            custom_filename = metadata.get('customFilename')  # Extract custom filename
-            if not session_id:
-                logger.error(f"No sessionId found in {args.session_file}")
-                sys.exit(1)
-            if not access_token:
-                logger.error(f"No accessToken found in {args.session_file}")
-                sys.exit(1)
-            logger.info("Found access token in session file - will use it instead of credentials")
-            if custom_filename:
-                logger.info(f"Found custom filename in session file: {custom_filename}")
-        else:
-            sys.exit(1)
-        creds = None  # Don't need credentials when we have access token
-    else:
-        logger.error("Please provide either --session-id or --session-file")
-        logger.info("Use --list-sessions to see available session files")
-        sys.exit(1)
+    return parser
+
+
+# Flag-style modes from before subcommands, mapped onto them
+LEGACY_MODE_FLAGS = {
+    '--refresh-catalog': 'refresh-catalog',
+    '--list-sessions': 'list-sessions',
+    '--watch': 'watch',
+    '--all-pending': 'all-pending',
+    '--session-id': 'process',
+    '--session-file': 'process',
+}
+COMMANDS = {'process', 'all-pending', 'watch', 'list-sessions', 'refresh-catalog', 'sprites', 'sync-dir', 'mirror', 'feed'}
+
+
+def _legacy_argv(argv: List[str]) -> List[str]:
+    """Rewrite an old flag-style command line as the equivalent subcommand."""
+    if not argv or argv[0] in COMMANDS or argv[0] in ('-h', '--help'):
+        return argv
+    for i, arg in enumerate(argv):
+        command = LEGACY_MODE_FLAGS.get(arg.split('=', 1)[0])
+        if command == 'process':
+            return [command] + argv
+        if command:
+            return [command] + argv[:i] + argv[i + 1:]
+    return argv
+
+
+def _session_options(args: argparse.Namespace, journal: SessionJournal, rendition_pool) -> Dict:
+    return {
+        'workers': args.workers,
+        'max_inflight_bytes': args.max_inflight_mb * 1024 * 1024,
+        'chunk_size': args.chunk_mb * 1024 * 1024,
+        'upload_mode': args.upload_mode,
+        'resume': args.resume,
+        'range_parts': args.range_parts,
+        'range_min_size': args.range_min_mb * 1024 * 1024,
+        'journal': journal,
+        'rendition_pool': rendition_pool,
+        'posts_dir': Path(args.posts_dir) if args.posts else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point for the script."""
+    parser = build_parser()
+    args = parser.parse_args(_legacy_argv(sys.argv[1:] if argv is None else argv))
+    if getattr(args, 'workers', 1) < 1:
+        parser.error('--workers must be at least 1')
+    if getattr(args, 'session_workers', 1) < 1:
+        parser.error('--session-workers must be at least 1')
+    if getattr(args, 'poll_interval', 1) <= 0:
+        parser.error('--poll-interval must be positive')
+    if getattr(args, 'chunk_mb', 1) < 1:
+        parser.error('--chunk-mb must be at least 1')
+    if getattr(args, 'range_parts', 1) < 1:
+        parser.error('--range-parts must be at least 1')
+    if getattr(args, 'cache_mb', 0) < 0:
+        parser.error('--cache-mb must not be negative')
+    if getattr(args, 'hash_workers', 1) < 1:
+        parser.error('--hash-workers must be at least 1')
+    if args.command == 'sync-dir' and not Path(args.directory).is_dir():
+        parser.error(f'{args.directory} is not a directory')
     
-    # Process the session
-    logger.info(f"Processing Picker session: {session_id}")
+    # The feed is built from the posts and _data/ alone
+    if args.command == 'feed':
+        if not build_photo_feed(Path(args.posts_dir)):
+            sys.exit(1)
+        return
     
-    if access_token:
-        # Use the access token from the session file
-        success = process_picker_session_with_token(session_id, access_token, azure_config, custom_filename)
-    else:
-        # Use credentials (requires valid token.json)
-        success = process_picker_session(session_id, azure_config, creds)
+    # Load Azure configuration
+    azure_config = load_azure_config(Path(args.azure_config))
     
-    if success:
-        logger.info("\n✓ Successfully processed Picker session")
-    else:
-        logger.error("\n✗ Failed to process Picker session")
-        sys.exit(1)
+    # One pooled set of HTTP/Azure clients for the whole run
+    concurrency = getattr(args, 'workers', 1) * getattr(args, 'session_workers', 1)
+    pool_size = args.pool_size or max(DEFAULT_POOL_SIZE, concurrency)
+    metrics_path = Path(args.metrics_out) if args.metrics_out else None
+    with profiling(args.profile, metrics_path), \
+            ClientContext(azure_config, pool_size) as clients, \
+            metrics_report(clients, metrics_path), \
+            BlobCatalog(Path(args.catalog)) as catalog:
+        clients.catalog = catalog
+        
+        if args.command == 'refresh-catalog':
+            catalog.refresh(clients.container_client, args.prefix)
+            logger.info(f"Catalog has {len(catalog.names(args.prefix))} blob(s) under '{args.prefix}'")
+            return
+        
+        if args.command == 'list-sessions':
+            session_files = list_metadata_files_from_azure(clients, SESSION_PREFIX)
+            if not session_files:
+                logger.info("No session files found in Azure Storage")
+                return
+            logger.info("\nPicker session files in Azure Storage:")
+            for i, blob_name in enumerate(session_files, 1):
+                logger.info(f"  {i}. {blob_name}")
+            return
+        
+        if args.command == 'sprites':
+            with create_rendition_pool(args.processes) as pool:
+                if not build_sprite_sheets(clients, pool, Path(args.posts_dir), workers=args.workers):
+                    sys.exit(1)
+            # Sprite cells moved, so the feed entries did too
+            if not build_photo_feed(Path(args.posts_dir)):
+                sys.exit(1)
+            return
+        
+        if args.command == 'mirror':
+            with create_rendition_pool(args.processes) as pool:
+                if not mirror_container(clients, pool, Path(args.mirror_dir), args.workers):
+                    sys.exit(1)
+            return
+        
+        if args.command == 'sync-dir':
+            with FileHashIndex(Path(args.hash_index)) as hash_index, \
+                    create_rendition_pool(args.rendition_processes) if args.renditions else contextlib.nullcontext() as rendition_pool:
+                if not sync_directory(
+                    Path(args.directory), clients, hash_index, args.prefix, args.hash_workers, args.dry_run,
+                    workers=args.workers,
+                    chunk_size=args.chunk_mb * 1024 * 1024,
+                    upload_mode=args.upload_mode,
+                    rendition_pool=rendition_pool,
+                    posts_dir=Path(args.posts_dir) if args.posts else None
+                ):
+                    sys.exit(1)
+            return
+        
+        with SessionJournal(Path(args.journal)) as journal, \
+                OriginalsCache(Path(args.cache_dir), args.cache_mb * 1024 * 1024) if args.cache_mb else contextlib.nullcontext() as originals, \
+                create_rendition_pool(args.rendition_processes) if args.renditions else contextlib.nullcontext() as rendition_pool:
+            clients.originals = originals
+            session_options = _session_options(args, journal, rendition_pool)
+            
+            # Stay up and ingest sessions as they land
+            if args.command == 'watch':
+                # Stop cleanly on SIGTERM (service managers) as well as Ctrl+C
+                stop = threading.Event()
+                signal.signal(signal.SIGTERM, lambda *_: stop.set())
+                watch_sessions(
+                    clients, args.session_workers, args.poll_interval,
+                    stop=stop, metrics_path=metrics_path, **session_options
+                )
+                return
+            
+            # Drain every pending session
+            if args.command == 'all-pending':
+                if process_all_pending_sessions(clients, args.session_workers, **session_options):
+                    logger.info("\n✓ Successfully processed all pending Picker sessions")
+                else:
+                    logger.error("\n✗ One or more Picker sessions failed")
+                    sys.exit(1)
+                return
+            
+            if args.session_id:
+                # No access token available, will need credentials (requires valid token.json)
+                creds = get_google_credentials()
+                logger.info(f"Processing Picker session: {args.session_id}")
+                success = process_picker_session(args.session_id, clients, creds, **session_options)
+            else:
+                # Use the access token from the session file
+                success = process_session_file(args.session_file, clients, **session_options)
+            
+            if success:
+                logger.info("\n✓ Successfully processed Picker session")
+            else:
+                logger.error("\n✗ Failed to process Picker session")
+                sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the pure helpers in process_picker_metadata.py
+
+Covers the legacy command-line translation, the blob catalog's prefix
+refresh, the adaptive rate controller, feed paging and post front-matter
+rewriting. No Google or Azure account is needed; the catalog tests use an
+in-memory stand-in for the container client.
+
+Usage:
+    python -m unittest test_process_picker_metadata    # from tools/
+"""
+
+import json
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from azure.storage.blob import BlobPrefix
+
+import process_picker_metadata as picker
+
+logging.disable(logging.CRITICAL)
+
+
+class FakeContainerClient:
+    """Just enough of ContainerClient for BlobCatalog.refresh: flat and delimited listings."""
+    
+    def __init__(self, blobs: dict):
+        self.blobs = blobs
+        self.listed = []
+    
+    def _blob(self, name: str) -> SimpleNamespace:
+        return SimpleNamespace(
+            name=name, size=len(name), etag=self.blobs[name],
+            content_settings=None, metadata={}, last_modified=None
+        )
+    
+    def list_blobs(self, name_starts_with=None, include=None):
+        self.listed.append(name_starts_with)
+        return [self._blob(name) for name in sorted(self.blobs) if name.startswith(name_starts_with or '')]
+    
+    def walk_blobs(self, name_starts_with=None, include=None, delimiter='/'):
+        prefix = name_starts_with or ''
+        seen = set()
+        for name in sorted(self.blobs):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter in rest:
+                subdir = prefix + rest[:rest.index(delimiter) + 1]
+                if subdir not in seen:
+                    seen.add(subdir)
+                    yield BlobPrefix(prefix=subdir)
+            else:
+                yield self._blob(name)
+
+
+class LegacyArgvTests(unittest.TestCase):
+
+    def test_subcommands_pass_through(self):
+        for argv in ([], ['watch', '--poll-interval', '5'], ['--help'], ['-h'], ['feed']):
+            self.assertEqual(picker._legacy_argv(argv), argv)
+    
+    def test_mode_flag_becomes_subcommand(self):
+        self.assertEqual(
+            picker._legacy_argv(['--workers', '4', '--watch', '--poll-interval', '5']),
+            ['watch', '--workers', '4', '--poll-interval', '5']
+        )
+        self.assertEqual(picker._legacy_argv(['--list-sessions']), ['list-sessions'])
+    
+    def test_session_flags_keep_their_value(self):
+        self.assertEqual(
+            picker._legacy_argv(['--session-id', 'abc123', '--workers', '2']),
+            ['process', '--session-id', 'abc123', '--workers', '2']
+        )
+        self.assertEqual(
+            picker._legacy_argv(['--session-file=picker-session-1.json']),
+            ['process', '--session-file=picker-session-1.json']
+        )
+    
+    def test_unknown_flags_are_left_to_argparse(self):
+        self.assertEqual(picker._legacy_argv(['--bogus']), ['--bogus'])
+    
+    def test_translated_command_line_parses(self):
+        args = picker.build_parser().parse_args(picker._legacy_argv(['--all-pending', '--workers', '3']))
+        self.assertEqual(args.command, 'all-pending')
+        self.assertEqual(args.workers, 3)
+
+
+class BlobCatalogRefreshTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.catalog = picker.BlobCatalog(Path(self.tmp.name) / 'catalog.sqlite3')
+    
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp.cleanup()
+    
+    def test_prefix_refresh_only_touches_the_prefix(self):
+        self.catalog.record('picker-session-a.json', etag='1')
+        self.catalog.record('picker-session-gone.json', etag='1')
+        self.catalog.record('photo.jpg', etag='1')
+        client = FakeContainerClient({
+            'picker-session-a.json': '2',
+            'picker-session-b.json': '1',
+            'picker-sessions.txt': '1',
+        })
+        
+        self.assertEqual(self.catalog.refresh(client, 'picker-session-'), (2, 1))
+        self.assertEqual(client.listed, ['picker-session-'])
+        self.assertEqual(self.catalog.names('picker-session-'), ['picker-session-a.json', 'picker-session-b.json'])
+        self.assertEqual(self.catalog.get('picker-session-a.json')['etag'], '2')
+        self.assertIsNotNone(self.catalog.get('photo.jpg'))
+        self.assertIsNone(self.catalog.get('picker-sessions.txt'))
+    
+    def test_unchanged_listing_rewrites_nothing(self):
+        client = FakeContainerClient({'picker-session-a.json': '1', 'picker-session-b.json': '1'})
+        self.catalog.refresh(client, 'picker-session-')
+        self.assertEqual(self.catalog.refresh(client, 'picker-session-'), (0, 0))
+    
+    def test_empty_prefix_covers_the_whole_container(self):
+        self.catalog.record('stale.jpg', etag='1')
+        client = FakeContainerClient({'a.jpg': '1', 'processed/b.json': '1'})
+        self.assertEqual(self.catalog.refresh(client), (2, 1))
+        self.assertEqual(client.listed, [None])
+        self.assertEqual(self.catalog.names(), ['a.jpg', 'processed/b.json'])
+    
+    def test_skip_and_subdirs_leave_other_rows_alone(self):
+        for name in ('renditions/old.webp', 'thumbs/old.jpg', 'other/old.jpg', 'gone.jpg'):
+            self.catalog.record(name, etag='1')
+        client = FakeContainerClient({
+            'top.jpg': '1',
+            'renditions/new.webp': '1',
+            'thumbs/new.jpg': '1',
+            'other/new.jpg': '1',
+        })
+        
+        added, removed = self.catalog.refresh(client, skip=('thumbs/',), subdirs=['renditions/'])
+        self.assertEqual((added, removed), (2, 2))
+        self.assertEqual(
+            self.catalog.names(),
+            ['other/old.jpg', 'renditions/new.webp', 'thumbs/old.jpg', 'top.jpg']
+        )
+    
+    def test_prefix_ending_in_the_last_code_point(self):
+        last = chr(0x10FFFF)
+        for name in (f'a{last}', f'a{last}1', 'a\uffff', 'b'):
+            self.catalog.record(name, etag='1')
+        self.assertEqual(self.catalog.names(f'a{last}'), [f'a{last}', f'a{last}1'])
+        self.assertEqual(self.catalog.names('a'), ['a\uffff', f'a{last}', f'a{last}1'])
+        self.assertEqual(picker._prefix_condition(last), ('name >= ?', (last,)))
+        self.assertEqual(picker._prefix_condition('a\ud7ff')[1], ('a\ud7ff', 'a\ue000'))
+
+
+class RateControllerTests(unittest.TestCase):
+
+    def test_success_grows_the_limit_additively_up_to_the_pool_size(self):
+        limiter = picker.RateController('test', 8)
+        limiter.limit = 4.0
+        limiter.on_success()
+        self.assertAlmostEqual(limiter.limit, 4.25)
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(limiter.limit, 8)
+    
+    def test_throttle_halves_the_limit_once_per_pause(self):
+        limiter = picker.RateController('test', 8)
+        self.assertEqual(limiter.on_throttle(60), 60)
+        self.assertEqual(limiter.on_throttle(60), 60)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.throttled, 2)
+        
+        limiter._paused_until = 0.0
+        limiter.on_throttle(60)
+        self.assertEqual(limiter.limit, 2)
+    
+    def test_limit_never_drops_below_one(self):
+        limiter = picker.RateController('test', 2)
+        for _ in range(5):
+            limiter._paused_until = 0.0
+            limiter.on_throttle(0)
+        self.assertEqual(limiter.limit, 1)
+    
+    def test_throttle_without_retry_after_backs_off(self):
+        limiter = picker.RateController('test', 4)
+        delay = limiter.on_throttle(None)
+        self.assertGreaterEqual(delay, 0)
+        self.assertLessEqual(delay, picker.BACKOFF_BASE_SECONDS)
+    
+    def test_slots_follow_the_limit(self):
+        limiter = picker.RateController('test', 2)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(limiter._in_flight, 2)
+        limiter.release()
+        limiter.limit = 1.0
+        limiter.release()
+        limiter.acquire()
+        self.assertEqual(limiter._in_flight, 1)
+
+
+def _write_post(posts_dir: Path, name: str, front_matter: str, body: str = 'Body text.\n') -> Path:
+    path = posts_dir / name
+    path.write_text(f"---\n{front_matter}\n---\n{body}", encoding='utf-8')
+    return path
+
+
+class PhotoFeedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        self.posts_dir = root / '_posts'
+        self.feed_dir = root / 'assets' / 'feeds'
+        self.index_file = root / '_data' / 'photo_feed.json'
+        self.posts_dir.mkdir()
+        for name in ('SITE_DIR', 'RENDITION_MANIFEST_FILE', 'ALIAS_MANIFEST_FILE', 'SPRITE_MAP_FILE'):
+            value = root if name == 'SITE_DIR' else root / '_data' / f"{name.lower()}.json"
+            patcher = mock.patch.object(picker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _add_photos(self, count: int, start: int = 0) -> None:
+        for i in range(start, start + count):
+            _write_post(
+                self.posts_dir, f"2024-{i // 28 + 1:02d}-{i % 28 + 1:02d}-photo-{i:03d}.md",
+                f'layout: photo-page\ntitle: "Photo {i}"\nphoto: photo-{i:03d}.jpg'
+            )
+    
+    def _build(self) -> dict:
+        self.assertTrue(picker.build_photo_feed(self.posts_dir, self.feed_dir, self.index_file))
+        return json.loads(self.index_file.read_text())
+    
+    def test_pages_hold_page_size_entries_newest_first(self):
+        size = picker.FEED_PAGE_SIZE
+        self._add_photos(size + 5)
+        index = self._build()
+        
+        self.assertEqual(index['total'], size + 5)
+        self.assertEqual(len(index['pages']), 2)
+        self.assertEqual(index['first'][0]['title'], f"Photo {size + 4}")
+        pages = [json.loads((self.feed_dir / Path(page).name).read_text())['photos'] for page in index['pages']]
+        self.assertEqual(pages[0], index['first'])
+        self.assertEqual([len(page) for page in pages], [size, 5])
+        self.assertEqual(pages[1][-1]['title'], 'Photo 0')
+        self.assertTrue(all(page.startswith('/assets/feeds/photos-') for page in index['pages']))
+    
+    def test_unchanged_pages_keep_their_file_and_stale_pages_are_removed(self):
+        size = picker.FEED_PAGE_SIZE
+        self._add_photos(size * 2)
+        first = self._build()['pages']
+        
+        # Posts are listed newest first, so a new photo reshuffles both pages
+        self._add_photos(1, start=size * 2)
+        second = self._build()['pages']
+        self.assertEqual(len(second), 3)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(sorted(path.name for path in self.feed_dir.glob('photos-*.json')),
+                         sorted(Path(page).name for page in second))
+        
+        self.assertEqual(self._build()['pages'], second)
+    
+    def test_empty_feed(self):
+        index = self._build()
+        self.assertEqual((index['total'], index['pages'], index['first']), (0, [], []))
+    
+    def test_unpublished_and_other_posts_are_left_out(self):
+        self._add_photos(1)
+        _write_post(self.posts_dir, '2024-02-01-draft.md', 'layout: photo-page\nphoto: draft.jpg\npublished: false')
+        _write_post(self.posts_dir, '2024-02-02-essay.md', 'layout: post\ntitle: Essay')
+        self.assertEqual(self._build()['total'], 1)
+
+
+class FrontMatterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.posts_dir = Path(self.tmp.name)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_split_front_matter(self):
+        self.assertEqual(picker._split_front_matter('---\na: 1\nb: 2\n---\nbody\n'), (['a: 1', 'b: 2'], 'body\n'))
+        self.assertEqual(picker._split_front_matter('no front matter\n'), ([], 'no front matter\n'))
+        self.assertEqual(picker._split_front_matter('---\nunterminated\n'), ([], '---\nunterminated\n'))
+    
+    def test_front_matter_value_quotes_only_when_needed(self):
+        self.assertEqual(picker._front_matter_value('photo-1.jpg'), 'photo-1.jpg')
+        self.assertEqual(picker._front_matter_value('a: b'), '"a: b"')
+        self.assertEqual(picker._front_matter_value(640), '640')
+    
+    def test_existing_post_keeps_its_fields_and_body(self):
+        path = _write_post(
+            self.posts_dir, '2023-05-01-harbour.md',
+            'layout: photo-page\ntitle: "Harbour: at dusk"\nphoto: "harbour.jpg"\nwidth: 10\nexcerpt: "Boats"',
+            'Written by hand.\n\nSecond paragraph.\n'
+        )
+        result = picker.write_photo_post('harbour.jpg', {'width': 4000, 'height': 3000, 'lqip': None}, self.posts_dir)
+        
+        self.assertEqual(result, path)
+        self.assertEqual(
+            path.read_text(encoding='utf-8'),
+            '---\nlayout: photo-page\ntitle: "Harbour: at dusk"\nphoto: "harbour.jpg"\nwidth: 4000\n'
+            'excerpt: "Boats"\nheight: 3000\n---\nWritten by hand.\n\nSecond paragraph.\n'
+        )
+        self.assertEqual(list(self.posts_dir.iterdir()), [path])
+    
+    def test_new_post_gets_a_title_and_a_free_name(self):
+        analysis = {'width': 800, 'height': 600, 'taken': None}
+        first = picker.write_photo_post('Night_sky-01.jpg', analysis, self.posts_dir, taken='2024-06-01T21:00:00Z')
+        second = picker.write_photo_post('night sky 01.png', analysis, self.posts_dir)
+        
+        self.assertTrue(first.name.endswith('-night-sky-01.md'))
+        self.assertTrue(second.name.endswith('-night-sky-01-2.md'))
+        lines, rest = picker._split_front_matter(first.read_text(encoding='utf-8'))
+        self.assertIn('title: "Night Sky 01"', lines)
+        self.assertIn('photo: Night_sky-01.jpg', lines)
+        self.assertIn('taken: "2024-06-01T21:00:00Z"', lines)
+        self.assertEqual(lines[-2:], ['excerpt: ""', 'published: true'])
+        self.assertEqual(rest, '\n')
+        self.assertEqual(picker.find_photo_post('Night_sky-01.jpg', self.posts_dir), first)
+
+
+if __name__ == '__main__':
+    unittest.main()